@@ -1,4 +1,5 @@
 import logging
+from typing import Optional
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
@@ -7,6 +8,9 @@ from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy import select, func
 from database import get_session, Product, Category, CartItem, User
 from config import settings
+from catalog_cache import catalog_cache, product_to_dict
+from availability import availability_rules, available_value, min_stock
+from outbound import outbound, PRIORITY_ADMIN
 from keyboards import admin_main_keyboard, admin_categories_keyboard, admin_products_keyboard, admin_product_management_keyboard
 
 logger = logging.getLogger(__name__)
@@ -18,6 +22,35 @@ async def is_admin(user_id: int) -> bool:
     return user_id == settings.admin_id
 
 
+async def received_image(message: Message) -> Optional[str]:
+    """
+    Изображение из ответа админа: фото (file_id), картинка файлом (уменьшается
+    и загружается как фото) или ссылка (загружается сразу, file_id - в кэше).
+    None - в сообщении нет изображения; ошибки загрузки - исключением.
+    """
+    from images import image_pipeline, is_remote
+
+    if message.photo:
+        return message.photo[-1].file_id
+    document = message.document
+    if document and (document.mime_type or "").startswith("image/"):
+        return await image_pipeline.ingest_file(message.bot, document.file_id, message.chat.id)
+    url = (message.text or "").strip()
+    if is_remote(url):
+        await image_pipeline.ingest_url(message.bot, url, message.chat.id, notify=True)
+        return url
+    return None
+
+
+def apply_availability(product: Product) -> None:
+    """Пересчитать available товара после изменения остатка (правила - в availability.py)"""
+    available = available_value(product_to_dict(product))
+    if available != product.available:
+        product.available = available
+        state = "возвращен в доступность" if available else "скрыт"
+        logger.info(f"Товар {product.name} (ID: {product.id}) {state}: остаток {product.stock_grams}")
+
+
 async def check_and_notify_out_of_stock(bot, product_id, product_name, ordering_user_id=None):
     """Заглушка для функции уведомления о закончившемся товаре"""
     logger = logging.getLogger(__name__)
@@ -47,6 +80,7 @@ class AdminStates(StatesGroup):
     waiting_edit_confirm_category = State()
     waiting_edit_final_save = State()
     waiting_edit_value = State()
+    waiting_import_file = State()
 
 
 
@@ -58,7 +92,12 @@ async def admin_panel(message: Message):
         await message.answer("❌ Доступ запрещен")
         return
     await message.answer(
-            "👑 Панель администратора Barkery Shop\n\n\n"
+            "👑 Панель администратора Barkery Shop\n\n"
+            "📥 /import - загрузить каталог из CSV/XLSX\n"
+            "📤 /export - выгрузить каталог с остатками\n"
+            "🖼 /warm_images - заранее загрузить фото каталога в Telegram\n"
+            "⏱ /perf - самые медленные операции\n"
+            "🗄 /perf_updates - запросы к БД и время API по экранам\n\n"
             "Выберите действие:",
         reply_markup=admin_main_keyboard()
     )
@@ -126,6 +165,7 @@ async def process_category_name(message: Message, state: FSMContext):
         session.add(category)
         await session.commit()
         await session.refresh(category)
+        await catalog_cache.reload()
         await message.answer(f"✅ Категория '{category_name}' успешно создана! ID: {category.id}")
         await state.clear()
         # Возвращаем к списку категорий
@@ -184,6 +224,7 @@ async def process_edit_category_name(message: Message, state: FSMContext):
         old_name = category.name
         category.name = new_name
         await session.commit()
+        await catalog_cache.reload()
         await message.answer(f"✅ Категория переименована: {old_name} → {new_name}")
         # Возвращаем к списку категорий
         stmt = select(Category).order_by(Category.name)
@@ -222,6 +263,7 @@ async def admin_delete_category_handler(callback: CallbackQuery):
         # Удаляем категорию
         await session.delete(category)
         await session.commit()
+        await catalog_cache.reload()
         await callback.answer(f"✅ Категория '{category.name}' удалена")
         # Обновляем список категорий
         stmt = select(Category).order_by(Category.name)
@@ -433,7 +475,7 @@ async def process_product_stock_create(message: Message, state: FSMContext):
         await message.answer(
             f"✅ Количество принято: {stock} {unit_text}\n"
             f"✅ Единицы измерения: {unit_text} (шаг: {measurement_step})\n\n"
-            "Шаг 5 из 6: Загрузите изображение товара.\n"
+            "Шаг 5 из 6: Загрузите изображение товара (фото, файл или ссылку).\n"
             "Или отправьте 'пропустить' если без изображения:"
         )
     except ValueError:
@@ -447,13 +489,17 @@ async def process_product_image(message: Message, state: FSMContext):
 
     if message.text and message.text.strip().lower() in ['пропустить', 'skip', 'без изображения']:
         await message.answer("✅ Пропускаем загрузку изображения")
-    elif message.photo:
-        # Используем file_id от телеграма
-        image_url = message.photo[-1].file_id
-        await message.answer(f"✅ Изображение получено")
     else:
-        await message.answer("❌ Пожалуйста, загрузите изображение или отправьте 'пропустить'")
-        return
+        try:
+            image_url = await received_image(message)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки изображения: {e}")
+            await message.answer(f"❌ Не удалось загрузить изображение: {e}\nПопробуйте еще раз:")
+            return
+        if image_url is None:
+            await message.answer("❌ Пожалуйста, загрузите изображение (фото, файл или ссылку) или отправьте 'пропустить'")
+            return
+        await message.answer(f"✅ Изображение получено")
 
     # Сохраняем URL изображения в состоянии
     await state.update_data(image_url=image_url)
@@ -653,6 +699,8 @@ async def process_product_hypoallergenic(message: Message, state: FSMContext):
             await session.commit()
             await session.refresh(product)
 
+        await catalog_cache.patch_product(product.id)
+
         # Формируем информативное сообщение
         category_info = data.get('category_name', f"ID: {data['category_id']}")
 
@@ -714,6 +762,7 @@ async def admin_toggle_hypoallergenic_handler(callback: CallbackQuery):
         new_status = not old_status
         product.is_hypoallergenic = new_status
         await session.commit()
+        catalog_cache.apply_product_fields(product_id, is_hypoallergenic=new_status)
 
         status_text = "гипоаллергенный" if new_status else "обычный"
         await callback.answer(f"✅ Товар теперь {status_text}")
@@ -780,25 +829,21 @@ async def admin_toggle_product_handler(callback: CallbackQuery):
         new_status = not old_status
 
         # Если ВКЛЮЧАЕМ товар, проверяем остатки
-        if new_status:
-            # Для весового товара: включаем только если >= 100г
-            if product.unit_type == 'grams' and product.stock_grams < 100:
-                await callback.answer(
-                    f"⚠️ Нельзя включить весовой товар. Остатки: {product.stock_grams}г (< 100г)",
-                    show_alert=True
-                )
-                return
-
-            # Для штучного товара: включаем только если >= 1шт
-            elif product.unit_type == 'pieces' and product.stock_grams < 1:
-                await callback.answer(
-                    f"⚠️ Нельзя включить штучный товар. Остатки: {product.stock_grams}шт (< 1шт)",
-                    show_alert=True
-                )
-                return
+        minimum = min_stock(product.unit_type)
+        if new_status and product.stock_grams < minimum:
+            if product.unit_type == 'grams':
+                kind, unit = "весовой", "г"
+            else:
+                kind, unit = "штучный", "шт"
+            await callback.answer(
+                f"⚠️ Нельзя включить {kind} товар. Остатки: {product.stock_grams}{unit} (< {minimum}{unit})",
+                show_alert=True
+            )
+            return
 
         product.available = new_status
         await session.commit()
+        catalog_cache.apply_product_fields(product_id, available=new_status)
 
         status_text = "включен" if new_status else "выключен"
         await callback.answer(f"✅ Товар '{product.name}' {status_text}")
@@ -1057,24 +1102,6 @@ async def process_edit_field(message: Message, state: FSMContext):
                     return
                 old_value = product.stock_grams
                 product.stock_grams = new_value
-
-                # Логика возврата товара в доступность при достаточных остатках
-                if not product.available:
-                    should_show = False
-                    if product.unit_type == 'grams':
-                        # Для весового: показываем если >= 100г
-                        if new_value >= 100:
-                            should_show = True
-                            reason = "остатки восстановлены до 100г и более"
-                    else:  # pieces
-                        # Для штучный: показываем если >= 1шт
-                        if new_value >= 1:
-                            should_show = True
-                            reason = "остатки восстановлены до 1шт и более"
-
-                    if should_show:
-                        product.available = True
-                        logger.info(f"Товар {product.name} (ID: {product.id}) возвращен в доступность: {reason}")
             elif field == 'price':
                 new_value = float(value)
                 if new_value <= 0:
@@ -1116,7 +1143,12 @@ async def process_edit_field(message: Message, state: FSMContext):
                 await state.clear()
                 return
 
+            if field in ('stock_grams', 'unit_type'):
+                # Остаток или его единицы изменились - доступность по общим правилам
+                apply_availability(product)
+
             await session.commit()
+            await catalog_cache.patch_product(product_id)
             await message.answer(f"✅ Товар обновлен: {field} = {value}")
 
             # Возвращаем к списку товаров
@@ -1272,7 +1304,7 @@ async def process_edit_step_response(message: Message, state: FSMContext):
             'price': "Введите новую цену (например: 750/шт или 500/гр):",
             'stock': f"Введите новое количество ({'грамм' if data.get('product_unit_type', 'grams') == 'grams' else 'штук'}):",
             'unit_type': "Выберите единицы: 1 - граммы, 2 - штуки:",
-            'image': "Загрузите новое изображение или отправьте 'пропустить':",
+            'image': "Загрузите новое изображение (фото, файл или ссылку) или отправьте 'пропустить':",
             'category': "Введите ID новой категории:"
         }
 
@@ -1394,21 +1426,21 @@ async def process_edit_unit_type_value(message: Message, state: FSMContext):
 @admin_router.message(AdminStates.waiting_edit_confirm_image)
 async def process_edit_image_value(message: Message, state: FSMContext):
     """Обработка нового изображения - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
-    # Проверяем что есть либо текст, либо фото
-    if message.text:
-        text = message.text.strip().lower()
-        if text in ['пропустить', 'skip', 'без изображения']:
-            new_value = None
-            await message.answer("✅ Изображение удалено")
-        else:
-            await message.answer("❌ Для пропуска отправьте 'пропустить', или загрузите изображение")
+    # Проверяем что есть либо текст, либо изображение
+    if message.text and message.text.strip().lower() in ['пропустить', 'skip', 'без изображения']:
+        new_value = None
+        await message.answer("✅ Изображение удалено")
+    else:
+        try:
+            new_value = await received_image(message)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки изображения: {e}")
+            await message.answer(f"❌ Не удалось загрузить изображение: {e}\nПопробуйте еще раз:")
+            return
+        if new_value is None:
+            await message.answer("❌ Загрузите изображение (фото, файл или ссылку) или отправьте 'пропустить'")
             return
-    elif message.photo:
-        new_value = message.photo[-1].file_id
         await message.answer("✅ Изображение получено")
-    else:
-        await message.answer("❌ Пожалуйста, загрузите изображение или отправьте 'пропустить'")
-        return
 
     data = await state.get_data()
     changes = data.get('edit_changes', {})
@@ -1466,13 +1498,11 @@ async def save_product_changes(callback_or_message, state: FSMContext):
                     setattr(product, field, value)
 
             # Автоматически обновляем доступность при изменении остатков
-            if 'stock_grams' in changes:
-                if product.unit_type == 'grams':
-                    product.available = product.stock_grams >= 100
-                else:  # pieces
-                    product.available = product.stock_grams >= 1
+            if changes.keys() & {'stock_grams', 'unit_type', 'hide_when_zero'}:
+                apply_availability(product)
 
             await session.commit()
+            await catalog_cache.patch_product(product_id)
 
             # Показываем результат
             changes_list = "\n".join([f"• {k}: {v}" for k, v in changes.items()])
@@ -1574,6 +1604,25 @@ async def admin_statistics_handler(callback: CallbackQuery):
             f"📈 Средний чек: {stats.get('avg_order_value', 0):.0f} RSD"
         )
 
+        periods = [("Сегодня", "today"), ("7 дней", "week"), ("30 дней", "month")]
+        if all(key in stats for _, key in periods):
+            stats_text += "\n\n🗓 ПО ПЕРИОДАМ\n"
+            for title, key in periods:
+                period = stats[key]
+                stats_text += (
+                    f"• {title}: {period['orders']} заказов, {period['revenue']:.0f} RSD, "
+                    f"средний чек {period['avg_order_value']:.0f} RSD\n"
+                )
+
+        if stats.get("top_products"):
+            stats_text += "\n🏆 ТОП ТОВАРОВ ЗА 30 ДНЕЙ\n"
+            for i, product in enumerate(stats["top_products"], 1):
+                unit = {"grams": "г", "pieces": "шт"}.get(product["unit_type"], "")
+                stats_text += (
+                    f"{i}. {product['product_name']} - {product['revenue']:.0f} RSD "
+                    f"({product['units']}{unit})\n"
+                )
+
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_statistics")],
             [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_back")]
@@ -1603,6 +1652,83 @@ async def admin_statistics_handler(callback: CallbackQuery):
         # Вместо показа alert, просто отвечаем что статистика обновлена
         await callback.answer("📊 Статистика обновлена")
 
+@admin_router.message(Command("rebuild_stats"))
+async def admin_rebuild_stats(message: Message):
+    """Пересобрать сводки продаж из заказов"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещен")
+        return
+
+    from statistics import statistics_service
+    result = await statistics_service.rebuild()
+    if result["success"]:
+        await message.answer(
+            f"✅ Сводки продаж пересобраны\n\n"
+            f"🗓 Дней: {result['days']}\n"
+            f"📦 Строк по товарам: {result['product_rows']}"
+        )
+    else:
+        await message.answer(f"❌ Ошибка пересборки: {result['error']}")
+
+
+@admin_router.message(Command("perf"))
+async def admin_performance(message: Message):
+    """Самые медленные операции по p99: /perf - за последние минуты, /perf all - с запуска"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещен")
+        return
+
+    from logging_config import performance_monitor
+
+    window = "all" not in (message.text or "").split()[1:]
+    slowest = performance_monitor.slowest(limit=10, window=window)
+    if window:
+        title = f"за последние {int(performance_monitor.window_seconds // 60)} мин"
+    else:
+        title = "с момента запуска"
+
+    if not slowest:
+        await message.answer(f"⏱ Нет замеров {title}")
+        return
+
+    lines = [f"⏱ <b>Самые медленные операции {title}</b> (мс)\n"]
+    for name, stats in slowest:
+        lines.append(
+            f"<code>{name}</code>\n"
+            f"  n={stats['count']} p50={stats['p50_ms']} p90={stats['p90_ms']} "
+            f"p99={stats['p99_ms']} p999={stats['p999_ms']} max={stats['max_time_seconds'] * 1000:.0f}"
+            + (f" ошибок={stats['errors']}" if stats.get("errors") else "")
+        )
+    if window:
+        lines.append("\n/perf all - с момента запуска")
+    await message.answer("\n".join(lines))
+
+
+@admin_router.message(Command("perf_updates"))
+async def admin_update_performance(message: Message):
+    """Экраны с наибольшим числом запросов к БД: доля БД и Telegram API во времени апдейта"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещен")
+        return
+
+    from request_metrics import update_stats
+
+    rows = update_stats.report(limit=15)
+    if not rows:
+        await message.answer("🗄 Апдейтов еще не было")
+        return
+
+    lines = ["🗄 <b>Апдейты по числу запросов к БД</b> (с момента запуска)\n"]
+    for row in rows:
+        lines.append(
+            f"<code>{row['label']}</code>\n"
+            f"  n={row['count']} {row['avg_ms']} мс, "
+            f"запросов {row['avg_queries']} (max {row['max_queries']}), "
+            f"БД {row['db_share']}%, API {row['api_share']}% ({row['avg_api_calls']} выз.)"
+        )
+    await message.answer("\n".join(lines))
+
+
 @admin_router.callback_query(F.data == "admin_back")
 async def admin_back(callback: CallbackQuery):
     """Назад в главное меню админки"""
@@ -1645,6 +1771,8 @@ async def admin_delete_product_handler(callback: CallbackQuery):
         await session.delete(product)
         await session.commit()
 
+    await catalog_cache.patch_product(product_id)
+
     # 4. Результат
     await callback.answer(f"✅ УДАЛЕНО из БД: {product_name}", show_alert=True)
 
@@ -1666,44 +1794,20 @@ async def admin_refresh_catalog_handler(callback: CallbackQuery):
 
     category_id = int(callback.data.split(":")[1])
 
-    async with get_session() as session:
-        # Обновляем все товары категории по логике hide_when_zero
-        stmt = select(Product).where(Product.category_id == category_id)
-        result = await session.execute(stmt)
-        products = result.scalars().all()
-
-        updated_count = 0
-        for product in products:
-            old_status = product.available
-
-            # Применяем логику hide_when_zero
-            if product.unit_type == 'grams':
-                # Для весового: доступен если >= 100г
-                product.available = product.stock_grams >= 100
-            else:  # pieces
-                # Для штучного: доступен если >= 1шт
-                product.available = product.stock_grams >= 1
-
-            if old_status != product.available:
-                updated_count += 1
-                logger.info(f"Товар {product.name} обновлен: {old_status} -> {product.available}")
-
-        if updated_count > 0:
-            await session.commit()
+    # Пересчет по правилам hide_when_zero одним UPDATE
+    changed_ids = await availability_rules.refresh(category_id)
+    updated_count = len(changed_ids)
+    await catalog_cache.patch_products(changed_ids)
 
+    async with get_session() as session:
         # Возвращаем обновленный список
         category = await session.get(Category, category_id)
-        products_list = [
-            {
-                "id": p.id,
-                "name": p.name,
-                "price": p.price,
-                "stock_grams": p.stock_grams,
-                "available": p.available,
-                "unit_type": p.unit_type
-            }
-            for p in products
-        ]
+        result = await session.execute(
+            select(Product.id, Product.name, Product.price, Product.stock_grams,
+                   Product.available, Product.unit_type)
+            .where(Product.category_id == category_id)
+        )
+        products_list = [dict(row) for row in result.mappings()]
 
         try:
             await callback.message.edit_text(
@@ -1722,4 +1826,195 @@ async def admin_refresh_catalog_handler(callback: CallbackQuery):
                 reply_markup=admin_product_management_keyboard(products_list, category_id)
             )
 
-        await callback.answer(f"✅ Каталог обновлен. Изменено: {updated_count} товаров")
\ No newline at end of file
+        await callback.answer(f"✅ Каталог обновлен. Изменено: {updated_count} товаров")
+
+
+@admin_router.message(Command("refresh_catalog"))
+async def admin_refresh_all_catalog(message: Message):
+    """Пересчет доступности всех товаров по остаткам"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещен")
+        return
+
+    changed_ids = await availability_rules.refresh()
+    await catalog_cache.patch_products(changed_ids)
+    await message.answer(f"✅ Каталог обновлен. Изменено: {len(changed_ids)} товаров")
+
+
+@admin_router.message(Command("warm_images"))
+async def admin_warm_images(message: Message):
+    """Загрузить в Telegram фото каталога по URL, которых еще нет в кэше file_id"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещен")
+        return
+
+    from images import image_pipeline
+
+    async def report(result):
+        if not result["success"]:
+            text = f"❌ Ошибка загрузки фото: {result['error']}"
+        else:
+            lines = [
+                "✅ Фото каталога загружены",
+                "",
+                f"🖼 Фото по ссылкам: {result['total']}",
+                f"♻️ Уже были загружены: {result['cached']}",
+                f"⬆️ Загружено: {result['uploaded']}",
+                f"⚠️ Ошибок: {result['failed']}",
+                f"⏱ {result['seconds']:.0f} с"
+            ]
+            if result["errors"]:
+                lines += ["", "Первые ошибки:", *result["errors"]]
+            text = "\n".join(lines)
+        await outbound.send(message.chat.id, lambda: message.answer(text), priority=PRIORITY_ADMIN)
+
+    if image_pipeline.start_warm(message.bot, message.chat.id, report):
+        await message.answer("🖼 Загружаю фото каталога в Telegram, по окончании пришлю отчет")
+    else:
+        await message.answer("⏳ Фото уже загружаются, дождитесь отчета")
+
+
+# ========== МАССОВЫЙ ИМПОРТ И ЭКСПОРТ КАТАЛОГА ==========
+
+# Лимит Bot API на скачивание файлов
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
+
+@admin_router.message(Command("export"))
+async def admin_export_catalog(message: Message):
+    """Выгрузка каталога с остатками: /export или /export xlsx"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещен")
+        return
+
+    import os
+    import tempfile
+    from aiogram.types import FSInputFile
+    from catalog_io import catalog_io, export_filename
+
+    text = message.text or ""
+    extension = "xlsx" if "xlsx" in text.lower() else "csv"
+    fd, path = tempfile.mkstemp(suffix=f".{extension}")
+    os.close(fd)
+
+    try:
+        result = await catalog_io.export_file(path)
+        if not result["success"]:
+            await message.answer(f"❌ {result['error']}")
+            return
+
+        await message.answer_document(
+            FSInputFile(path, filename=export_filename(extension)),
+            caption=f"📤 Каталог: {result['products']} товаров\n"
+                    f"Отредактируйте файл и отправьте его с подписью /import"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка экспорта каталога: {e}")
+        await message.answer(f"❌ Ошибка экспорта: {str(e)}")
+    finally:
+        os.remove(path)
+
+
+@admin_router.message(Command("import"))
+async def admin_import_catalog(message: Message, state: FSMContext):
+    """Импорт каталога: файл с подписью /import или /import и затем файл"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ Доступ запрещен")
+        return
+
+    if message.document:
+        await state.clear()
+        await process_catalog_import(message)
+        return
+
+    await state.set_state(AdminStates.waiting_import_file)
+    await message.answer(
+        "📥 Отправьте файл каталога (CSV или XLSX).\n\n"
+        "Колонки: id;category;name;description;price;unit_type;stock;image_url;"
+        "available;is_active;hide_when_zero;is_hypoallergenic\n\n"
+        "• строка с id обновляет товар, без id - ищется по названию в категории или создается\n"
+        "• пустая ячейка - поле не меняется\n"
+        "• unit_type: grams или pieces, флаги: да/нет\n\n"
+        "Проще всего начать с выгрузки /export.\n"
+        "Для отмены отправьте 'отмена'."
+    )
+
+
+@admin_router.message(AdminStates.waiting_import_file)
+async def process_import_file(message: Message, state: FSMContext):
+    """Файл каталога после команды /import"""
+    if not message.document:
+        if (message.text or "").strip().lower() == "отмена":
+            await state.clear()
+            await message.answer("Импорт отменен", reply_markup=admin_main_keyboard())
+        else:
+            await message.answer("❌ Отправьте файл CSV или XLSX (или 'отмена'):")
+        return
+
+    await state.clear()
+    await process_catalog_import(message)
+
+
+async def process_catalog_import(message: Message):
+    """Скачать файл, импортировать каталог и отправить отчет"""
+    import os
+    import tempfile
+    from aiogram.types import FSInputFile
+    from catalog_io import catalog_io
+
+    document = message.document
+    file_name = (document.file_name or "").lower()
+    if not file_name.endswith((".csv", ".xlsx")):
+        await message.answer("❌ Поддерживаются только файлы .csv и .xlsx")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await message.answer("❌ Файл больше 20 МБ. Разделите его на части.")
+        return
+
+    status = await message.answer("⏳ Импорт каталога...")
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file_name)[1])
+    os.close(fd)
+    fd, report_path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+
+    try:
+        # Файл пишется на диск потоком, а не в память
+        await message.bot.download(document, destination=path)
+        result = await catalog_io.import_file(path, report_path)
+        if "rows" not in result:
+            await status.edit_text(f"❌ {result['error']}")
+            return
+
+        if result["created"] or result["updated"] or result["categories_created"]:
+            await catalog_cache.reload()
+
+        lines = [
+            "✅ Импорт завершен" if result["success"] else f"❌ Импорт прерван: {result['error']}",
+            "",
+            f"📄 Строк: {result['rows']}",
+            f"➕ Создано: {result['created']}",
+            f"✏️ Обновлено: {result['updated']}",
+            f"▫️ Без изменений: {result['unchanged']}",
+            f"📂 Новых категорий: {result['categories_created']}",
+            f"⚠️ Ошибок: {result['errors']}"
+        ]
+        if result.get("duration") is not None:
+            lines.append(f"⏱ {result['duration']} с")
+        if result["error_samples"]:
+            lines += ["", "Первые ошибки:", *result["error_samples"]]
+        await status.edit_text("\n".join(lines))
+
+        if result["created"] or result["updated"] or result["errors"]:
+            await message.answer_document(
+                FSInputFile(report_path, filename="import_report.csv"),
+                caption="📋 Отчет об изменениях"
+            )
+    except Exception as e:
+        logger.error(f"Ошибка импорта каталога: {e}")
+        import traceback
+        logger.error(f"Трассировка: {traceback.format_exc()}")
+        await status.edit_text(f"❌ Ошибка импорта: {str(e)}")
+    finally:
+        for file_path in (path, report_path):
+            if os.path.exists(file_path):
+                os.remove(file_path)
@@ -0,0 +1,121 @@
+"""
+Правила доступности товаров Barkery Shop
+
+Единственное место, где описано, когда товар скрывается по остаткам
+и когда снова показывается. Правило задано SQL-выражением: пересчет
+категории или всего каталога - один UPDATE ... CASE, списание остатков
+при заказе подставляет то же выражение в свой UPDATE, а фильтры
+каталога - в WHERE. Для данных, уже загруженных в память (кэш
+каталога, импорт), есть такие же проверки на Python.
+"""
+import logging
+from typing import Iterable, List, Mapping, Optional
+
+from sqlalchemy import and_, case, not_, or_, update
+
+from database import get_session, Product
+
+logger = logging.getLogger(__name__)
+
+# Минимальный остаток, при котором товар можно заказать
+MIN_STOCK = {'grams': 100, 'pieces': 1}
+
+
+def min_stock(unit_type: str) -> int:
+    return MIN_STOCK.get(unit_type, MIN_STOCK['pieces'])
+
+
+# ---------- SQL ----------
+
+def has_min_stock(stock=Product.stock_grams):
+    """Остаток не ниже минимума для единиц товара"""
+    return or_(*(
+        and_(Product.unit_type == unit_type, stock >= minimum)
+        for unit_type, minimum in MIN_STOCK.items()
+    ))
+
+
+def availability(stock=Product.stock_grams, restore: bool = True):
+    """
+    Новое значение products.available при остатке stock:
+    - остаток ниже минимума и включено hide_when_zero - товар скрывается;
+    - остаток не ниже минимума - товар показывается (только при restore:
+      пересчет каталога, пополнение; при продаже остаток только убывает);
+    - иначе available не меняется.
+    """
+    whens = [(and_(Product.hide_when_zero == True, not_(has_min_stock(stock))), False)]
+    if restore:
+        whens.append((has_min_stock(stock), True))
+    return case(*whens, else_=Product.available)
+
+
+def visible_clause():
+    """Товар виден покупателю (фильтр каталога)"""
+    return and_(
+        Product.available == True,
+        Product.is_active == True,
+        or_(Product.hide_when_zero == False, has_min_stock())
+    )
+
+
+# ---------- те же правила для данных в памяти ----------
+
+def has_min_stock_value(unit_type: str, stock: int) -> bool:
+    return unit_type in MIN_STOCK and stock >= MIN_STOCK[unit_type]
+
+
+def available_value(product: Mapping, stock: Optional[int] = None, restore: bool = True) -> bool:
+    """available для товара-словаря (колонки products) при остатке stock"""
+    stock = product["stock_grams"] if stock is None else stock
+    enough = has_min_stock_value(product["unit_type"], stock)
+    if product["hide_when_zero"] and not enough:
+        return False
+    if restore and enough:
+        return True
+    return product["available"]
+
+
+def is_visible_value(product: Mapping) -> bool:
+    if not product["available"] or not product["is_active"]:
+        return False
+    return not product["hide_when_zero"] or has_min_stock_value(product["unit_type"], product["stock_grams"])
+
+
+class AvailabilityRules:
+    """Пересчет доступности товаров по остаткам"""
+
+    async def apply(
+            self,
+            session,
+            category_id: Optional[int] = None,
+            product_ids: Optional[Iterable[int]] = None
+    ) -> List[int]:
+        """
+        Пересчитать available одним UPDATE в транзакции session.
+        Меняются только строки, где значение действительно другое; возвращает их id.
+        """
+        new_available = availability()
+        stmt = update(Product).where(Product.available != new_available)
+        if category_id is not None:
+            stmt = stmt.where(Product.category_id == category_id)
+        if product_ids is not None:
+            stmt = stmt.where(Product.id.in_(list(product_ids)))
+        stmt = (
+            stmt.values(available=new_available)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        )
+        return list((await session.execute(stmt)).scalars())
+
+    async def refresh(self, category_id: Optional[int] = None) -> List[int]:
+        """Пересчитать категорию (или весь каталог) и вернуть id измененных товаров"""
+        async with get_session() as session:
+            changed = await self.apply(session, category_id=category_id)
+
+        scope = f"категории {category_id}" if category_id is not None else "каталога"
+        logger.info(f"Доступность {scope} пересчитана, изменено товаров: {len(changed)}")
+        return changed
+
+
+# Глобальный экземпляр
+availability_rules = AvailabilityRules()
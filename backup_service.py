@@ -0,0 +1,272 @@
+"""
+Резервное копирование БД Barkery Shop
+
+Горячая копия через online backup API SQLite: страницы копируются
+порциями в отдельном потоке из зафиксированного снимка WAL, поэтому
+бот продолжает обрабатывать заказы. Копия сжимается потоково (gzip),
+старые копии удаляются по политике хранения: последние N ежедневных
+и по одной на неделю за последние M недель. Ночной запуск -
+APScheduler (04:00 по TIMEZONE).
+"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.engine import make_url
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = "barkery_"
+BACKUP_SUFFIX = ".db.gz"
+# Сколько раз копирование может начаться заново из-за записи в БД,
+# прежде чем переключиться на копирование за один проход
+MAX_BACKUP_RESTARTS = 5
+
+
+class BackupRestartLimit(Exception):
+    """Копирование слишком часто перезапускалось из-за записи в исходную БД"""
+
+
+class BackupManager:
+    """Горячие резервные копии SQLite с ротацией"""
+
+    def __init__(
+            self,
+            backup_dir: str = "./backups",
+            keep_daily: int = 7,
+            keep_weekly: int = 4,
+            pages_per_step: int = 1024,
+            step_sleep: float = 0.005
+    ):
+        self.backup_dir = backup_dir
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._lock = asyncio.Lock()
+        self._scheduler = None
+        self.last_result: Optional[Dict] = None
+
+    # ---------- путь к БД ----------
+
+    @staticmethod
+    def get_db_path() -> Optional[str]:
+        """Путь к файлу SQLite из DATABASE_URL (None - не файловая SQLite)"""
+        url = make_url(settings.database_url)
+        if not url.drivername.startswith("sqlite") or not url.database or url.database == ":memory:":
+            return None
+        return os.path.abspath(url.database)
+
+    # ---------- создание копии ----------
+
+    async def create_backup(self) -> Dict:
+        """Создать сжатую копию БД, не блокируя цикл событий"""
+        db_path = self.get_db_path()
+        if db_path is None or not os.path.exists(db_path):
+            return {"success": False, "error": "Резервное копирование доступно только для файловой SQLite"}
+
+        if self._lock.locked():
+            return {"success": False, "error": "Резервное копирование уже выполняется"}
+
+        async with self._lock:
+            started = time.perf_counter()
+            try:
+                path, raw_size = await asyncio.to_thread(self._backup_sync, db_path)
+                removed = await asyncio.to_thread(self._apply_retention)
+                result = {
+                    "success": True,
+                    "file": path,
+                    "size_bytes": os.path.getsize(path),
+                    "raw_size_bytes": raw_size,
+                    "duration": round(time.perf_counter() - started, 2),
+                    "removed": removed
+                }
+                logger.info(
+                    f"💾 Резервная копия создана: {os.path.basename(path)} "
+                    f"({raw_size / 1048576:.1f} MB -> {result['size_bytes'] / 1048576:.1f} MB, "
+                    f"{result['duration']} с), удалено старых: {len(removed)}"
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка резервного копирования: {e}")
+                result = {"success": False, "error": str(e)}
+
+            result["timestamp"] = datetime.now().isoformat()
+            self.last_result = result
+            return result
+
+    def _backup_sync(self, db_path: str):
+        """Скопировать БД через backup API и сжать копию (выполняется в потоке)"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        raw_path = os.path.join(self.backup_dir, f"{name}.db.tmp")
+        gz_path = os.path.join(self.backup_dir, f"{name}{BACKUP_SUFFIX}")
+        part_path = gz_path + ".part"
+
+        try:
+            self._copy_database(db_path, raw_path)
+            raw_size = os.path.getsize(raw_path)
+
+            # Потоковое сжатие: файл не читается в память целиком
+            with open(raw_path, "rb") as src, gzip.open(part_path, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, length=1024 * 1024)
+            os.replace(part_path, gz_path)
+            return gz_path, raw_size
+        finally:
+            for path in (raw_path, part_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _copy_database(self, db_path: str, raw_path: str) -> None:
+        """Online backup порциями по pages_per_step страниц"""
+        source = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        target = sqlite3.connect(raw_path)
+        snapshot = False
+        try:
+            if source.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal":
+                # Открытая транзакция чтения фиксирует снимок WAL: запись в БД продолжается,
+                # а копирование не начинается заново после каждого заказа
+                source.execute("BEGIN")
+                source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+                snapshot = True
+
+            state = {"remaining": None, "restarts": 0}
+
+            def progress(status, remaining, total):
+                # Запись в исходную БД между порциями начинает копирование заново
+                if state["remaining"] is not None and remaining > state["remaining"]:
+                    state["restarts"] += 1
+                    if state["restarts"] > MAX_BACKUP_RESTARTS:
+                        raise BackupRestartLimit()
+                state["remaining"] = remaining
+
+            try:
+                source.backup(target, pages=self.pages_per_step, progress=progress, sleep=self.step_sleep)
+            except BackupRestartLimit:
+                # В режиме WAL копирование за один проход держит только снимок для чтения
+                # и не мешает записи
+                logger.warning("Резервная копия перезапускалась слишком часто, копируем за один проход")
+                source.backup(target, pages=-1)
+
+            result = target.execute("PRAGMA quick_check").fetchone()
+            if not result or result[0] != "ok":
+                raise RuntimeError(f"Копия БД не прошла проверку: {result}")
+        finally:
+            if snapshot:
+                source.execute("COMMIT")
+            target.close()
+            source.close()
+
+    # ---------- хранение ----------
+
+    def list_backups(self) -> List[Dict]:
+        """Копии от новых к старым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        backups = []
+        for entry in os.scandir(self.backup_dir):
+            if entry.is_file() and entry.name.startswith(BACKUP_PREFIX) and entry.name.endswith(BACKUP_SUFFIX):
+                stat = entry.stat()
+                backups.append({
+                    "file": entry.path,
+                    "name": entry.name,
+                    "size_bytes": stat.st_size,
+                    "created": datetime.fromtimestamp(stat.st_mtime)
+                })
+        backups.sort(key=lambda b: b["created"], reverse=True)
+        return backups
+
+    def _apply_retention(self) -> List[str]:
+        """Оставить keep_daily последних копий и самую свежую копию каждой из keep_weekly последних недель"""
+        backups = self.list_backups()
+        keep = {b["file"] for b in backups[:self.keep_daily]}
+
+        weeks = []
+        for backup in backups:
+            week = backup["created"].isocalendar()[:2]
+            if week in weeks:
+                continue
+            if len(weeks) >= self.keep_weekly:
+                break
+            weeks.append(week)
+            keep.add(backup["file"])
+
+        removed = []
+        for backup in backups:
+            if backup["file"] not in keep:
+                try:
+                    os.remove(backup["file"])
+                    removed.append(backup["name"])
+                except OSError as e:
+                    logger.warning(f"Не удалось удалить старую копию {backup['name']}: {e}")
+        return removed
+
+    async def get_backup_stats(self) -> Dict:
+        """Статистика резервных копий (используется в health check)"""
+        backups = await asyncio.to_thread(self.list_backups)
+        last = backups[0] if backups else None
+        return {
+            "total_backups": len(backups),
+            "total_size_mb": round(sum(b["size_bytes"] for b in backups) / 1048576, 2),
+            "last_backup": last["created"].isoformat() if last else None,
+            "last_backup_file": last["name"] if last else None,
+            "backup_dir": os.path.abspath(self.backup_dir),
+            "in_progress": self._lock.locked(),
+            "last_error": None if not self.last_result or self.last_result["success"] else self.last_result["error"]
+        }
+
+    # ---------- расписание ----------
+
+    async def scheduled_backup(self, bot=None) -> None:
+        """Ночная задача: копия и уведомление админу"""
+        result = await self.create_backup()
+        if bot is None:
+            return
+        if result["success"]:
+            from notifications import send_backup_notification
+            await send_backup_notification(bot, os.path.basename(result["file"]))
+        else:
+            logger.error(f"Ночная резервная копия не создана: {result['error']}")
+
+    def start_scheduler(self, bot=None, hour: int = 4, minute: int = 0) -> bool:
+        """Запланировать ежедневную копию (по умолчанию в 04:00 по TIMEZONE)"""
+        if self.get_db_path() is None:
+            logger.info("Резервное копирование отключено: БД не файловая SQLite")
+            return False
+
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        from apscheduler.triggers.cron import CronTrigger
+
+        self._scheduler = AsyncIOScheduler(timezone=settings.timezone)
+        self._scheduler.add_job(
+            self.scheduled_backup,
+            CronTrigger(hour=hour, minute=minute, timezone=settings.timezone),
+            kwargs={"bot": bot},
+            id="nightly_backup",
+            coalesce=True,
+            max_instances=1,
+            misfire_grace_time=3600
+        )
+        self._scheduler.start()
+        logger.info(f"💾 Резервное копирование: ежедневно в {hour:02d}:{minute:02d} ({settings.timezone})")
+        return True
+
+    def stop_scheduler(self) -> None:
+        if self._scheduler is not None:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
+
+
+# Глобальный экземпляр
+backup_manager = BackupManager(
+    backup_dir=settings.backup_dir,
+    keep_daily=settings.backup_keep_daily,
+    keep_weekly=settings.backup_keep_weekly
+)
@@ -7,11 +7,27 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import settings
-from database import init_db
+from database import init_db, engine
+from catalog_cache import catalog_cache
 from admin import admin_router
-from handlers import router as main_router
+from handlers import router as main_router, card_contexts
+from keyboards import keyboard_cache
+from search import product_search
+from middlewares import UserIdentityMiddleware, PerformanceMiddleware, UpdateTimingMiddleware, TelegramTimingMiddleware
+from webhook import run_webhook
+from outbound import outbound
+from backup_service import backup_manager
+from fsm_storage import SQLiteStorage
+from shared_state import shared_state
+from request_metrics import install_query_hooks
+from metrics import metrics_exporter
+from error_handling import error_sink, admin_notification_sink
+from outbox import outbox
+from idempotency import idempotency
+from images import image_pipeline
 
 # Настраиваем логирование
 logging.basicConfig(
@@ -33,7 +49,32 @@ async def main():
 
     # Инициализация
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    # Состояния заказа и админки хранятся в БД и переживают перезапуск;
+    # с REDIS_URL - в Redis, общем для всех процессов бота
+    storage = shared_state.fsm_storage()
+    if storage is None:
+        if settings.fsm_storage == "sqlite":
+            storage = SQLiteStorage(
+                flush_interval=settings.fsm_flush_interval,
+                ttl_seconds=settings.fsm_ttl_hours * 3600
+            )
+        else:
+            storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+
+    # user_id пользователя берется из кэша, а не из get_or_create_user в каждом обработчике
+    main_router.message.middleware(UserIdentityMiddleware())
+    main_router.callback_query.middleware(UserIdentityMiddleware())
+
+    # Время каждого обработчика - в гистограммы PerformanceMonitor (/perf в админке)
+    for router in (admin_router, main_router):
+        router.message.middleware(PerformanceMiddleware("message"))
+        router.callback_query.middleware(PerformanceMiddleware("callback"))
+
+    # Полное время апдейта с разбивкой на БД и Telegram API (/perf_updates в админке)
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    bot.session.middleware(TelegramTimingMiddleware())
+    install_query_hooks(engine)
 
     # Включаем роутеры
     dp.include_router(admin_router)
@@ -42,20 +83,61 @@ async def main():
     # Инициализация БД
     await init_db()
 
+    # С Redis каталог меняют и другие процессы: следим за общей версией каталога,
+    # при изменении перечитываем снимок и сбрасываем кэши, собранные по старым данным
+    for clear in (keyboard_cache.clear, product_search.clear_cache, card_contexts.clear):
+        catalog_cache.add_listener(clear)
+    await catalog_cache.start_sync(settings.catalog_sync_interval)
+
+    # Загружаем каталог в память (дальше он обновляется при изменениях в админке)
+    await catalog_cache.load()
+    # Фото товаров, уже загруженные в Telegram (URL -> file_id)
+    await image_pipeline.load()
+
+    # Уведомления админу о заказах (outbox) - в фоне, с повторами
+    outbox.start(bot)
+    # Старые ключи идемпотентности заказов - в фоне, не в транзакции заказа
+    idempotency.start_purge()
+
+    # Ночное резервное копирование
+    if settings.backup_enabled:
+        backup_manager.start_scheduler(bot, hour=settings.backup_hour, minute=settings.backup_minute)
+
+    # Prometheus /metrics и /healthz
+    if settings.metrics_port:
+        metrics_exporter.attach(storage=storage)
+        await metrics_exporter.start(settings.metrics_host, settings.metrics_port)
+
     logger.info(f"👑 Админ ID: {settings.admin_id}")
+    logger.info(f"📡 Режим: {settings.bot_mode}")
     logger.info("✅ Бот готов к работе")
 
-    # Сбрасываем webhook
-    await bot.delete_webhook(drop_pending_updates=True)
-
     # Запуск
     try:
-        await dp.start_polling(bot)
+        if settings.bot_mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Сбрасываем webhook
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("⏹️ Остановлен пользователем")
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}")
         raise
+    finally:
+        backup_manager.stop_scheduler()
+        await metrics_exporter.stop()
+        await outbox.stop()
+        await idempotency.stop_purge()
+        await catalog_cache.stop_sync()
+        await image_pipeline.close()
+        # Досылаем то, что осталось в очереди исходящих запросов
+        await outbound.close()
+        await shared_state.close()
+        # Дописываем ошибки, которые еще в очереди
+        await error_sink.close()
+        await admin_notification_sink.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""
+Пересчет доступности товаров: одна категория и весь каталог на 100 тысячах товаров
+
+AvailabilityRules.apply() - один UPDATE ... CASE в транзакции. Замеряются
+два случая для категории и для всего каталога:
+- без изменений (остатки уже соответствуют available) - стоимость проверки;
+- у каждого десятого товара остаток обнулен или восстановлен - UPDATE
+  меняет и возвращает эти строки (как после импорта или инвентаризации).
+
+    python benchmarks/bench_availability.py [--categories 100] [--per-category 1000]
+"""
+import argparse
+import asyncio
+import time
+
+from common import configure, fill_catalog, percentiles, print_table
+
+configure("availability")
+
+from sqlalchemy import text, update  # noqa: E402
+
+from availability import availability_rules  # noqa: E402
+from database import init_db, get_session, Product  # noqa: E402
+
+REPEATS = 10
+
+
+async def set_every_tenth_stock(stock: int) -> None:
+    """Остаток каждого десятого товара (без пересчета available)"""
+    async with get_session() as session:
+        await session.execute(
+            update(Product).where(Product.id % 10 == 0).values(stock_grams=stock)
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def apply(category_id=None) -> int:
+    async with get_session() as session:
+        return len(await availability_rules.apply(session, category_id=category_id))
+
+
+async def measure(label: str, category_id, change: bool) -> dict:
+    samples, changed = [], []
+    for i in range(REPEATS):
+        if change:
+            # Чередуем: обнуленные товары скрываются, пополненные снова показываются
+            await set_every_tenth_stock(0 if i % 2 == 0 else 100000)
+        started = time.perf_counter()
+        changed.append(await apply(category_id))
+        samples.append((time.perf_counter() - started) * 1000)
+        # Остальные категории приводим в соответствие вне замера
+        await apply()
+    stats = percentiles(samples)
+    return {"scope": label, "changes": "10% товаров" if change else "нет", "changed_rows": max(changed),
+            "n": stats["n"], "p50": stats["p50"], "p95": stats["p95"], "max": stats["max"]}
+
+
+async def query_plan(category_id: int) -> str:
+    async with get_session() as session:
+        rows = await session.execute(text(
+            "EXPLAIN QUERY PLAN UPDATE products SET available = 0 "
+            "WHERE category_id = :c AND available = 1"
+        ), {"c": category_id})
+        return "; ".join(row[-1] for row in rows)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--per-category", type=int, default=1000)
+    args = parser.parse_args()
+
+    await init_db()
+    category_ids = await fill_catalog(args.categories, args.per_category)
+    total = args.categories * args.per_category
+    category_id = category_ids[len(category_ids) // 2]
+    await apply()
+
+    rows = []
+    for change in (False, True):
+        rows.append(await measure(f"категория ({args.per_category})", category_id, change))
+        rows.append(await measure(f"каталог ({total})", None, change))
+    print_table(f"AvailabilityRules.apply(), мс ({REPEATS} повторов, {total} товаров)", rows)
+    print(f"\nПлан UPDATE по категории: {await query_plan(category_id)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+"""
+Резервная копия большой БД: задержка обработчиков во время копирования
+
+БД дополняется таблицей bench_padding до --size-mb мегабайт, затем
+нажатия category:, product: и cart_add: (запись в БД) идут через
+Dispatcher без копии, во время BackupManager.create_backup() (порции
+по pages_per_step страниц в потоке) и во время копии за один проход
+(pages=-1). Отдельно меряется задержка цикла событий.
+
+    python benchmarks/bench_backup.py [--size-mb 300]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import time
+
+from common import (configure, percentiles, print_table, fake_bot, build_dispatcher,
+                    callback_update, fill_catalog, timed, unthrottle)
+
+workdir = configure("backup")
+
+from database import init_db  # noqa: E402
+from catalog_cache import catalog_cache  # noqa: E402
+from backup_service import BackupManager  # noqa: E402
+
+BASELINE_TAPS = 600
+
+
+def pad_database(db_path: str, size_mb: int) -> None:
+    """Дописать в БД size_mb мегабайт случайных данных (в потоке)"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS bench_padding (id INTEGER PRIMARY KEY, data BLOB)")
+        rows = size_mb * 16
+        for start in range(0, rows, 512):
+            conn.executemany(
+                "INSERT INTO bench_padding (data) VALUES (randomblob(65536))",
+                [()] * min(512, rows - start)
+            )
+            conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+async def loop_lag(stop: asyncio.Event, samples: list):
+    """Насколько позже срабатывает sleep(0.01)"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append((time.perf_counter() - started - 0.01) * 1000)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=300)
+    args = parser.parse_args()
+
+    await init_db()
+    category_ids = await fill_catalog(5, 40)
+    await catalog_cache.load()
+    products = {cid: [p["id"] for p in catalog_cache.snapshot.products_by_category[cid]] for cid in category_ids}
+
+    db_path = BackupManager.get_db_path()
+    started = time.perf_counter()
+    await asyncio.to_thread(pad_database, db_path, args.size_mb)
+    print(f"БД {os.path.getsize(db_path) / 1048576:.0f} MB, заполнена за {time.perf_counter() - started:.1f} с")
+
+    unthrottle()
+    bot = fake_bot()
+    dp = build_dispatcher()
+    rng = random.Random(6)
+
+    async def tap(samples, i):
+        cid = rng.choice(category_ids)
+        pid = rng.choice(products[cid])
+        user_id = 8000 + i % 50
+        samples["category"].append(await timed(dp.feed_update(bot, callback_update(user_id, f"category:{cid}"))))
+        samples["product"].append(await timed(dp.feed_update(bot, callback_update(user_id, f"product:{pid}:{cid}"))))
+        samples["cart_add"].append(await timed(
+            dp.feed_update(bot, callback_update(user_id, f"cart_add:{pid}:100:{cid}"))
+        ))
+
+    async def phase(label, backup=None):
+        samples = {"category": [], "product": [], "cart_add": []}
+        lag, stop = [], asyncio.Event()
+        ticker = asyncio.create_task(loop_lag(stop, lag))
+        duration = None
+        if backup is None:
+            for i in range(BASELINE_TAPS):
+                await tap(samples, i)
+        else:
+            task = asyncio.create_task(backup.create_backup())
+            i = 0
+            while not task.done():
+                await tap(samples, i)
+                i += 1
+            result = task.result()
+            assert result["success"], result
+            duration = result["duration"]
+        stop.set()
+        await ticker
+        lag_stats = percentiles(lag)
+        return [
+            {"phase": label, "tap": kind, **{k: v for k, v in percentiles(values).items() if k != "mean"},
+             "loop_lag_max": lag_stats["max"], "backup_s": duration}
+            for kind, values in samples.items()
+        ]
+
+    await phase("прогрев")
+    rows = await phase("без копии")
+    rows += await phase("BackupManager", BackupManager(backup_dir=os.path.join(workdir, "chunked")))
+    rows += await phase("один проход", BackupManager(backup_dir=os.path.join(workdir, "single"), pages_per_step=-1))
+    print_table(f"Нажатия во время резервной копии БД {args.size_mb}+ MB, мс", rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
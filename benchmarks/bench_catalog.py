@@ -0,0 +1,102 @@
+"""
+Снимок каталога в памяти: задержка обработчиков каталога и цена продажи
+
+1. p50/p99 обработки нажатий category:<id> и product:<id>:<cid> через
+   Dispatcher - из снимка и из БД (снимок выключен).
+2. Обновление снимка после заказа из трех позиций на каталоге в 100k
+   товаров: точечный with_products против полной пересборки снимка
+   (так снимок обновлялся раньше - по разу на позицию).
+
+    python benchmarks/bench_catalog.py
+"""
+import asyncio
+import random
+import time
+
+from common import (configure, percentiles, print_table, fake_bot, build_dispatcher,
+                    callback_update, fill_catalog, timed, unthrottle)
+
+configure("catalog")
+
+from database import init_db  # noqa: E402
+from catalog_cache import catalog_cache, CatalogSnapshot  # noqa: E402
+
+TAPS = 500
+
+
+async def handler_latency():
+    category_ids = await fill_catalog(5, 40)
+    await catalog_cache.load()
+    products = {cid: [p["id"] for p in catalog_cache.snapshot.products_by_category[cid]] for cid in category_ids}
+
+    unthrottle()
+    bot = fake_bot()
+    dp = build_dispatcher()
+    rng = random.Random(1)
+
+    async def taps(label):
+        samples = {"category": [], "product": []}
+        for i in range(TAPS):
+            cid = rng.choice(category_ids)
+            user_id = 1000 + i % 50
+            samples["category"].append(await timed(dp.feed_update(bot, callback_update(user_id, f"category:{cid}"))))
+            pid = rng.choice(products[cid])
+            samples["product"].append(await timed(dp.feed_update(bot, callback_update(user_id, f"product:{pid}:{cid}"))))
+        return [{"mode": label, "tap": tap, **percentiles(values)} for tap, values in samples.items()]
+
+    # Прогрев: пользователи и соединения
+    await taps("warmup")
+    rows = await taps("snapshot")
+    snapshot = catalog_cache._snapshot
+    catalog_cache._snapshot = None
+    rows += await taps("database")
+    catalog_cache._snapshot = snapshot
+    print_table(f"Обработчики каталога, мс ({TAPS} нажатий каждого вида)", rows,
+                ["mode", "tap", "p50", "p95", "p99", "mean"])
+
+
+def sale_update():
+    rng = random.Random(2)
+    categories = [{"id": c, "name": f"Категория {c}"} for c in range(100)]
+    products = [
+        {"id": i, "name": f"Лакомство {rng.randint(0, 10 ** 6)}", "description": None, "price": 100,
+         "stock_grams": 1000, "image_url": None, "available": True, "is_active": True,
+         "unit_type": "grams", "measurement_step": 100, "hide_when_zero": True,
+         "is_hypoallergenic": i % 10 == 0, "category_id": i % 100}
+        for i in range(100_000)
+    ]
+    snapshot = CatalogSnapshot(1, categories, products)
+
+    patch, rebuild = [], []
+    for version in range(2, 202):
+        sold = rng.sample(range(100_000), 3)
+        updates = {pid: {**snapshot.products[pid], "stock_grams": 500} for pid in sold}
+
+        started = time.perf_counter()
+        patched = snapshot.with_products(version, updates)
+        patch.append((time.perf_counter() - started) * 1000)
+
+        # Полная пересборка - секунды на заказ, поэтому только 10 замеров
+        if version < 12:
+            started = time.perf_counter()
+            current = snapshot.products.copy()
+            for pid, product in updates.items():
+                current[pid] = product
+                CatalogSnapshot(version, snapshot.categories, current.values())
+            rebuild.append((time.perf_counter() - started) * 1000)
+        snapshot = patched
+
+    print_table("Обновление снимка после заказа из 3 позиций, 100k товаров, мс", [
+        {"mode": "with_products (точечно)", **percentiles(patch)},
+        {"mode": "пересборка на позицию", **percentiles(rebuild)},
+    ], ["mode", "p50", "p99", "max"])
+
+
+async def main():
+    await init_db()
+    await handler_latency()
+    sale_update()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
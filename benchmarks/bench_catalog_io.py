@@ -0,0 +1,139 @@
+"""
+Импорт и экспорт каталога: пиковая память на 50 тысячах строк
+
+Сгенерированный файл (--rows строк, 50 категорий) проходит полный круг:
+импорт новых товаров, экспорт и импорт выгрузки (обновление по id, без
+изменений). Каждый шаг выполняется под tracemalloc, пик памяти Python
+сравнивается с PEAK_LIMIT_MB: файл читается построчно и пишется пачками,
+поэтому пик не должен расти вместе с файлом. Память SQLite (C) tracemalloc
+не видит. XLSX (read_only/write_only) проверяется, если установлен openpyxl.
+
+    python benchmarks/bench_catalog_io.py [--rows 50000]
+"""
+import argparse
+import asyncio
+import csv
+import os
+import random
+import time
+import tracemalloc
+
+from common import configure, print_table
+
+workdir = configure("catalog-io")
+
+from database import init_db, get_session, Product  # noqa: E402
+from catalog_io import CatalogImporter, COLUMNS  # noqa: E402
+from sqlalchemy import delete, func, select  # noqa: E402
+
+# Потолок пика памяти на шаг: меньше CSV-файла на 50 тысяч строк (~13 МБ),
+# с запасом на openpyxl; от числа строк растет только список changed_ids
+PEAK_LIMIT_MB = 16
+
+WORDS = ["сушеный", "вяленый", "хрустящий", "мягкий", "кролик", "индейка", "утка", "лосось",
+         "говядина", "рубец", "трахея", "сердце", "печенье", "кусочки", "хвостики", "натуральный"]
+
+
+def generate_rows(count: int):
+    rng = random.Random(14)
+    for i in range(count):
+        pieces = rng.random() < 0.2
+        yield [
+            "", f"Категория {i % 50}", f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} №{i}",
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 15))),
+            rng.randint(50, 900), "pieces" if pieces else "grams",
+            rng.randint(0, 50) if pieces else rng.randint(0, 50) * 100,
+            f"https://example.com/img/{i}.jpg", "", "да", "да", "нет"
+        ]
+
+
+def write_csv(path: str, count: int) -> None:
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(COLUMNS)
+        writer.writerows(generate_rows(count))
+
+
+def write_xlsx(path: str, count: int) -> None:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("catalog")
+    sheet.append(COLUMNS)
+    for row in generate_rows(count):
+        sheet.append(row)
+    workbook.save(path)
+
+
+async def traced(label: str, coro_factory, path: str, rows: int) -> dict:
+    """Шаг под tracemalloc: время, пик памяти и проверка потолка"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        result = await coro_factory()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert result["success"], result
+    peak_mb = peak / 1024 / 1024
+    assert peak_mb < PEAK_LIMIT_MB, f"{label}: пик {peak_mb:.1f} МБ при потолке {PEAK_LIMIT_MB} МБ"
+    return {
+        "step": label,
+        "rows": rows,
+        "file_mb": os.path.getsize(path) / 1024 / 1024,
+        "seconds": elapsed,
+        "peak_mb": peak_mb,
+        "limit_mb": PEAK_LIMIT_MB,
+        "result": ", ".join(f"{k}={result[k]}" for k in ("created", "updated", "unchanged", "errors", "products")
+                            if k in result)
+    }
+
+
+async def product_count() -> int:
+    async with get_session() as session:
+        return await session.scalar(select(func.count()).select_from(Product))
+
+
+async def clear_products() -> None:
+    async with get_session() as session:
+        await session.execute(delete(Product))
+
+
+async def round_trip(extension: str, rows: int, write) -> list:
+    importer = CatalogImporter()
+    source = os.path.join(workdir, f"catalog.{extension}")
+    exported = os.path.join(workdir, f"export.{extension}")
+    report = os.path.join(workdir, "report.csv")
+    write(source, rows)
+
+    await clear_products()
+    steps = [await traced(f"{extension}: импорт новых", lambda: importer.import_file(source, report), source, rows)]
+    assert await product_count() == rows
+    steps.append(await traced(f"{extension}: экспорт", lambda: importer.export_file(exported), exported, rows))
+    steps.append(await traced(f"{extension}: импорт выгрузки",
+                              lambda: importer.import_file(exported, report), exported, rows))
+    assert steps[-1]["result"].startswith(f"created=0, updated=0, unchanged={rows}"), steps[-1]["result"]
+    return steps
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    await init_db()
+    rows = await round_trip("csv", args.rows, write_csv)
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        print("openpyxl не установлен - XLSX пропущен")
+    else:
+        rows += await round_trip("xlsx", args.rows, write_xlsx)
+
+    print_table(f"Импорт и экспорт каталога под tracemalloc ({args.rows} строк)", rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
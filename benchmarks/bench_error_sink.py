@@ -0,0 +1,128 @@
+"""
+Запись ошибок: задержки цикла событий при потоке 1000 ошибок в секунду
+
+Ошибки с трассировкой в 20 кадров поступают с частотой RATE в секунду
+в течение SECONDS секунд, параллельно тикер раз в 1 мс меряет, насколько
+позже он просыпается (задержка цикла событий). Сравниваются:
+- прежняя запись: JSON-файл на ошибку, open() и traceback в цикле событий
+  (id ошибки уникален, иначе файлы затирали друг друга);
+- EnhancedErrorHandler.handle_error через error_sink (очередь, пачки,
+  запись в потоке);
+- простой цикл без ошибок.
+
+    python benchmarks/bench_error_sink.py
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+from common import configure, percentiles, print_table
+
+workdir = configure("error-sink")
+os.chdir(workdir)
+logging.disable(logging.ERROR)
+
+from error_handling import EnhancedErrorHandler, error_sink  # noqa: E402
+
+RATE = 1000
+SECONDS = 3
+DEPTH = 20
+
+
+def _fail(depth: int):
+    if depth == 0:
+        raise ValueError("Товар недоступен для пользователя")
+    _fail(depth - 1)
+
+
+def make_error() -> Exception:
+    try:
+        _fail(DEPTH)
+    except ValueError as e:
+        return e
+
+
+async def legacy_handle_error(error: Exception, context: str, user_id: int, seq: int) -> None:
+    """Как EnhancedErrorHandler сохранял ошибку раньше (id дополнен номером)"""
+    error_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{seq}"
+    details = {
+        "error_id": error_id,
+        "timestamp": datetime.now().isoformat(),
+        "error_type": type(error).__name__,
+        "error_message": str(error),
+        "context": context,
+        "user_id": user_id,
+        "traceback": "".join(traceback.format_exception(error)),
+        "handled": True
+    }
+    errors_dir = Path("legacy/errors")
+    errors_dir.mkdir(parents=True, exist_ok=True)
+    with open(errors_dir / f"error_{error_id}.json", "w", encoding="utf-8") as f:
+        json.dump(details, f, indent=2, ensure_ascii=False, default=str)
+
+
+async def new_handle_error(error: Exception, context: str, user_id: int, seq: int) -> None:
+    await EnhancedErrorHandler.handle_error(error, context=context, user_id=user_id, notify_user=True)
+
+
+async def ticker(stop: asyncio.Event, lag: list) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lag.append((time.perf_counter() - started - 0.001) * 1000)
+
+
+async def run(label, handle=None):
+    lag, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(stop, lag))
+    await asyncio.sleep(0)
+    total = RATE * SECONDS
+    started = time.perf_counter()
+    for seq in range(total):
+        # Расписание: ошибка каждые 1/RATE секунды; если не успеваем - все равно
+        # отдаем управление, как между обновлениями от Telegram
+        delay = started + seq / RATE - time.perf_counter()
+        await asyncio.sleep(max(delay, 0))
+        if handle is not None:
+            error = make_error()
+            await handle(error, "cart_update", 1000 + seq % 100, seq)
+    offered = time.perf_counter() - started
+    if handle is new_handle_error:
+        await error_sink.flush()
+    flushed = time.perf_counter() - started
+    stop.set()
+    await tick
+    stats = percentiles(lag)
+    return {
+        "mode": label,
+        "offer_s": offered,
+        "written_s": flushed,
+        "lag_p50": stats["p50"],
+        "lag_p99": stats["p99"],
+        "lag_max": stats["max"]
+    }
+
+
+async def main():
+    rows = [
+        await run("без ошибок"),
+        await run("прежняя запись", legacy_handle_error),
+        await run("error_sink", new_handle_error),
+    ]
+    stats = error_sink.stats()
+    legacy_files = len(os.listdir("legacy/errors"))
+    print_table(
+        f"{RATE * SECONDS} ошибок по {RATE}/с, трассировка {DEPTH} кадров; задержка цикла событий, мс "
+        f"(файлов прежней записи: {legacy_files}; error_sink: записано {stats['written']}, "
+        f"пачек {stats['batches']}, отброшено {stats['dropped']})", rows
+    )
+    await error_sink.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
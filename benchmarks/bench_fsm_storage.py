@@ -0,0 +1,102 @@
+"""
+Хранилище FSM: SQLiteStorage (write-behind) против MemoryStorage
+
+USERS пользователей одновременно проходят оформление заказа через
+FSMContext: шаги set_state + update_data, как в handlers (кличка,
+адрес, логин, сохранение адреса), на каждом шаге - get_data. Первый шаг
+меряется отдельно: для SQLiteStorage это промах кэша и чтение из БД.
+Сравниваются:
+- MemoryStorage (прежнее хранилище, теряет состояния при перезапуске);
+- SQLiteStorage с отложенной записью (как в боте);
+- SQLiteStorage с записью на каждом шаге (flush после каждой операции) -
+  во что обошлась бы прямая запись в БД.
+
+    python benchmarks/bench_fsm_storage.py
+"""
+import asyncio
+import time
+
+from common import configure, percentiles, print_table
+
+configure("fsm-storage")
+
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+from database import init_db  # noqa: E402
+from fsm_storage import SQLiteStorage  # noqa: E402
+
+USERS = 500
+STEPS = [
+    ("OrderForm:waiting_pet_name", {"pet_name": "Рекс"}),
+    ("OrderForm:waiting_address", {"address": "Белград, Кнеза Милоша 10, кв. 5"}),
+    ("OrderForm:waiting_telegram_login", {"telegram_login": "@rex_owner"}),
+    ("OrderForm:waiting_save_address", {"checkout_token": "0f3c9a", "total": 1250}),
+]
+
+
+class WriteThroughStorage(SQLiteStorage):
+    """Запись в БД на каждой операции"""
+
+    async def set_state(self, key, state=None):
+        await super().set_state(key, state)
+        await self.flush()
+
+    async def set_data(self, key, data):
+        await super().set_data(key, data)
+        await self.flush()
+
+
+async def checkout_flow(storage, user_id, first, later):
+    state = FSMContext(storage, StorageKey(bot_id=42, chat_id=user_id, user_id=user_id))
+    for step, (name, data) in enumerate(STEPS):
+        started = time.perf_counter()
+        await state.set_state(name)
+        await state.update_data(**data)
+        await state.get_data()
+        (later if step else first).append((time.perf_counter() - started) * 1000)
+        # Пользователь печатает следующий ответ
+        await asyncio.sleep(0.01)
+    await state.clear()
+
+
+async def run(label, storage):
+    first, later = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*(checkout_flow(storage, 20_000 + i, first, later) for i in range(USERS)))
+    elapsed = time.perf_counter() - started
+    flush_ms = None
+    if isinstance(storage, SQLiteStorage):
+        flush_started = time.perf_counter()
+        await storage.close()
+        flush_ms = (time.perf_counter() - flush_started) * 1000
+    first, later = percentiles(first), percentiles(later)
+    return {
+        "storage": label,
+        "first_p50": first["p50"],
+        "first_p99": first["p99"],
+        "next_p50": later["p50"],
+        "next_p99": later["p99"],
+        "flows/s": USERS / elapsed,
+        "db_tx": storage.stats()["flushes"] if isinstance(storage, SQLiteStorage) else 0,
+        "close_ms": flush_ms
+    }
+
+
+async def main():
+    await init_db()
+    await run("прогрев", SQLiteStorage())
+    rows = [
+        await run("MemoryStorage", MemoryStorage()),
+        await run("SQLite write-behind", SQLiteStorage()),
+        await run("SQLite запись на шаге", WriteThroughStorage()),
+    ]
+    print_table(
+        f"FSM: {USERS} одновременных оформлений по {len(STEPS)} шага; "
+        f"шаг = set_state + update_data + get_data, мс", rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
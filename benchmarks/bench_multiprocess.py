@@ -0,0 +1,167 @@
+"""
+Несколько процессов бота с общим Redis: корзина и заказы, 1-4 процесса
+
+Каждый процесс - отдельный бот (spawn) с REDIS_URL, как за балансировщиком
+webhook: блокировки корзины - аренды в Redis, БД SQLite общая. Процесс
+ведет своих покупателей: USER_STEPS нажатий "+" в корзине, добавление
+второго товара, корзина и заказ. Все процессы стартуют одновременно
+(после импорта), время - от старта до завершения последнего процесса.
+После каждого прогона проверяется, что второго товара продано ровно
+столько, сколько было, а каждая корзина перед заказом содержит все
+приращения.
+
+Без --redis-url поднимается fakeredis по TCP в этом процессе (нужны
+пакеты fakeredis и lupa); он сам занимает CPU, поэтому для честных цифр
+лучше настоящий Redis.
+
+    python benchmarks/bench_multiprocess.py [--redis-url redis://localhost:6379/0] [--users 40]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+from common import configure, print_table
+
+USER_STEPS = 4
+WORKER_COUNTS = (1, 2, 3, 4)
+
+
+def worker(user_ids, cart_product, stock_product, start, results):
+    """Процесс бота: окружение (БД, REDIS_URL) унаследовано от родителя"""
+    from services import cart_service, checkout_service
+
+    async def shop():
+        # Первое подключение к Redis и БД - до старта замера
+        await cart_service.get_cart(user_ids[0])
+        start.wait()
+        started = time.time()
+        orders = lost = 0
+        for user_id in user_ids:
+            for _ in range(USER_STEPS):
+                await cart_service.update_cart_quantity(user_id, cart_product, 100)
+            await cart_service.add_to_cart(user_id, stock_product, 100)
+            cart = await cart_service.get_cart(user_id)
+            # Заказ очищает корзину - приращения проверяем до него
+            quantity = next(i["quantity"] for i in cart["items"] if i["product_id"] == cart_product)
+            lost += quantity != USER_STEPS * 100
+            result = await checkout_service.checkout(
+                user_id, "Рекс", "@rex", "Белград", cart["items"], cart["total_price"],
+                idempotency_key=("checkout", f"bench-{user_id}")
+            )
+            orders += bool(result["success"])
+        results.put((started, time.time(), orders, lost))
+
+    asyncio.run(shop())
+
+
+async def prepare(users: int, stock: int):
+    from database import get_session, Category, Product, User
+
+    async with get_session() as session:
+        category = Category(name=f"Категория {time.monotonic_ns()}")
+        session.add(category)
+        await session.flush()
+        values = dict(price=100, unit_type="grams", measurement_step=100, available=True,
+                      is_active=True, hide_when_zero=True, is_hypoallergenic=False, category_id=category.id)
+        cart_product = Product(name="Печенье", stock_grams=10 ** 9, **values)
+        stock_product = Product(name="Сушка", stock_grams=stock, **values)
+        session.add_all([cart_product, stock_product])
+        created = [User(telegram_id=f"{time.monotonic_ns()}-{i}") for i in range(users)]
+        session.add_all(created)
+        await session.flush()
+        return cart_product.id, stock_product.id, [u.id for u in created]
+
+
+async def check(user_ids, stock_product):
+    from sqlalchemy import func, select
+    from database import get_session, Order, OrderItem, Product
+
+    async with get_session() as session:
+        sold = await session.scalar(
+            select(func.coalesce(func.sum(OrderItem.quantity), 0))
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(OrderItem.product_id == stock_product, Order.user_id.in_(user_ids))
+        )
+        stock = await session.scalar(select(Product.stock_grams).where(Product.id == stock_product))
+    return sold, stock
+
+
+def run_case(workers: int, users_per_worker: int) -> dict:
+    from database import init_db
+
+    # Второго товара хватает на половину покупателей: остальным его не положат
+    # в корзину или откажут в заказе
+    total_users = workers * users_per_worker
+    stock = total_users // 2 * 100
+    asyncio.run(init_db())
+    cart_product, stock_product, user_ids = asyncio.run(prepare(total_users, stock))
+
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=(
+            user_ids[i * users_per_worker:(i + 1) * users_per_worker], cart_product, stock_product, start, results
+        ))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # Ждем импорта и подключений во всех процессах
+    time.sleep(3 + workers)
+    start.set()
+    reports = [results.get(timeout=600) for _ in processes]
+    for process in processes:
+        process.join()
+
+    elapsed = max(r[1] for r in reports) - min(r[0] for r in reports)
+    sold, left = asyncio.run(check(user_ids, stock_product))
+    assert sum(r[3] for r in reports) == 0, "потеряны изменения корзины"
+    assert (sold, left) == (stock, 0), f"продано {sold} из {stock}, остаток {left}"
+    operations = total_users * (USER_STEPS + 3)
+    return {
+        "workers": workers,
+        "users": total_users,
+        "orders": sum(r[2] for r in reports),
+        "seconds": elapsed,
+        "checkouts_per_s": total_users / elapsed,
+        "ops_per_s": operations / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default="")
+    parser.add_argument("--users", type=int, default=40, help="покупателей на процесс")
+    args = parser.parse_args()
+
+    redis_url = args.redis_url
+    server = None
+    if not redis_url:
+        import fakeredis
+
+        server = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+        redis_url = f"redis://{host}:{port}/0"
+
+    configure("multiprocess", REDIS_URL=redis_url)
+    rows = [run_case(workers, args.users) for workers in WORKER_COUNTS]
+    base = rows[0]["ops_per_s"]
+    for row in rows:
+        row["speedup"] = row["ops_per_s"] / base
+    print_table(
+        f"Корзина и заказы из нескольких процессов ({args.users} покупателей на процесс, "
+        f"{USER_STEPS} нажатий + добавление + корзина + заказ; CPU: {os.cpu_count()}; "
+        f"Redis: {'fakeredis' if server else redis_url})",
+        rows
+    )
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
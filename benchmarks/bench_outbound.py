@@ -0,0 +1,84 @@
+"""
+Очередь исходящих запросов: пропускная способность и задержка ответов при всплеске
+
+Bot API заменен fake_session() с задержкой 30 мс. Всплеск: USERS
+пользователей одновременно открывают карточку (ответ пользователю + два
+фоновых удаления прежних сообщений) и через полсекунды - следующую,
+а один пользователь быстро листает каталог - RAPID ответов подряд
+в свой чат.
+
+Сравниваются прежние настройки (1 запрос/с на чат, серия 3, удаления
+расходуют лимит чата) и текущие (3/с, серия 10, удаления - отдельный
+общий лимит 20/с). Глобальный лимит 25/с в обоих случаях.
+
+    python benchmarks/bench_outbound.py
+"""
+import asyncio
+import time
+
+from common import configure, percentiles, print_table, fake_bot
+
+configure("outbound")
+
+from outbound import OutboundScheduler, PRIORITY_USER, PRIORITY_CLEANUP  # noqa: E402
+
+USERS = 60
+RAPID = 12
+LATENCY = 0.03
+
+
+async def burst(label, scheduler, deletes_own_budget):
+    calls = []
+    bot = fake_bot(LATENCY, calls)
+    replies, rapid = [], []
+
+    async def reply(chat_id, samples):
+        started = time.perf_counter()
+        await scheduler.send(chat_id, lambda: bot.send_message(chat_id=chat_id, text="Карточка"),
+                             priority=PRIORITY_USER)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    async def open_card(chat_id):
+        for message_id in (1, 2):
+            scheduler.post(chat_id, lambda m=message_id: bot.delete_message(chat_id=chat_id, message_id=m),
+                           priority=PRIORITY_CLEANUP, delete=deletes_own_budget)
+        await reply(chat_id, replies)
+
+    async def user(chat_id):
+        # Открыл карточку и через полсекунды - следующую
+        await open_card(chat_id)
+        await asyncio.sleep(0.5)
+        await open_card(chat_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(user(7000 + i) for i in range(USERS)),
+        *(reply(1, rapid) for _ in range(RAPID))
+    )
+    replies_done = time.perf_counter() - started
+    await scheduler.close(timeout=60)
+    total = time.perf_counter() - started
+
+    rows = []
+    for kind, samples in (("ответы всплеска", replies), ("серия в одном чате", rapid)):
+        stats = percentiles(samples)
+        rows.append({
+            "settings": label, "requests": kind, "p50": stats["p50"], "p99": stats["p99"], "max": stats["max"],
+            "replies_s": replies_done, "total_s": total, "req/s": len(calls) / total
+        })
+    return rows
+
+
+async def main():
+    rows = []
+    rows += await burst("прежние", OutboundScheduler(global_rate=25, chat_rate=1, chat_burst=3), False)
+    rows += await burst("текущие", OutboundScheduler(global_rate=25, chat_rate=3, chat_burst=10, delete_rate=20),
+                        True)
+    print_table(
+        f"Всплеск: {USERS} пользователей по 2 карточки (ответ + 2 удаления) и {RAPID} ответов в один чат; "
+        f"задержка ответа пользователю, мс", rows
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
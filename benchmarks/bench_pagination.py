@@ -0,0 +1,185 @@
+"""
+Постраничные клавиатуры каталога: 10, 500 и 5000 товаров в категории
+
+1. Клавиатура категории: прежняя (кнопка на каждый товар) против одной
+   страницы products_keyboard и попадания в keyboard_cache - время сборки,
+   время сериализации в JSON (как при отправке в Telegram), число кнопок
+   и размер JSON.
+2. Нажатия category:<id>, category:<id>:p<n> и catalog:p<n> через
+   Dispatcher: прежняя клавиатура, страница без кэша (кэш очищается перед
+   каждым нажатием) и страница с кэшем.
+
+    python benchmarks/bench_pagination.py
+"""
+import asyncio
+import random
+import time
+
+from sqlalchemy import insert
+
+from common import (configure, percentiles, print_table, fake_bot, build_dispatcher,
+                    callback_update, unthrottle)
+
+configure("pagination")
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+from aiogram.utils.keyboard import InlineKeyboardBuilder  # noqa: E402
+
+import handlers  # noqa: E402
+from database import init_db, get_session, Category, Product  # noqa: E402
+from catalog_cache import catalog_cache  # noqa: E402
+from keyboards import (products_keyboard, keyboard_cache, page_count,  # noqa: E402
+                       CATEGORIES_PAGE_SIZE, PRODUCTS_PAGE_SIZE)
+from services import catalog_service  # noqa: E402
+
+SIZES = (10, 500, 5000)
+# Категорий помимо основных - чтобы у каталога было несколько страниц
+EXTRA_CATEGORIES = 40
+REPEATS = 50
+TAPS = 200
+
+
+def legacy_products_keyboard(products: list, category_id: int, page: int = 0) -> InlineKeyboardMarkup:
+    """Клавиатура категории до постраничного вывода: кнопка на каждый товар"""
+    builder = InlineKeyboardBuilder()
+    for product in products:
+        unit_type = product.get('unit_type', 'grams')
+        price_text = f"{product['price']} RSD/100г" if unit_type == 'grams' else f"{product['price']} RSD/шт"
+        stock_status = "✅" if product['available'] and product['stock_grams'] > 0 else "⏳"
+        builder.row(InlineKeyboardButton(
+            text=f"{stock_status} {product['name']} - {price_text}",
+            callback_data=f"product:{product['id']}:{category_id}"
+        ))
+    builder.row(
+        InlineKeyboardButton(text="⬅️ Назад", callback_data="catalog"),
+        InlineKeyboardButton(text="🛒 Корзина", callback_data="cart_check")
+    )
+    return builder.as_markup()
+
+
+async def fill(sizes) -> dict:
+    """Категория на каждый размер и EXTRA_CATEGORIES категорий по товару; {размер: id категории}"""
+    values = dict(price=100, stock_grams=100000, unit_type="grams", measurement_step=100,
+                  available=True, is_active=True, hide_when_zero=True, is_hypoallergenic=False,
+                  description="Сушеное мясо")
+    categories = {}
+    async with get_session() as session:
+        for name, count in [(f"Товаров: {n}", n) for n in sizes] + [
+            (f"Разное {i}", 1) for i in range(EXTRA_CATEGORIES)
+        ]:
+            category = Category(name=name)
+            session.add(category)
+            await session.flush()
+            categories.setdefault(count, category.id)
+            await session.execute(insert(Product), [
+                {**values, "name": f"Лакомство {category.id}-{i}", "category_id": category.id}
+                for i in range(count)
+            ])
+    return categories
+
+
+def _ms(func, repeats: int = REPEATS) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - started) * 1000 / repeats
+
+
+def _buttons(markup: InlineKeyboardMarkup) -> int:
+    return sum(len(row) for row in markup.inline_keyboard)
+
+
+async def keyboard_build(categories: dict):
+    rows = []
+    for size in SIZES:
+        category_id = categories[size]
+        products = await catalog_service.get_products_by_category(category_id)
+        last = page_count(len(products), PRODUCTS_PAGE_SIZE) - 1
+        legacy = legacy_products_keyboard(products, category_id)
+        page = products_keyboard(products, category_id, last)
+        keyboard_cache.clear()
+        keyboard_cache.get(("products", category_id, last), catalog_cache.version,
+                           lambda: products_keyboard(products, category_id, last))
+        rows.append({
+            "products": size,
+            "old_ms": _ms(lambda: legacy_products_keyboard(products, category_id), 5 if size > 500 else REPEATS),
+            "old_json_ms": _ms(lambda: legacy.model_dump_json(exclude_none=True), 5 if size > 500 else REPEATS),
+            "old_buttons": _buttons(legacy),
+            "old_kb": len(legacy.model_dump_json(exclude_none=True)) / 1024,
+            "page_ms": _ms(lambda: products_keyboard(products, category_id, last)),
+            "page_json_ms": _ms(lambda: page.model_dump_json(exclude_none=True)),
+            "page_buttons": _buttons(page),
+            "page_kb": len(page.model_dump_json(exclude_none=True)) / 1024,
+            "cached_us": _ms(lambda: keyboard_cache.get(
+                ("products", category_id, last), catalog_cache.version,
+                lambda: products_keyboard(products, category_id, last)
+            ), 1000) * 1000
+        })
+    print_table("Клавиатура категории (последняя страница): сборка, JSON, кнопки", rows)
+
+
+async def taps(dp, bot, data_for, mode: str) -> dict:
+    """TAPS нажатий; mode: old - прежняя клавиатура, page - без кэша, cached - с кэшем"""
+    original = handlers.products_keyboard
+    if mode == "old":
+        handlers.products_keyboard = legacy_products_keyboard
+    rng = random.Random(5)
+    samples = []
+    try:
+        for i in range(TAPS):
+            if mode != "cached":
+                keyboard_cache.clear()
+            update = callback_update(5000 + i % 20, data_for(rng), message_id=i)
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            samples.append((time.perf_counter() - started) * 1000)
+    finally:
+        handlers.products_keyboard = original
+    return percentiles(samples)
+
+
+async def dispatcher_taps(categories: dict):
+    unthrottle()
+    bot = fake_bot()
+    dp = build_dispatcher()
+    catalog_pages = page_count(len(await catalog_service.get_categories()) + 1, CATEGORIES_PAGE_SIZE)
+
+    cases = [
+        (f"catalog:p<n> ({catalog_pages} стр.)", lambda rng: f"catalog:p{rng.randrange(catalog_pages)}")
+    ]
+    for size in SIZES:
+        category_id = categories[size]
+        pages = page_count(size, PRODUCTS_PAGE_SIZE)
+        cases.append((f"category {size}: первая", lambda rng, c=category_id: f"category:{c}"))
+        cases.append((f"category {size}: p<n> ({pages} стр.)",
+                      lambda rng, c=category_id, p=pages: f"category:{c}:p{rng.randrange(p)}"))
+
+    rows = []
+    for label, data_for in cases:
+        row = {"tap": label}
+        for mode in ("old", "page", "cached"):
+            # Категорий немного - прежнюю клавиатуру каталога не сравниваем
+            if mode == "old" and label.startswith("catalog"):
+                row["old_p50"] = row["old_p99"] = "-"
+                continue
+            stats = await taps(dp, bot, data_for, mode)
+            row[f"{mode}_p50"] = stats["p50"]
+            row[f"{mode}_p99"] = stats["p99"]
+        rows.append(row)
+    print_table(
+        f"Нажатия через Dispatcher, мс ({TAPS} нажатий, 20 пользователей; "
+        f"old - прежняя клавиатура категории, page - страница без кэша, cached - с keyboard_cache)",
+        rows
+    )
+
+
+async def main():
+    await init_db()
+    categories = await fill(SIZES)
+    await catalog_cache.load()
+    await keyboard_build(categories)
+    await dispatcher_taps(categories)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
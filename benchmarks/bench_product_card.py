@@ -0,0 +1,112 @@
+"""
+Карточка товара: запросы к БД и время на нажатие
+
+1. Данные карточки: прежний путь (три сессии: get_product, get_or_create_user,
+   select CartItem) против ProductCardService.get_card - со снимком каталога
+   и без него.
+2. Нажатия product:, qty_inc: и cart_add: через Dispatcher: среднее число
+   запросов и время по сводке UpdateTimingMiddleware.
+
+    python benchmarks/bench_product_card.py
+"""
+import asyncio
+import random
+import time
+
+from sqlalchemy import select
+
+from common import (configure, percentiles, print_table, fake_bot, build_dispatcher,
+                    callback_update, fill_catalog, unthrottle)
+
+configure("product-card")
+
+from database import init_db, engine, get_session, CartItem  # noqa: E402
+from catalog_cache import catalog_cache  # noqa: E402
+from services import cart_service, catalog_service, product_card_service  # noqa: E402
+from request_metrics import install_query_hooks, current_update, UpdateContext, update_stats  # noqa: E402
+from middlewares import UpdateTimingMiddleware  # noqa: E402
+
+TAPS = 300
+
+
+async def legacy_card(telegram_id: int, product_id: int):
+    """Как карточка собиралась до ProductCardService"""
+    product = await catalog_service.get_product(product_id)
+    user = await cart_service.get_or_create_user(telegram_id)
+    async with get_session() as session:
+        result = await session.execute(
+            select(CartItem).where(CartItem.user_id == user.id, CartItem.product_id == product_id)
+        )
+        cart_item = result.scalar_one_or_none()
+    return product, cart_item.quantity if cart_item else 0
+
+
+async def measure(label, make_call, product_ids):
+    rng = random.Random(3)
+    samples, queries = [], 0
+    for i in range(TAPS):
+        ctx = UpdateContext()
+        token = current_update.set(ctx)
+        started = time.perf_counter()
+        try:
+            await make_call(2000 + i % 20, rng.choice(product_ids))
+        finally:
+            current_update.reset(token)
+        samples.append((time.perf_counter() - started) * 1000)
+        queries += ctx.queries
+    stats = percentiles(samples)
+    return {"path": label, "queries": queries / TAPS, "p50": stats["p50"], "p99": stats["p99"]}
+
+
+async def card_data(product_ids):
+    users = {}
+    for telegram_id in range(2000, 2020):
+        users[telegram_id] = (await cart_service.get_or_create_user(telegram_id)).id
+
+    async def get_card(telegram_id, product_id):
+        return await product_card_service.get_card(users[telegram_id], product_id)
+
+    snapshot = catalog_cache._snapshot
+    catalog_cache._snapshot = None
+    rows = [
+        await measure("3 сессии (прежний путь)", legacy_card, product_ids),
+        await measure("get_card без снимка", get_card, product_ids),
+    ]
+    catalog_cache._snapshot = snapshot
+    rows.append(await measure("get_card со снимком", get_card, product_ids))
+    print_table(f"Данные карточки: запросов и мс на нажатие ({TAPS} нажатий)", rows)
+
+
+async def handler_taps(category_id, product_ids):
+    unthrottle()
+    bot = fake_bot()
+    dp = build_dispatcher()
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    update_stats.reset()
+
+    rng = random.Random(4)
+    for i in range(TAPS):
+        user_id = 3000 + i % 20
+        product_id = rng.choice(product_ids)
+        await dp.feed_update(bot, callback_update(user_id, f"product:{product_id}:{category_id}", message_id=i))
+        await dp.feed_update(bot, callback_update(user_id, f"qty_inc:{product_id}:{category_id}", message_id=i))
+        await dp.feed_update(bot, callback_update(user_id, f"cart_add:{product_id}:100:{category_id}", message_id=i))
+
+    print_table("Нажатия через Dispatcher (сводка UpdateTimingMiddleware)", [
+        {k: row[k] for k in ("label", "count", "avg_queries", "max_queries", "avg_ms", "avg_db_ms")}
+        for row in update_stats.report(by="avg_queries")
+    ])
+
+
+async def main():
+    await init_db()
+    install_query_hooks(engine)
+    (category_id,) = await fill_catalog(1, 200)
+    await catalog_cache.load()
+    product_ids = list(catalog_cache.snapshot.products)
+    await card_data(product_ids)
+    await handler_taps(category_id, product_ids)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+"""
+Поиск товаров: p50/p99 на 100 тысячах товаров
+
+Каталог из --products синтетических товаров: в названии слово-лакомство
+в разных падежах и прилагательные, в описании - слова из словаря
+примерно в 4 тысячи слов. Запросы (формы слов, недописанные слова,
+несколько слов, редкие слова) выполняются по две страницы:
+- без кэша (кэш страниц очищается перед каждым запросом);
+- из кэша страниц;
+- запасной поиск подстроки в названии (без FTS5) - для сравнения.
+
+    python benchmarks/bench_search.py [--products 100000]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import insert
+
+from common import configure, percentiles, print_table
+
+configure("search")
+
+import search  # noqa: E402
+from database import init_db, get_session, Category, Product  # noqa: E402
+from catalog_cache import catalog_cache  # noqa: E402
+from search import product_search, build_match_query  # noqa: E402
+
+ROUNDS = 5
+
+TREATS = [
+    ("ягнёнок", "ягнёнка", "ягнёнком"), ("огурец", "огурца", "огурцом"), ("печенье", "печенья", "печеньем"),
+    ("торт", "торта", "тортами"), ("кролик", "кролика", "кроликом"), ("индейка", "индейки", "индейкой"),
+    ("утка", "утки", "уткой"), ("лосось", "лосося", "лососем"), ("говядина", "говядины", "говядиной"),
+    ("цыпленок", "цыпленка", "цыпленком"), ("сердце", "сердца", "сердцем"), ("хвостик", "хвостика", "хвостиками"),
+    ("кусочек", "кусочка", "кусочками"), ("трахея", "трахеи", "трахеей"), ("рубец", "рубца", "рубцом"),
+    ("желудок", "желудка", "желудками"), ("копыто", "копыта", "копытами"), ("мешок", "мешка", "мешками"),
+]
+ADJECTIVES = ["сушеный", "вяленый", "хрустящий", "мягкий", "гипоаллергенный", "натуральный",
+              "домашний", "нежный", "большой", "маленький", "сырный", "овощной"]
+SYLLABLES = ["ба", "ве", "го", "ду", "жи", "за", "ки", "ло", "му", "не", "по", "ри", "со", "ту", "фа", "хо",
+             "ча", "ше", "ям", "ор", "ил", "ен", "ус", "ак"]
+
+QUERIES = [
+    "печенье", "ягнёнка", "ягненок", "огурцом", "цыпленка", "сушеный кролик", "мягкие кусочки", "индейк",
+    "утка с тыквой", "лосось", "желудки говяжьи", "хрустящие мешки", "рубец вяленый", "нежное сердце",
+    "копыта", "хвостики", "торт", "tort",
+]
+
+
+def vocabulary(rng: random.Random, size: int) -> list:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+async def fill(count: int) -> None:
+    rng = random.Random(11)
+    words = vocabulary(rng, 3800)
+    values = dict(price=100, stock_grams=100000, unit_type="grams", measurement_step=100,
+                  available=True, is_active=True, hide_when_zero=True, is_hypoallergenic=False)
+    async with get_session() as session:
+        category = Category(name="Лакомства")
+        session.add(category)
+        await session.flush()
+        for start in range(0, count, 10000):
+            rows = []
+            for i in range(start, min(start + 10000, count)):
+                treat = rng.choice(rng.choice(TREATS))
+                name = f"{rng.choice(ADJECTIVES).capitalize()} {treat} {rng.choice(words)} №{i}"
+                description = " ".join(rng.choice(words) for _ in range(rng.randint(8, 16)))
+                if rng.random() < 0.3:
+                    description += f" с {rng.choice(rng.choice(TREATS))}"
+                rows.append({**values, "name": name, "description": description, "category_id": category.id})
+            await session.execute(insert(Product), rows)
+    await catalog_cache.load()
+
+
+async def run_queries(label: str, clear: bool) -> dict:
+    samples, per_query = [], {}
+    for _ in range(ROUNDS):
+        for query in QUERIES:
+            for page in (0, 1):
+                if clear:
+                    product_search.clear_cache()
+                started = time.perf_counter()
+                result = await product_search.search(query, page)
+                elapsed = (time.perf_counter() - started) * 1000
+                assert result["success"], result
+                samples.append(elapsed)
+                per_query.setdefault(query, []).append(elapsed)
+    stats = percentiles(samples)
+    slowest = max(per_query, key=lambda q: percentiles(per_query[q])["p99"])
+    return {"mode": label, "n": stats["n"], "p50": stats["p50"], "p95": stats["p95"],
+            "p99": stats["p99"], "max": stats["max"], "slowest": slowest}
+
+
+async def matches(query: str) -> int:
+    from sqlalchemy import text
+
+    match = build_match_query(query)
+    async with get_session() as session:
+        return await session.scalar(text("SELECT count(*) FROM products_fts WHERE products_fts MATCH :m"),
+                                    {"m": match})
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100000)
+    args = parser.parse_args()
+
+    await init_db()
+    started = time.perf_counter()
+    await fill(args.products)
+    print(f"Каталог: {args.products} товаров за {time.perf_counter() - started:.1f} с")
+
+    await run_queries("прогрев", clear=True)
+    rows = [await run_queries("FTS5 без кэша", clear=True)]
+    # Первый проход заполняет кэш страниц
+    await run_queries("прогрев кэша", clear=False)
+    rows.append(await run_queries("кэш страниц", clear=False))
+    search.IS_SQLITE = False
+    rows.append(await run_queries("подстрока в названии", clear=True))
+    search.IS_SQLITE = True
+
+    print_table(
+        f"Поиск: {len(QUERIES)} запросов x 2 страницы x {ROUNDS}, мс ({args.products} товаров)", rows
+    )
+    print_table("Совпадений в индексе", [
+        {"query": query, "match": build_match_query(query), "rows": await matches(query)} for query in QUERIES
+    ])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
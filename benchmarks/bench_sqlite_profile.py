@@ -0,0 +1,120 @@
+"""
+Профиль SQLite (database.SQLITE_PROFILE): пропускная способность корзины и оформления
+
+Покупатели параллельно кладут товары в корзину, читают корзину и карточки,
+оформляют заказ. Каждый профиль запускается в отдельном процессе (профиль
+читается при импорте database), в конце - сравнительная таблица.
+
+    python benchmarks/bench_sqlite_profile.py [--customers 50] [--rounds 10]
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+from common import configure, percentiles, print_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", help="запустить один профиль (внутренний режим)")
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=10)
+    return parser.parse_args()
+
+
+async def run_profile(profile: str, customers: int, rounds: int) -> dict:
+    configure(f"sqlite-{profile}", SQLITE_PROFILE=profile)
+
+    from common import fill_catalog
+    from database import init_db, get_session, User, check_sqlite_profile
+    from catalog_cache import catalog_cache
+    from services import cart_service, checkout_service, product_card_service
+
+    await init_db()
+    await fill_catalog(10, 50)
+    await catalog_cache.load()
+    pragmas = await check_sqlite_profile()
+    product_ids = list(catalog_cache.snapshot.products)
+
+    async with get_session() as session:
+        users = [User(telegram_id=str(50_000 + i)) for i in range(customers)]
+        session.add_all(users)
+        await session.flush()
+        user_ids = [u.id for u in users]
+
+    samples = {"add_to_cart": [], "get_cart": [], "card": [], "checkout": []}
+    errors = {}
+
+    async def timed(kind, coro):
+        # Ошибки (database is locked) считаются, а не прерывают прогон
+        started = time.perf_counter()
+        try:
+            result = await coro
+        except Exception as e:
+            name = type(getattr(e, "orig", e)).__name__
+            errors[name] = errors.get(name, 0) + 1
+            return None
+        samples[kind].append((time.perf_counter() - started) * 1000)
+        return result
+
+    async def customer(user_id: int, rng: random.Random):
+        for _ in range(rounds):
+            for product_id in rng.sample(product_ids, 3):
+                await timed("card", product_card_service.get_card(user_id, product_id))
+                await timed("add_to_cart", cart_service.add_to_cart(user_id, product_id, 200))
+            cart = await timed("get_cart", cart_service.get_cart(user_id))
+            if cart is None or not cart["items"]:
+                continue
+            await timed("checkout", checkout_service.checkout(
+                user_id, "Рекс", "@rex", "Белград", cart["items"], cart["total_price"]
+            ))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(uid, random.Random(uid)) for uid in user_ids))
+    elapsed = time.perf_counter() - started
+
+    operations = sum(len(v) for v in samples.values())
+    return {
+        "profile": profile,
+        "journal_mode": pragmas.get("journal_mode"),
+        "seconds": elapsed,
+        "ops_per_s": operations / elapsed,
+        "checkouts_per_s": len(samples["checkout"]) / elapsed,
+        "errors": sum(errors.values()),
+        "error_types": errors,
+        "latency": {kind: percentiles(values) for kind, values in samples.items()}
+    }
+
+
+def main():
+    args = parse_args()
+    if args.profile:
+        result = asyncio.run(run_profile(args.profile, args.customers, args.rounds))
+        print(json.dumps(result))
+        return
+
+    results = []
+    for profile in ("default", "production"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--profile", profile,
+             "--customers", str(args.customers), "--rounds", str(args.rounds)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print_table(f"Пропускная способность ({args.customers} покупателей x {args.rounds} заказов)", [
+        {k: r[k] for k in ("profile", "journal_mode", "seconds", "ops_per_s", "checkouts_per_s", "errors")}
+        for r in results
+    ])
+    print_table("Задержка операций, мс", [
+        {"profile": r["profile"], "operation": kind, "p50": stats["p50"], "p99": stats["p99"], "max": stats["max"]}
+        for r in results for kind, stats in r["latency"].items()
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Webhook: пропускная способность от HTTP-запроса до обработанного обновления
+
+Приложение create_app() поднимается на localhost, клиент aiohttp шлет
+синтетические обновления (нажатия category:, product:, qty_inc:) с
+секретным заголовком. Меряем:
+- время ответа webhook (Telegram ждет только его);
+- обновлений в секунду до полной обработки (processed + failed
+  LimitedRequestHandler) при разном числе одновременных соединений
+  и разном WEBHOOK_MAX_CONCURRENCY.
+
+    python benchmarks/bench_webhook.py
+"""
+import asyncio
+import random
+import time
+
+from common import (configure, percentiles, print_table, fake_bot, build_dispatcher,
+                    callback_update, fill_catalog, unthrottle)
+
+configure("webhook")
+
+from aiohttp import ClientSession, TCPConnector, web  # noqa: E402
+
+from database import init_db  # noqa: E402
+from catalog_cache import catalog_cache  # noqa: E402
+from config import settings  # noqa: E402
+from webhook import create_app  # noqa: E402
+
+UPDATES = 2000
+SECRET = "bench-secret"
+
+
+def make_updates(count, category_id, product_ids):
+    rng = random.Random(5)
+    updates = []
+    for i in range(count):
+        user_id = 5000 + i % 200
+        product_id = rng.choice(product_ids)
+        data = rng.choice([
+            f"category:{category_id}",
+            f"product:{product_id}:{category_id}",
+            f"qty_inc:{product_id}:{category_id}"
+        ])
+        update = callback_update(user_id, data, message_id=i)
+        updates.append(update.model_dump(mode="json", exclude_none=True))
+    return updates
+
+
+async def run_case(dp, connections, max_concurrency, updates):
+    settings.webhook_max_concurrency = max_concurrency
+    app = create_app(dp, fake_bot(latency=0.005), SECRET)
+    handler = app["webhook_handler"]
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}{settings.webhook_path}"
+
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+    response_ms, statuses = [], {}
+
+    async def client(session):
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            async with session.post(url, json=update,
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+                await response.read()
+            response_ms.append((time.perf_counter() - started) * 1000)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=connections)) as session:
+        await asyncio.gather(*(client(session) for _ in range(connections)))
+        accepted = time.perf_counter() - started
+        while handler.processed + handler.failed < statuses.get(200, 0):
+            await asyncio.sleep(0.005)
+    total = time.perf_counter() - started
+
+    await handler.close()
+    await runner.cleanup()
+
+    stats = percentiles(response_ms)
+    return {
+        "connections": connections,
+        "concurrency": max_concurrency,
+        "accepted/s": len(updates) / accepted,
+        "processed/s": handler.processed / total,
+        "failed": handler.failed,
+        "non_200": sum(n for status, n in statuses.items() if status != 200),
+        "resp_p50": stats["p50"],
+        "resp_p99": stats["p99"]
+    }
+
+
+async def main():
+    await init_db()
+    (category_id,) = await fill_catalog(1, 200)
+    await catalog_cache.load()
+    product_ids = list(catalog_cache.snapshot.products)
+    updates = make_updates(UPDATES, category_id, product_ids)
+
+    unthrottle()
+    dp = build_dispatcher()
+    rows = []
+    # Прогрев: пользователи, соединения с БД
+    await run_case(dp, 8, 32, updates[:300])
+    for connections, max_concurrency in [(1, 32), (8, 32), (40, 32), (40, 8), (40, 128)]:
+        unthrottle()
+        rows.append(await run_case(dp, connections, max_concurrency, updates))
+    print_table(f"Webhook: {UPDATES} обновлений, Bot API с задержкой 5 мс; ответ webhook, мс", rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
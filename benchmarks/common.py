@@ -0,0 +1,204 @@
+"""
+Общее для бенчмарков Barkery Shop
+
+Каждый бенчмарк запускается отдельным процессом из корня репозитория
+(python benchmarks/bench_<имя>.py): configure() задает временную БД и
+переменные окружения до импорта модулей бота. Запросы к Telegram уходят
+в fake_session() - ответы без сети с настраиваемой задержкой.
+"""
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure(name: str, **env) -> str:
+    """Временный каталог с БД бенчмарка; вызывать до импорта модулей бота"""
+    workdir = tempfile.mkdtemp(prefix=f"barkery-bench-{name}-")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ.setdefault("BOT_TOKEN", "42:TEST")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ["BACKUP_ENABLED"] = "0"
+    os.environ.setdefault("REDIS_URL", "")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    import logging
+    logging.disable(logging.WARNING)
+    return workdir
+
+
+def percentiles(samples_ms: Iterable[float]) -> Dict[str, float]:
+    samples = sorted(samples_ms)
+    if not samples:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "mean": 0.0}
+
+    def at(q: float) -> float:
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    return {
+        "n": len(samples),
+        "p50": at(0.50),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": samples[-1],
+        "mean": sum(samples) / len(samples)
+    }
+
+
+def print_table(title: str, rows: List[Dict], columns: Optional[List[str]] = None) -> None:
+    """Таблица результатов: rows - словари с одинаковыми ключами"""
+    print(f"\n{title}")
+    if not rows:
+        return
+    columns = columns or list(rows[0])
+    widths = {c: max(len(c), *(len(_fmt(r.get(c))) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(_fmt(row.get(c)).rjust(widths[c]) for c in columns))
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}" if value < 100 else f"{value:.0f}"
+    return str(value)
+
+
+async def timed(coro) -> float:
+    """Время выполнения корутины, мс"""
+    started = time.perf_counter()
+    await coro
+    return (time.perf_counter() - started) * 1000
+
+
+# ---------- Telegram без сети ----------
+
+def unthrottle() -> None:
+    """Снять ограничения outbound (лимиты Telegram мерим отдельно, bench_outbound.py)"""
+    from outbound import outbound, TokenBucket
+
+    outbound.chat_rate = outbound.chat_burst = 1e6
+    outbound._global = TokenBucket(1e6, 1e6)
+    outbound._deletes = TokenBucket(1e6, 1e6)
+    outbound._chats.clear()
+
+
+def fake_bot(latency: float = 0.0, calls: Optional[list] = None):
+    """Bot, запросы которого обрабатывает fake_session()"""
+    from aiogram import Bot
+
+    return Bot("42:TEST", session=fake_session(latency, calls))
+
+
+def fake_session(latency: float = 0.0, calls: Optional[list] = None):
+    """
+    Сессия aiogram без сети: каждый запрос ждет latency секунд и получает
+    правдоподобный ответ. calls - список, куда складываются все запросы.
+    """
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message, PhotoSize, User
+
+    class FakeTelegramSession(BaseSession):
+        async def make_request(self, bot, method, timeout=None):
+            if calls is not None:
+                calls.append(method)
+            if latency:
+                await asyncio.sleep(latency)
+            name = type(method).__name__
+            if name == "GetMe":
+                return User(id=42, is_bot=True, first_name="bench", username="barkery_bot")
+            if method.__returning__ is bool:
+                return True
+            chat = Chat(id=getattr(method, "chat_id", 1) or 1, type="private")
+            now = datetime.datetime.now()
+            if name == "SendPhoto":
+                return Message(message_id=1, date=now, chat=chat, photo=[
+                    PhotoSize(file_id="photo", file_unique_id="photo", width=1280, height=960)
+                ])
+            return Message(message_id=1, date=now, chat=chat, text="ok")
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return FakeTelegramSession()
+
+
+def build_dispatcher(storage=None):
+    """Dispatcher с роутерами и middleware, как в barkery_bot.main"""
+    from aiogram import Dispatcher
+    from admin import admin_router
+    from handlers import router as main_router
+    from middlewares import UserIdentityMiddleware, PerformanceMiddleware
+
+    if not getattr(main_router, "_bench_ready", False):
+        main_router.message.middleware(UserIdentityMiddleware())
+        main_router.callback_query.middleware(UserIdentityMiddleware())
+        for router in (admin_router, main_router):
+            router.message.middleware(PerformanceMiddleware("message"))
+            router.callback_query.middleware(PerformanceMiddleware("callback"))
+        main_router._bench_ready = True
+    dp = Dispatcher(storage=storage) if storage is not None else Dispatcher()
+    dp.include_router(admin_router)
+    dp.include_router(main_router)
+    return dp
+
+
+_update_id = 0
+
+
+def callback_update(user_id: int, data: str, message_id: int = 10):
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+    global _update_id
+    _update_id += 1
+    user = User(id=user_id, is_bot=False, first_name="bench")
+    message = Message(message_id=message_id, date=datetime.datetime.now(),
+                      chat=Chat(id=user_id, type="private"), text="x")
+    return Update(update_id=_update_id, callback_query=CallbackQuery(
+        id=str(_update_id), from_user=user, chat_instance="bench", data=data, message=message
+    ))
+
+
+def message_update(user_id: int, text: str):
+    from aiogram.types import Chat, Message, Update, User
+
+    global _update_id
+    _update_id += 1
+    user = User(id=user_id, is_bot=False, first_name="bench")
+    return Update(update_id=_update_id, message=Message(
+        message_id=_update_id, date=datetime.datetime.now(),
+        chat=Chat(id=user_id, type="private"), from_user=user, text=text
+    ))
+
+
+async def fill_catalog(categories: int, products_per_category: int, **fields) -> List[int]:
+    """Заполнить каталог одним INSERT на категорию; возвращает id категорий"""
+    from sqlalchemy import insert
+    from database import get_session, Category, Product
+
+    category_ids = []
+    async with get_session() as session:
+        for c in range(categories):
+            category = Category(name=f"Категория {c}")
+            session.add(category)
+            await session.flush()
+            category_ids.append(category.id)
+            values = dict(price=100, stock_grams=100000, unit_type="grams", measurement_step=100,
+                          available=True, is_active=True, hide_when_zero=True, is_hypoallergenic=False)
+            values.update(fields)
+            await session.execute(insert(Product), [
+                {**values, "name": f"Лакомство {c}-{i}", "description": "Сушеное мясо",
+                 "category_id": category.id}
+                for i in range(products_per_category)
+            ])
+    return category_ids
@@ -0,0 +1,366 @@
+"""
+Снимок каталога в памяти для Barkery Shop
+
+Категории и товары загружаются один раз при старте и отдаются из памяти.
+Любое изменение товара (админка, списание остатков) сразу пересобирает
+или точечно обновляет снимок (write-through), поэтому просмотр каталога
+не делает запросов к БД.
+
+С общим бэкендом (Redis) каждое изменение пишется в общий журнал
+изменений каталога: id измененных товаров или "весь каталог" (категории).
+Остальные процессы проверяют журнал раз в sync_interval секунд,
+перечитывают только измененные товары (полная загрузка - при изменении
+категорий или пропуске записей журнала) и сбрасывают зависимые кэши
+(слушатели add_listener).
+"""
+import asyncio
+import logging
+import uuid
+from bisect import bisect_left, insort
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set
+
+from sqlalchemy import select
+
+from database import get_session, Category, Product
+from availability import is_visible_value
+from shared_state import StateBackend, shared_state
+
+logger = logging.getLogger(__name__)
+
+
+def product_to_dict(product: Product) -> Dict:
+    """Преобразовать ORM-объект товара в словарь (формат CatalogService)"""
+    return {
+        "id": product.id,
+        "name": product.name,
+        "description": product.description,
+        "price": product.price,
+        "stock_grams": product.stock_grams,
+        "image_url": product.image_url,
+        "available": product.available,
+        "is_active": product.is_active,
+        "unit_type": product.unit_type,
+        "measurement_step": product.measurement_step,
+        "hide_when_zero": product.hide_when_zero,
+        "is_hypoallergenic": product.is_hypoallergenic,
+        "category_id": product.category_id
+    }
+
+
+def is_product_visible(product: Mapping) -> bool:
+    """
+    Виден ли товар покупателю.
+    Та же логика, что и в SQL-фильтре CatalogService.get_products_by_category
+    """
+    return is_visible_value(product)
+
+
+def _product_order(product: Mapping):
+    """Порядок товаров в категории: по названию (как ORDER BY name), при равных - по id"""
+    return product["name"], product["id"]
+
+
+def _replaced(items: Iterable[Mapping], removed: List[Mapping], added: List[Mapping]) -> tuple:
+    """Отсортированный список товаров без removed и с added (поиск позиции - бинарный)"""
+    items = list(items)
+    for product in removed:
+        i = bisect_left(items, _product_order(product), key=_product_order)
+        if i < len(items) and items[i]["id"] == product["id"]:
+            del items[i]
+    for product in added:
+        insort(items, product, key=_product_order)
+    return tuple(items)
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога с готовыми индексами"""
+
+    __slots__ = ("version", "categories", "categories_by_id", "products",
+                 "products_by_category", "hypoallergenic")
+
+    def __init__(self, version: int, categories: Iterable[Dict], products: Iterable[Dict]):
+        categories = sorted(
+            (MappingProxyType(dict(c)) for c in categories),
+            key=lambda c: c["name"]
+        )
+        products_by_id = {p["id"]: MappingProxyType(dict(p)) for p in products}
+
+        # Видимые товары по категориям, отсортированные по названию (как ORDER BY name)
+        by_category: Dict[int, List[Mapping]] = {}
+        hypoallergenic = []
+        for product in sorted(products_by_id.values(), key=_product_order):
+            if not is_product_visible(product):
+                continue
+            by_category.setdefault(product["category_id"], []).append(product)
+            if product["is_hypoallergenic"]:
+                hypoallergenic.append(product)
+
+        set_ = object.__setattr__
+        set_(self, "version", version)
+        set_(self, "categories", tuple(categories))
+        set_(self, "categories_by_id", MappingProxyType({c["id"]: c for c in categories}))
+        set_(self, "products", MappingProxyType(products_by_id))
+        set_(self, "products_by_category", MappingProxyType(
+            {cid: tuple(items) for cid, items in by_category.items()}
+        ))
+        set_(self, "hypoallergenic", tuple(hypoallergenic))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CatalogSnapshot неизменяем")
+
+    def with_products(self, version: int, updates: Dict[int, Optional[Dict]]) -> "CatalogSnapshot":
+        """
+        Новый снимок с заменой товаров (None - товар удален).
+        Пересобираются только категории затронутых товаров, остальные
+        индексы переиспользуются: продажа не пересортировывает весь каталог.
+        """
+        products = self.products.copy()
+        # Старые и новые версии товаров по категориям и для списка гипоаллергенных
+        removed: Dict[int, List[Mapping]] = {}
+        added: Dict[int, List[Mapping]] = {}
+        hypo_removed: List[Mapping] = []
+        hypo_added: List[Mapping] = []
+
+        for product_id, product in updates.items():
+            old = products.get(product_id)
+            if old is not None:
+                removed.setdefault(old["category_id"], []).append(old)
+                if old["is_hypoallergenic"]:
+                    hypo_removed.append(old)
+            if product is None:
+                products.pop(product_id, None)
+                continue
+            product = MappingProxyType(dict(product))
+            products[product_id] = product
+            removed.setdefault(product["category_id"], [])
+            if is_product_visible(product):
+                added.setdefault(product["category_id"], []).append(product)
+                if product["is_hypoallergenic"]:
+                    hypo_added.append(product)
+
+        by_category = self.products_by_category.copy()
+        for category_id, old_items in removed.items():
+            items = _replaced(by_category.get(category_id, ()), old_items, added.get(category_id, []))
+            if items:
+                by_category[category_id] = items
+            else:
+                by_category.pop(category_id, None)
+
+        hypoallergenic = self.hypoallergenic
+        if hypo_removed or hypo_added:
+            hypoallergenic = _replaced(hypoallergenic, hypo_removed, hypo_added)
+
+        snapshot = object.__new__(CatalogSnapshot)
+        set_ = object.__setattr__
+        set_(snapshot, "version", version)
+        set_(snapshot, "categories", self.categories)
+        set_(snapshot, "categories_by_id", self.categories_by_id)
+        set_(snapshot, "products", MappingProxyType(products))
+        set_(snapshot, "products_by_category", MappingProxyType(by_category))
+        set_(snapshot, "hypoallergenic", hypoallergenic)
+        return snapshot
+
+
+class CatalogCache:
+    """Процессный кэш каталога с write-through инвалидацией"""
+
+    def __init__(self, backend: StateBackend = shared_state):
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        # Сериализуем чтение из БД и подмену снимка, чтобы не потерять обновления
+        self._lock = asyncio.Lock()
+
+        self.backend = backend
+        # Свои записи в журнале изменений пропускаем
+        self._origin = uuid.uuid4().hex
+        # Номер последней прочитанной записи журнала изменений каталога
+        self._shared_version: Optional[int] = None
+        self._listeners: List[Callable[[], None]] = []
+        self._sync_task: Optional[asyncio.Task] = None
+        self._publish_tasks: Set[asyncio.Task] = set()
+        self.remote_patches = 0
+        self.remote_reloads = 0
+
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        """Текущий снимок (None - не загружен, нужно идти в БД)"""
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        """Версия каталога (растет при каждом изменении)"""
+        return self._version
+
+    def _next_version(self) -> int:
+        self._version += 1
+        return self._version
+
+    async def load(self) -> Optional[CatalogSnapshot]:
+        """Полная загрузка каталога из БД"""
+        async with self._lock:
+            try:
+                async with get_session() as session:
+                    result = await session.execute(select(Category))
+                    categories = [{"id": c.id, "name": c.name} for c in result.scalars().all()]
+
+                    result = await session.execute(select(Product))
+                    products = [product_to_dict(p) for p in result.scalars().all()]
+
+                self._snapshot = CatalogSnapshot(self._next_version(), categories, products)
+                logger.info(
+                    f"Каталог загружен в память: {len(categories)} категорий, "
+                    f"{len(products)} товаров (версия {self._version})"
+                )
+            except Exception as e:
+                logger.error(f"Не удалось загрузить каталог в память: {e}")
+                self._snapshot = None
+            return self._snapshot
+
+    async def reload(self) -> Optional[CatalogSnapshot]:
+        """Пересобрать снимок целиком (изменения категорий)"""
+        snapshot = await self.load()
+        self._publish()
+        return snapshot
+
+    async def patch_products(self, product_ids: Iterable[int]) -> None:
+        """Перечитать указанные товары из БД и обновить снимок"""
+        product_ids = list(set(product_ids))
+        if not product_ids:
+            return
+        await self._patch(product_ids)
+        self._publish(product_ids)
+
+    async def _patch(self, product_ids: List[int]) -> None:
+        if self._snapshot is None:
+            await self.load()
+            return
+
+        async with self._lock:
+            try:
+                async with get_session() as session:
+                    result = await session.execute(
+                        select(Product).where(Product.id.in_(product_ids))
+                    )
+                    found = {p.id: product_to_dict(p) for p in result.scalars().all()}
+
+                updates = {pid: found.get(pid) for pid in product_ids}
+                self._snapshot = self._snapshot.with_products(self._next_version(), updates)
+            except Exception as e:
+                # Лучше временно ходить в БД, чем показывать устаревшие данные
+                logger.error(f"Не удалось обновить товары {product_ids} в кэше каталога: {e}")
+                self._snapshot = None
+
+    async def patch_product(self, product_id: int) -> None:
+        """Перечитать один товар из БД и обновить снимок"""
+        await self.patch_products([product_id])
+
+    def apply_product_fields(self, product_id: int, **fields) -> None:
+        """Точечно обновить поля товара без обращения к БД (данные уже известны)"""
+        self.apply_products_fields({product_id: fields})
+
+    def apply_products_fields(self, updates: Dict[int, Dict]) -> None:
+        """Обновить поля нескольких товаров одной подменой снимка (например, все позиции заказа)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        products = {}
+        for product_id, fields in updates.items():
+            if product_id in snapshot.products:
+                products[product_id] = {**snapshot.products[product_id], **fields}
+        if products:
+            self._snapshot = snapshot.with_products(self._next_version(), products)
+            self._publish(list(products))
+
+    # ---------- изменения в других процессах ----------
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Вызывать callback после перезагрузки каталога, измененного другим процессом"""
+        self._listeners.append(callback)
+
+    def _publish(self, product_ids: Optional[List[int]] = None) -> None:
+        """Сообщить другим процессам об изменении товаров (None - весь каталог), в фоне"""
+        if not self.backend.shared or self._shared_version is None:
+            return
+        change = {"origin": self._origin, "products": product_ids}
+        task = asyncio.create_task(self._broadcast(change))
+        self._publish_tasks.add(task)
+        task.add_done_callback(self._publish_tasks.discard)
+
+    async def _broadcast(self, change: Dict) -> None:
+        try:
+            await self.backend.publish_change("catalog", change)
+        except Exception as e:
+            logger.error(f"Не удалось опубликовать изменение каталога: {e}")
+
+    async def sync(self) -> bool:
+        """Применить изменения каталога из других процессов; True - снимок обновлен"""
+        head = await self.backend.log_version("catalog")
+        if self._shared_version is None:
+            self._shared_version = head
+            return False
+        if head <= self._shared_version:
+            return False
+
+        changes = await self.backend.changes_since("catalog", self._shared_version)
+        # Журнал ограничен: если первой записи уже нет - часть изменений пропущена
+        complete = bool(changes) and changes[0][0] == self._shared_version + 1
+        self._shared_version = max(head, changes[-1][0] if changes else head)
+
+        remote = [change for _, change in changes if change.get("origin") != self._origin]
+        if complete and not remote:
+            return False
+        if not complete or any(change.get("products") is None for change in remote):
+            await self.load()
+            self.remote_reloads += 1
+        else:
+            await self._patch(list({pid for change in remote for pid in change["products"]}))
+            self.remote_patches += 1
+
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка сброса кэша после изменения каталога: {e}")
+        return True
+
+    async def start_sync(self, interval: float = 1.0) -> None:
+        """Запомнить текущую общую версию и следить за ней (только для общего бэкенда)"""
+        if not self.backend.shared or self._sync_task is not None:
+            return
+        await self.sync()
+        self._sync_task = asyncio.create_task(self._sync_loop(interval))
+
+    async def _sync_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Не удалось проверить версию каталога: {e}")
+
+    async def stop_sync(self) -> None:
+        tasks = set(self._publish_tasks)
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            tasks.add(self._sync_task)
+            self._sync_task = None
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        """Краткая информация о снимке"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"loaded": False, "version": self._version}
+        return {
+            "loaded": True,
+            "version": snapshot.version,
+            "remote_patches": self.remote_patches,
+            "remote_reloads": self.remote_reloads,
+            "categories": len(snapshot.categories),
+            "products": len(snapshot.products)
+        }
+
+
+# Глобальный экземпляр
+catalog_cache = CatalogCache()
@@ -0,0 +1,439 @@
+"""
+Массовый импорт и экспорт каталога Barkery Shop (CSV, XLSX)
+
+Файл читается построчно и пишется в БД пачками по batch_size строк,
+каждая пачка - отдельная транзакция, поэтому в памяти одновременно
+находится только одна пачка, а бот продолжает обслуживать заказы.
+Товар ищется по id, а без id - по названию в категории; категории
+создаются по названию. Отчет об изменениях пишется в CSV по ходу
+импорта. Экспорт выбирает товары из БД порциями и пишет файл в том
+же формате, поэтому выгрузку можно отредактировать и загрузить обратно.
+XLSX требует пакет openpyxl.
+"""
+import asyncio
+import csv
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import get_session, Category, Product
+from availability import available_value
+
+logger = logging.getLogger(__name__)
+
+# Колонки файла (и порядок колонок при экспорте)
+COLUMNS = [
+    "id", "category", "name", "description", "price", "unit_type", "stock",
+    "image_url", "available", "is_active", "hide_when_zero", "is_hypoallergenic"
+]
+REPORT_COLUMNS = ["line", "action", "id", "name", "changes"]
+
+_TRUE = {"1", "да", "д", "yes", "y", "true", "+"}
+_FALSE = {"0", "нет", "н", "no", "n", "false", "-"}
+_UNIT_TYPES = {
+    "grams": "grams", "г": "grams", "гр": "grams",
+    "pieces": "pieces", "шт": "pieces"
+}
+# Поле файла -> колонка products
+_FIELDS = {
+    "name": "name",
+    "description": "description",
+    "price": "price",
+    "unit_type": "unit_type",
+    "stock": "stock_grams",
+    "image_url": "image_url",
+    "available": "available",
+    "is_active": "is_active",
+    "hide_when_zero": "hide_when_zero",
+    "is_hypoallergenic": "is_hypoallergenic"
+}
+
+
+class ImportRowError(ValueError):
+    """Строка файла не прошла проверку"""
+
+
+def _parse_bool(value: str, column: str) -> bool:
+    value = value.lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ImportRowError(f"{column}: ожидается да/нет, получено '{value}'")
+
+
+def parse_row(raw: Dict[str, str]) -> Dict:
+    """
+    Проверить строку файла и привести значения к типам БД.
+    Пустые ячейки пропускаются: при обновлении поле не меняется.
+    """
+    row = {}
+    for column in COLUMNS:
+        value = raw.get(column)
+        if value is None:
+            continue
+        value = str(value).strip()
+        if not value:
+            continue
+
+        if column == "id":
+            try:
+                row["id"] = int(float(value))
+            except ValueError:
+                raise ImportRowError(f"id: ожидается число, получено '{value}'")
+        elif column == "price":
+            try:
+                price = float(value.replace(",", ".").replace(" ", ""))
+            except ValueError:
+                raise ImportRowError(f"price: ожидается число, получено '{value}'")
+            if price <= 0:
+                raise ImportRowError("price: цена должна быть больше 0")
+            row["price"] = price
+        elif column == "stock":
+            try:
+                stock = int(float(value.replace(",", ".").replace(" ", "")))
+            except ValueError:
+                raise ImportRowError(f"stock: ожидается число, получено '{value}'")
+            if stock < 0:
+                raise ImportRowError("stock: количество не может быть отрицательным")
+            row["stock"] = stock
+        elif column == "unit_type":
+            unit_type = _UNIT_TYPES.get(value.lower())
+            if unit_type is None:
+                raise ImportRowError(f"unit_type: ожидается grams или pieces, получено '{value}'")
+            row["unit_type"] = unit_type
+        elif column in ("available", "is_active", "hide_when_zero", "is_hypoallergenic"):
+            row[column] = _parse_bool(value, column)
+        else:
+            row[column] = value
+
+    if "id" not in row:
+        # Новый товар или поиск по названию: нужны название и категория
+        if "name" not in row or "category" not in row:
+            raise ImportRowError("без id обязательны name и category")
+    return row
+
+
+def _iter_csv(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Строки CSV по одной (разделитель ; или , определяется по заголовку)"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        header = f.readline()
+        delimiter = ";" if header.count(";") > header.count(",") else ","
+        columns = [c.strip().lower() for c in next(csv.reader([header], delimiter=delimiter))]
+        reader = csv.reader(f, delimiter=delimiter)
+        for values in reader:
+            if not any(v.strip() for v in values):
+                continue
+            yield reader.line_num + 1, dict(zip(columns, values))
+
+
+def _iter_xlsx(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Строки первого листа XLSX (режим read_only - файл не грузится целиком)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("Для XLSX нужен пакет openpyxl: pip install openpyxl")
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = [str(c).strip().lower() if c is not None else "" for c in header]
+        for line, values in enumerate(rows, start=2):
+            if all(v is None or str(v).strip() == "" for v in values):
+                continue
+            yield line, {c: ("" if v is None else str(v)) for c, v in zip(columns, values)}
+    finally:
+        workbook.close()
+
+
+class CatalogImporter:
+    """Импорт и экспорт каталога"""
+
+    def __init__(self, batch_size: int = 500, error_samples: int = 10):
+        self.batch_size = batch_size
+        self.error_samples = error_samples
+        self._lock = asyncio.Lock()
+
+    # ---------- импорт ----------
+
+    async def import_file(self, path: str, report_path: str) -> Dict:
+        """Импортировать CSV/XLSX, отчет об изменениях записать в report_path"""
+        if self._lock.locked():
+            return {"success": False, "error": "Импорт уже выполняется"}
+
+        async with self._lock:
+            started = time.perf_counter()
+            stats = {
+                "rows": 0, "created": 0, "updated": 0, "unchanged": 0, "errors": 0,
+                "categories_created": 0, "error_samples": [], "changed_ids": []
+            }
+            rows_iter = _iter_xlsx(path) if path.lower().endswith(".xlsx") else _iter_csv(path)
+
+            try:
+                with open(report_path, "w", encoding="utf-8-sig", newline="") as report_file:
+                    report = csv.writer(report_file, delimiter=";")
+                    report.writerow(REPORT_COLUMNS)
+
+                    batch: List[Tuple[int, Dict]] = []
+                    for line, raw in rows_iter:
+                        stats["rows"] += 1
+                        try:
+                            batch.append((line, parse_row(raw)))
+                        except ImportRowError as e:
+                            self._row_error(stats, report, line, raw.get("name", ""), str(e))
+
+                        if len(batch) >= self.batch_size:
+                            await self._apply_batch(batch, report, stats)
+                            batch = []
+                    if batch:
+                        await self._apply_batch(batch, report, stats)
+            except (RuntimeError, UnicodeDecodeError, csv.Error) as e:
+                logger.error(f"❌ Ошибка импорта каталога: {e}")
+                return {"success": False, "error": str(e), **stats}
+
+            stats["duration"] = round(time.perf_counter() - started, 2)
+            logger.info(
+                f"📥 Импорт каталога: строк {stats['rows']}, создано {stats['created']}, "
+                f"обновлено {stats['updated']}, без изменений {stats['unchanged']}, "
+                f"ошибок {stats['errors']} ({stats['duration']} с)"
+            )
+            return {"success": True, **stats}
+
+    def _row_error(self, stats: Dict, report, line: int, name: str, error: str) -> None:
+        stats["errors"] += 1
+        if len(stats["error_samples"]) < self.error_samples:
+            stats["error_samples"].append(f"строка {line}: {error}")
+        report.writerow([line, "error", "", name, error])
+
+    async def _apply_batch(self, batch: List[Tuple[int, Dict]], report, stats: Dict) -> None:
+        """Записать пачку строк одной транзакцией"""
+        async with get_session() as session:
+            category_ids = await self._resolve_categories(
+                session, {row["category"] for _, row in batch if "category" in row}, stats
+            )
+
+            ids = {row["id"] for _, row in batch if "id" in row}
+            names = {row["name"] for _, row in batch if "id" not in row}
+            columns = [
+                Product.id, Product.category_id, Product.measurement_step,
+                *(getattr(Product, c) for c in _FIELDS.values())
+            ]
+
+            by_id: Dict[int, Dict] = {}
+            by_name: Dict[Tuple[str, int], Dict] = {}
+            if ids:
+                result = await session.execute(select(*columns).where(Product.id.in_(ids)))
+                by_id = {r["id"]: dict(r) for r in result.mappings()}
+            if names:
+                result = await session.execute(
+                    select(*columns).where(Product.name.in_(names)).order_by(Product.id.desc())
+                )
+                # При одинаковых названиях в категории берем товар с меньшим id
+                by_name = {(r["name"], r["category_id"]): dict(r) for r in result.mappings()}
+
+            updates: Dict[int, Dict] = {}
+            inserts: Dict[Tuple[str, int], Dict] = {}
+            entries = []
+
+            for line, row in batch:
+                category_id = category_ids.get(row["category"]) if "category" in row else None
+                if "id" in row:
+                    current = by_id.get(row["id"])
+                    if current is None:
+                        self._row_error(stats, report, line, row.get("name", ""), f"товар id={row['id']} не найден")
+                        continue
+                else:
+                    current = by_name.get((row["name"], category_id))
+
+                if current is None:
+                    key = (row["name"], category_id)
+                    values = inserts.get(key)
+                    if values is None:
+                        if "price" not in row:
+                            self._row_error(stats, report, line, row["name"], "для нового товара обязательна price")
+                            continue
+                        values = inserts[key] = self._new_product(category_id)
+                        entries.append((line, "created", key, values))
+                    # Повтор товара в той же пачке дополняет уже подготовленную вставку
+                    self._apply_values(values, row, category_id)
+                    continue
+
+                # Значения с учетом предыдущих строк этой же пачки
+                values = updates.setdefault(current["id"], {})
+                new = {**current, **values}
+                self._apply_values(new, row, category_id)
+                changes = {k: (current[k], v) for k, v in new.items() if k != "id" and v != current[k]}
+                values.clear()
+                values.update({k: v for k, (_, v) in changes.items()})
+                entries.append((line, "updated", current, changes))
+
+            if inserts:
+                # RETURNING без сортировки по параметрам - вставка идет пачками, а не по строке
+                result = await session.execute(
+                    insert(Product).returning(Product.id, Product.name, Product.category_id),
+                    list(inserts.values())
+                )
+                for new_id, name, category_id in result.all():
+                    inserts[(name, category_id)]["id"] = new_id
+
+            pending_updates = [{"id": pid, **values} for pid, values in updates.items() if values]
+            if pending_updates:
+                await session.execute(update(Product), pending_updates)
+
+        # Отчет пишем после фиксации транзакции
+        for line, action, target, data in entries:
+            if action == "created":
+                stats["created"] += 1
+                stats["changed_ids"].append(data["id"])
+                report.writerow([line, "created", data["id"], data["name"], ""])
+            elif data:
+                stats["updated"] += 1
+                stats["changed_ids"].append(target["id"])
+                changes = ", ".join(f"{k}: {old} -> {new}" for k, (old, new) in data.items())
+                report.writerow([line, "updated", target["id"], target["name"], changes])
+            else:
+                stats["unchanged"] += 1
+
+    @staticmethod
+    def _new_product(category_id: int) -> Dict:
+        return {
+            "category_id": category_id,
+            "description": "",
+            "image_url": None,
+            "unit_type": "grams",
+            "measurement_step": 100,
+            "stock_grams": 0,
+            "available": True,
+            "is_active": True,
+            "hide_when_zero": True,
+            "is_hypoallergenic": False
+        }
+
+    @staticmethod
+    def _apply_values(values: Dict, row: Dict, category_id: Optional[int]) -> None:
+        """Перенести поля строки в значения товара"""
+        for field, column in _FIELDS.items():
+            if field in row:
+                values[column] = row[field]
+        if category_id is not None:
+            values["category_id"] = category_id
+        if "unit_type" in row:
+            values["measurement_step"] = 100 if row["unit_type"] == 'grams' else 1
+
+        if "available" not in row and ("stock" in row or "id" not in values):
+            # Доступность по остатку - по тем же правилам, что и обновление каталога в админке
+            values["available"] = available_value(values)
+
+    async def _resolve_categories(self, session, names: set, stats: Dict) -> Dict[str, int]:
+        """id категорий по названиям, недостающие категории создаются"""
+        if not names:
+            return {}
+        result = await session.execute(select(Category.id, Category.name).where(Category.name.in_(names)))
+        category_ids = {name: category_id for category_id, name in result.all()}
+
+        missing = [name for name in names if name not in category_ids]
+        if missing:
+            await session.execute(
+                sqlite_insert(Category).on_conflict_do_nothing(index_elements=[Category.name]),
+                [{"name": name} for name in missing]
+            )
+            result = await session.execute(select(Category.id, Category.name).where(Category.name.in_(missing)))
+            created = dict((name, category_id) for category_id, name in result.all())
+            category_ids.update(created)
+            stats["categories_created"] += len(created)
+        return category_ids
+
+    # ---------- экспорт ----------
+
+    async def export_file(self, path: str, chunk_size: int = 1000) -> Dict:
+        """Выгрузить каталог с остатками в CSV или XLSX (по расширению path)"""
+        started = time.perf_counter()
+        stmt = (
+            select(
+                Product.id, Category.name.label("category"), Product.name, Product.description,
+                Product.price, Product.unit_type, Product.stock_grams.label("stock"), Product.image_url,
+                Product.available, Product.is_active, Product.hide_when_zero, Product.is_hypoallergenic
+            )
+            .outerjoin(Category, Category.id == Product.category_id)
+            .order_by(Product.category_id, Product.id)
+            .execution_options(yield_per=chunk_size)
+        )
+
+        is_xlsx = path.lower().endswith(".xlsx")
+        try:
+            writer = _XlsxWriter(path) if is_xlsx else _CsvWriter(path)
+        except RuntimeError as e:
+            return {"success": False, "error": str(e)}
+
+        count = 0
+        try:
+            writer.writerow(COLUMNS)
+            async with get_session() as session:
+                result = await session.stream(stmt)
+                async for rows in result.partitions():
+                    for row in rows:
+                        writer.writerow([
+                            _format_value(row[i]) if not is_xlsx else row[i]
+                            for i in range(len(COLUMNS))
+                        ])
+                    count += len(rows)
+        finally:
+            writer.close()
+
+        duration = round(time.perf_counter() - started, 2)
+        logger.info(f"📤 Экспорт каталога: {count} товаров ({duration} с)")
+        return {"success": True, "file": path, "products": count, "duration": duration}
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._file, delimiter=";")
+
+    def writerow(self, values) -> None:
+        self._writer.writerow(values)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _XlsxWriter:
+    """XLSX в режиме write_only: строки сбрасываются на диск по мере записи"""
+
+    def __init__(self, path: str):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("Для XLSX нужен пакет openpyxl: pip install openpyxl")
+        self.path = path
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("catalog")
+
+    def writerow(self, values) -> None:
+        self._sheet.append(list(values))
+
+    def close(self) -> None:
+        self._workbook.save(self.path)
+
+
+def export_filename(extension: str = "csv") -> str:
+    return f"barkery_catalog_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}"
+
+
+# Глобальный экземпляр
+catalog_io = CatalogImporter()
@@ -1,12 +1,22 @@
 """
 Модуль для чистого интерфейса без потери функционала.
 Только управление сообщениями, без изменений логики.
+
+Все запросы к Telegram идут через планировщик outbound: ответы
+пользователю - с высшим приоритетом, удаление старых сообщений -
+в фоне с низким, повторные редактирования одного сообщения склеиваются.
 """
+import asyncio
 import logging
-from typing import Dict, Optional, Union
+import time
+from typing import Dict, Optional, Set, Tuple
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.exceptions import TelegramBadRequest
 
+from outbound import OutboundScheduler, outbound, PRIORITY_USER, PRIORITY_CLEANUP
+from images import image_pipeline
+from shared_state import StateBackend, shared_state
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,11 +26,69 @@ class CleanInterface:
     Сохраняет ВЕСЬ существующий функционал.
     """
 
-    def __init__(self):
-        # Храним ID последнего фото-сообщения для каждого пользователя
-        self.last_photo_message: Dict[int, int] = {}
-        # Храним ID последнего текстового сообщения
-        self.last_text_message: Dict[int, int] = {}
+    def __init__(
+            self,
+            scheduler: OutboundScheduler = outbound,
+            backend: StateBackend = shared_state,
+            card_edit_delay: float = 0.35,
+            card_edit_max_delay: float = 1.5
+    ):
+        self.scheduler = scheduler
+        # Отложенные правки карточек: (user_id, message_id) -> [call, таймер, время первой правки, ревизия]
+        self.card_edit_delay = card_edit_delay
+        self.card_edit_max_delay = card_edit_max_delay
+        self._card_edits: Dict[Tuple[int, int], list] = {}
+        # Задачи отправки отложенных правок (ссылки держим, пока задача не завершится)
+        self._flush_tasks: Set[asyncio.Task] = set()
+        # Ревизия карточки (user_id, message_id): отправляется правка только с последней ревизией,
+        # даже если нажатия обрабатывали разные процессы
+        self._card_revisions = backend.keyed_store("card_rev", ttl_seconds=300)
+        # ID последних фото- и текстового сообщений пользователя (ключи "photo" и "text").
+        # Старше 48 часов сообщения бот удалить уже не может
+        self.messages = backend.keyed_store("ui_messages", ttl_seconds=48 * 3600, max_size=200000)
+
+    async def _send_text(self, bot, user_id: int, text: str,
+                         keyboard: Optional[InlineKeyboardMarkup] = None) -> Message:
+        """Отправить текстовое сообщение через очередь"""
+        return await self.scheduler.send(
+            user_id,
+            lambda: bot.send_message(
+                chat_id=user_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            ),
+            priority=PRIORITY_USER
+        )
+
+    async def _edit_text(self, bot, user_id: int, message_id: int, text: str,
+                         keyboard: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Отредактировать текст сообщения (ожидающие правки склеиваются)"""
+        # Сообщение уходит с карточки товара - отложенная правка карточки больше не нужна
+        await self.cancel_product_card_update(user_id, message_id)
+        await self.scheduler.send(
+            user_id,
+            lambda: bot.edit_message_text(
+                chat_id=user_id,
+                message_id=message_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            ),
+            priority=PRIORITY_USER,
+            coalesce_key=("edit", user_id, message_id)
+        )
+
+    async def _delete_later(self, bot, user_id: int, message_id: int) -> None:
+        """Удалить сообщение в фоне, не задерживая ответ пользователю"""
+        await self.cancel_product_card_update(user_id, message_id)
+        self.scheduler.post(
+            user_id,
+            lambda: bot.delete_message(chat_id=user_id, message_id=message_id),
+            priority=PRIORITY_CLEANUP,
+            coalesce_key=("delete", user_id, message_id),
+            delete=True
+        )
 
     async def smart_show_product(
             self,
@@ -33,77 +101,73 @@ class CleanInterface:
         Умный показ товара.
         """
         user_id = callback.from_user.id
+        bot = callback.bot
 
         if photo_url:
             # Товар с фото
             # 1. Удаляем предыдущее фото если было
-            await self._safe_delete_photo(user_id, callback.bot)
-
-            # 2. Отправляем новое фото
-            msg = await callback.bot.send_photo(
-                chat_id=user_id,
-                photo=photo_url,
-                caption=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
+            await self._safe_delete_photo(user_id, bot)
+
+            # 2. Отправляем новое фото (по URL - через кэш file_id)
+            msg = await image_pipeline.send_photo(
+                photo_url,
+                lambda photo: self.scheduler.send(
+                    user_id,
+                    lambda: bot.send_photo(
+                        chat_id=user_id,
+                        photo=photo,
+                        caption=text,
+                        reply_markup=keyboard,
+                        parse_mode="HTML"
+                    ),
+                    priority=PRIORITY_USER
+                )
             )
 
             # 3. Сохраняем ID фото-сообщения
-            self.last_photo_message[user_id] = msg.message_id
+            await self.messages.set(user_id, "photo", msg.message_id)
 
             # 4. Удаляем предыдущее текстовое сообщение если было
-            if user_id in self.last_text_message:
-                try:
-                    await callback.bot.delete_message(
-                        chat_id=user_id,
-                        message_id=self.last_text_message[user_id]
-                    )
-                except:
-                    pass
-                finally:
-                    self.last_text_message.pop(user_id, None)
+            message_id = await self.messages.pop(user_id, "text")
+            if message_id is not None:
+                await self._delete_later(bot, user_id, message_id)
 
         else:
             # Товар без фото
             # 1. Удаляем предыдущее фото если было
-            await self._safe_delete_photo(user_id, callback.bot)
+            await self._safe_delete_photo(user_id, bot)
 
             # 2. Пробуем отредактировать текущее сообщение
-            try:
-                if callback.message.photo:
-                    # Если текущее сообщение с фото - отправляем новое текстовое
-                    msg = await callback.bot.send_message(
-                        chat_id=user_id,
-                        text=text,
-                        reply_markup=keyboard,
-                        parse_mode="HTML"
-                    )
-                    self.last_text_message[user_id] = msg.message_id
-
-                    # Пробуем удалить старое фото
-                    try:
-                        await callback.message.delete()
-                    except:
-                        pass
-
-                else:
-                    # Редактируем текстовое сообщение
-                    await callback.message.edit_text(
-                        text=text,
-                        reply_markup=keyboard,
-                        parse_mode="HTML"
-                    )
-                    self.last_text_message[user_id] = callback.message.message_id
+            await self._edit_or_send(callback, text, keyboard)
 
-            except TelegramBadRequest:
-                # Если не удалось редактировать
-                msg = await callback.bot.send_message(
-                    chat_id=user_id,
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-                self.last_text_message[user_id] = msg.message_id
+    async def _edit_or_send(
+            self,
+            callback: CallbackQuery,
+            text: str,
+            keyboard: Optional[InlineKeyboardMarkup] = None
+    ) -> None:
+        """Отредактировать сообщение колбэка, а для фото - заменить его новым"""
+        user_id = callback.from_user.id
+        bot = callback.bot
+
+        try:
+            if callback.message.photo:
+                # Если текущее сообщение с фото - отправляем новое текстовое
+                msg = await self._send_text(bot, user_id, text, keyboard)
+                await self.messages.set(user_id, "text", msg.message_id)
+
+                # Старое фото удаляем в фоне
+                await self._delete_later(bot, user_id, callback.message.message_id)
+
+            else:
+                # Редактируем текстовое сообщение
+                await self._edit_text(bot, user_id, callback.message.message_id, text, keyboard)
+                await self.messages.set(user_id, "text", callback.message.message_id)
+
+        except TelegramBadRequest:
+            # Если не удалось редактировать
+            msg = await self._send_text(bot, user_id, text, keyboard)
+            await self.messages.set(user_id, "text", msg.message_id)
 
     async def clean_navigation(
             self,
@@ -116,29 +180,15 @@ class CleanInterface:
         Очистка при навигации.
         Вызывается при переходе ОТ карточки товара.
         """
-        if delete_photo and user_id in self.last_photo_message:
-            try:
-                await bot.delete_message(
-                    chat_id=user_id,
-                    message_id=self.last_photo_message[user_id]
-                )
-            except TelegramBadRequest as e:
-                if "message to delete not found" not in str(e).lower():
-                    logger.debug(f"Не удалось удалить фото: {e}")
-            finally:
-                self.last_photo_message.pop(user_id, None)
+        if delete_photo:
+            message_id = await self.messages.pop(user_id, "photo")
+            if message_id is not None:
+                await self._delete_later(bot, user_id, message_id)
 
-        if delete_text and user_id in self.last_text_message:
-            try:
-                await bot.delete_message(
-                    chat_id=user_id,
-                    message_id=self.last_text_message[user_id]
-                )
-            except TelegramBadRequest as e:
-                if "message to delete not found" not in str(e).lower():
-                    logger.debug(f"Не удалось удалить текст: {e}")
-            finally:
-                self.last_text_message.pop(user_id, None)
+        if delete_text:
+            message_id = await self.messages.pop(user_id, "text")
+            if message_id is not None:
+                await self._delete_later(bot, user_id, message_id)
 
     async def safe_edit_or_send(
             self,
@@ -154,42 +204,7 @@ class CleanInterface:
         # Удаляем фото если было
         await self._safe_delete_photo(user_id, callback.bot)
 
-        try:
-            # Пробуем отредактировать
-            if callback.message.photo:
-                # Если текущее сообщение с фото - отправляем новое
-                msg = await callback.bot.send_message(
-                    chat_id=user_id,
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-                self.last_text_message[user_id] = msg.message_id
-
-                # Пробуем удалить фото
-                try:
-                    await callback.message.delete()
-                except:
-                    pass
-
-            else:
-                # Редактируем текстовое
-                await callback.message.edit_text(
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-                self.last_text_message[user_id] = callback.message.message_id
-
-        except TelegramBadRequest:
-            # Если не удалось редактировать
-            msg = await callback.bot.send_message(
-                chat_id=user_id,
-                text=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            self.last_text_message[user_id] = msg.message_id
+        await self._edit_or_send(callback, text, keyboard)
 
     async def handle_product_quantity_change(
             self,
@@ -201,46 +216,110 @@ class CleanInterface:
         Обработка изменения количества в карточке товара.
         Сохраняет фото если оно есть.
         """
-        try:
-            if callback.message.photo:
-                await callback.message.edit_caption(
-                    caption=text,
-                    reply_markup=keyboard
-                )
-            else:
-                await callback.message.edit_text(
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-        except TelegramBadRequest:
-            # Если сообщение устарело - ничего не делаем
-            pass
+        user_id = callback.from_user.id
+        message_id = callback.message.message_id
+        # Отложенная правка устарела - карточка обновляется прямо сейчас
+        await self.cancel_product_card_update(user_id, message_id)
+        call = self._card_edit_call(callback.bot, user_id, message_id,
+                                    bool(callback.message.photo), text, keyboard)
 
-    # В классе CleanInterface добавляем метод:
+        try:
+            await self.scheduler.send(
+                user_id,
+                call,
+                priority=PRIORITY_USER,
+                coalesce_key=("edit", user_id, message_id)
+            )
+        except TelegramBadRequest as e:
+            # Если сообщение устарело или не изменилось - ничего не делаем
+            logger.debug(f"Карточка товара не обновлена: {e}")
 
-    async def safe_edit_or_send_message(
+    async def schedule_product_card_update(
             self,
-            message: Message,
+            callback: CallbackQuery,
             text: str,
-            keyboard: Optional[InlineKeyboardMarkup] = None
+            keyboard: InlineKeyboardMarkup
     ) -> None:
         """
-        Безопасное редактирование или отправка сообщения для Message объектов.
+        Отложенное обновление карточки товара (нажатия +/-).
+        Пока пользователь нажимает кнопки, правка откладывается; после паузы
+        card_edit_delay (но не позже card_edit_max_delay от первого нажатия)
+        отправляется только последнее состояние карточки.
         """
-        user_id = message.from_user.id
-
-        # Удаляем фото если было
-        await self._safe_delete_photo(user_id, message.bot)
+        user_id = callback.from_user.id
+        message_id = callback.message.message_id
+        call = self._card_edit_call(callback.bot, user_id, message_id,
+                                    bool(callback.message.photo), text, keyboard)
+        key = (user_id, message_id)
+        # Новая ревизия отменяет правки, отложенные другими процессами
+        revision = await self._card_revisions.incr(user_id, message_id)
+
+        entry = self._card_edits.get(key)
+        if entry is None:
+            entry = [call, None, time.monotonic(), revision]
+            self._card_edits[key] = entry
+        else:
+            entry[0] = call
+            entry[1].cancel()
+            entry[3] = revision
+
+        delay = min(self.card_edit_delay,
+                    max(0.0, entry[2] + self.card_edit_max_delay - time.monotonic()))
+        entry[1] = asyncio.get_running_loop().call_later(delay, self._start_flush, key)
+
+    def _start_flush(self, key: Tuple[int, int]) -> None:
+        task = asyncio.create_task(self._flush_card_edit(key))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Ошибка отложенной правки карточки: {task.exception()}")
+
+    async def cancel_product_card_update(self, user_id: int, message_id: int) -> None:
+        """Отменить отложенную правку карточки (карточка обновляется иначе)"""
+        entry = self._card_edits.pop((user_id, message_id), None)
+        if entry is not None:
+            entry[1].cancel()
+        await self._card_revisions.incr(user_id, message_id)
+
+    async def _flush_card_edit(self, key: Tuple[int, int]) -> None:
+        entry = self._card_edits.pop(key, None)
+        if entry is None:
+            return
+        user_id, message_id = key
+        try:
+            # Карточку уже обновили или снова нажали кнопку в другом процессе
+            if await self._card_revisions.get(user_id, message_id) != entry[3]:
+                return
+        except Exception as e:
+            logger.warning(f"Не удалось проверить ревизию карточки: {e}")
+        self.scheduler.post(
+            user_id,
+            entry[0],
+            priority=PRIORITY_USER,
+            coalesce_key=("edit", user_id, message_id)
+        )
 
-        # Для Message объектов всегда отправляем новое сообщение
-        msg = await message.bot.send_message(
+    @staticmethod
+    def _card_edit_call(bot, user_id: int, message_id: int, is_photo: bool,
+                        text: str, keyboard: InlineKeyboardMarkup):
+        """Запрос на правку карточки: подпись для фото, текст для остальных"""
+        if is_photo:
+            return lambda: bot.edit_message_caption(
+                chat_id=user_id,
+                message_id=message_id,
+                caption=text,
+                reply_markup=keyboard
+            )
+        return lambda: bot.edit_message_text(
             chat_id=user_id,
+            message_id=message_id,
             text=text,
             reply_markup=keyboard,
             parse_mode="HTML"
         )
-        self.last_text_message[user_id] = msg.message_id
 
     async def safe_edit_or_send_message(
             self,
@@ -253,60 +332,35 @@ class CleanInterface:
         Используется в обработчиках оформления заказа.
         """
         user_id = message.from_user.id
+        bot = message.bot
 
         # Удаляем предыдущее фото если было
-        await self._safe_delete_photo(user_id, message.bot)
+        await self._safe_delete_photo(user_id, bot)
 
         # Проверяем есть ли последнее текстовое сообщение от бота
-        if user_id in self.last_text_message:
+        message_id = await self.messages.get(user_id, "text")
+        if message_id is not None:
             try:
                 # Пробуем отредактировать последнее сообщение бота
-                await message.bot.edit_message_text(
-                    chat_id=user_id,
-                    message_id=self.last_text_message[user_id],
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
+                await self._edit_text(bot, user_id, message_id, text, keyboard)
                 return
             except TelegramBadRequest:
                 # Если не удалось отредактировать, удаляем старое
-                try:
-                    await message.bot.delete_message(
-                        chat_id=user_id,
-                        message_id=self.last_text_message[user_id]
-                    )
-                except:
-                    pass
-                self.last_text_message.pop(user_id, None)
+                await self._delete_later(bot, user_id, message_id)
+                await self.messages.pop(user_id, "text")
 
         # Отправляем новое сообщение
-        msg = await message.bot.send_message(
-            chat_id=user_id,
-            text=text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        self.last_text_message[user_id] = msg.message_id
+        msg = await self._send_text(bot, user_id, text, keyboard)
+        await self.messages.set(user_id, "text", msg.message_id)
 
     async def _safe_delete_photo(self, user_id: int, bot) -> bool:
-        """Безопасное удаление фото-сообщения"""
-        if user_id in self.last_photo_message:
-            try:
-                await bot.delete_message(
-                    chat_id=user_id,
-                    message_id=self.last_photo_message[user_id]
-                )
-                return True
-            except TelegramBadRequest as e:
-                if "message to delete not found" not in str(e).lower():
-                    logger.debug(f"Не удалось удалить фото: {e}")
-            except Exception as e:
-                logger.debug(f"Ошибка при удалении фото: {e}")
-            finally:
-                self.last_photo_message.pop(user_id, None)
-        return False
+        """Безопасное удаление фото-сообщения (в фоне, через очередь)"""
+        message_id = await self.messages.pop(user_id, "photo")
+        if message_id is None:
+            return False
+        await self._delete_later(bot, user_id, message_id)
+        return True
 
 
 # Глобальный экземпляр
-clean_ui = CleanInterface()
\ No newline at end of file
+clean_ui = CleanInterface()
@@ -10,6 +10,60 @@ class Settings:
     database_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./barkery.db")
     timezone = os.getenv("TIMEZONE", "Europe/Belgrade")
 
+    # Режим получения обновлений: polling или webhook
+    bot_mode = os.getenv("BOT_MODE", "polling").lower()
+    webhook_url = os.getenv("WEBHOOK_URL", "")
+    webhook_path = os.getenv("WEBHOOK_PATH", "/webhook")
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "")
+    webapp_host = os.getenv("WEBAPP_HOST", "0.0.0.0")
+    webapp_port = int(os.getenv("WEBAPP_PORT", "8080"))
+    # Сколько обновлений обрабатывается одновременно
+    webhook_max_concurrency = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "32"))
+    # Сколько принятых обновлений может ждать обработки; сверх - 429, Telegram повторит позже
+    webhook_max_backlog = int(os.getenv("WEBHOOK_MAX_BACKLOG", "1000"))
+    # Сколько секунд ждать завершения обработки при остановке
+    webhook_drain_timeout = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "15"))
+
+    # Ограничения исходящих запросов к Telegram (запросов в секунду)
+    outbound_global_rate = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+    # В личных чатах Telegram допускает короткие серии; при превышении придет RetryAfter
+    outbound_chat_rate = float(os.getenv("OUTBOUND_CHAT_RATE", "3"))
+    outbound_chat_burst = float(os.getenv("OUTBOUND_CHAT_BURST", "10"))
+    # Удаления сообщений (фоновая очистка) - общий лимит, лимит чата не расходуют
+    outbound_delete_rate = float(os.getenv("OUTBOUND_DELETE_RATE", "20"))
+    outbound_workers = int(os.getenv("OUTBOUND_WORKERS", "8"))
+
+    # Резервное копирование БД
+    backup_enabled = os.getenv("BACKUP_ENABLED", "1") == "1"
+    backup_dir = os.getenv("BACKUP_DIR", "./backups")
+    backup_hour = int(os.getenv("BACKUP_HOUR", "4"))
+    backup_minute = int(os.getenv("BACKUP_MINUTE", "0"))
+    backup_keep_daily = int(os.getenv("BACKUP_KEEP_DAILY", "7"))
+    backup_keep_weekly = int(os.getenv("BACKUP_KEEP_WEEKLY", "4"))
+
+    # Хранилище FSM: sqlite (переживает перезапуск) или memory
+    fsm_storage = os.getenv("FSM_STORAGE", "sqlite").lower()
+    fsm_flush_interval = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))
+    fsm_ttl_hours = float(os.getenv("FSM_TTL_HOURS", "24"))
+
+    # Redis для общего состояния нескольких процессов бота (пусто - всё в памяти процесса)
+    redis_url = os.getenv("REDIS_URL", "")
+    redis_prefix = os.getenv("REDIS_PREFIX", "barkery")
+    # Как часто проверять, не изменили ли каталог другие процессы (секунды, только с Redis)
+    catalog_sync_interval = float(os.getenv("CATALOG_SYNC_INTERVAL", "1.0"))
+
+    # Метрики Prometheus (/metrics) и /healthz; 0 - сервер метрик выключен
+    metrics_host = os.getenv("METRICS_HOST", "0.0.0.0")
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    # Как долго /healthz отдает прошлый результат check_health
+    health_cache_seconds = float(os.getenv("HEALTH_CACHE_SECONDS", "30"))
+
+    # Фото товаров по URL: уменьшаются до IMAGE_MAX_SIDE px (нужен Pillow) и загружаются
+    # в Telegram один раз; file_id хранится в product_images
+    image_max_side = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+    image_jpeg_quality = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+    image_max_download_mb = float(os.getenv("IMAGE_MAX_DOWNLOAD_MB", "20"))
+
     # Проверка обязательных полей
     @classmethod
     def validate(cls):
@@ -17,6 +71,10 @@ class Settings:
             raise ValueError("BOT_TOKEN не настроен")
         if cls.admin_id == 0:
             raise ValueError("ADMIN_ID не настроен")
+        if cls.bot_mode not in ("polling", "webhook"):
+            raise ValueError("BOT_MODE должен быть polling или webhook")
+        if cls.bot_mode == "webhook" and not cls.webhook_url:
+            raise ValueError("WEBHOOK_URL не настроен для режима webhook")
         return True
 
 
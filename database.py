@@ -1,18 +1,51 @@
 """
 Все модели и работа с БД в одном файде
 """
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, Date, DateTime, Text, UniqueConstraint, Index, event, text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.sql import func
 from contextlib import asynccontextmanager
+import logging
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Конфигурация
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./barkery.db")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Применять миграции при старте (0 - только проверить версию, миграции запускаются при деплое)
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+# Ревизия, которой соответствуют базы, созданные create_all до перехода на миграции
+LEGACY_REVISION = "0001"
+
+# Профиль производительности SQLite: "production" (WAL и прагмы) или "default" (настройки SQLite)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "32768"))  # 32 MB на соединение
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# aiosqlite держит отдельный поток на соединение, поэтому пул небольшой
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_MAX_OVERFLOW = int(os.getenv("SQLITE_MAX_OVERFLOW", "5"))
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_SQLITE_MEMORY = IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/").endswith("sqlite+aiosqlite:"))
+SQLITE_PRODUCTION = IS_SQLITE and SQLITE_PROFILE == "production"
+
+# Прагмы, которые применяются к каждому новому соединению
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",            # читатели не блокируются писателем
+    "synchronous": "NORMAL",          # в режиме WAL безопасно и намного быстрее FULL
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "cache_size": -SQLITE_CACHE_SIZE_KB,  # отрицательное значение - размер в KB
+    "mmap_size": SQLITE_MMAP_SIZE,
+    "temp_store": "MEMORY",
+}
 
 # Базовый класс для моделей
 Base = declarative_base()
@@ -82,6 +115,11 @@ class Product(Base):
     category_id = Column(Integer, ForeignKey("categories.id", ondelete="CASCADE"))
     category = relationship("Category")
 
+    __table_args__ = (
+        # Выборка видимых товаров категории
+        Index('ix_products_category_active_available', 'category_id', 'is_active', 'available'),
+    )
+
 
 class CartItem(Base):
     """Модель элемента корзины"""
@@ -121,7 +159,7 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
 
     product_name = Column(String, nullable=False)
@@ -155,13 +193,110 @@ class OrderErrorLog(Base):
     resolved_at = Column(DateTime(timezone=True), nullable=True)
 
 
+class FSMStateRecord(Base):
+    """Состояние FSM пользователя (хранилище fsm_storage.SQLiteStorage)"""
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)  # bot:chat:user:thread:business:destiny
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=False, default="{}")  # JSON
+    updated_at = Column(Float, nullable=False, index=True)  # unix time последней записи
+
+
+class SalesDaily(Base):
+    """Продажи за день (обновляется при оформлении заказа)"""
+    __tablename__ = "sales_daily"
+
+    day = Column(Date, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)  # граммы и штуки вместе, как в order_items
+    revenue = Column(Float, nullable=False, default=0)
+
+
+class SalesProductDaily(Base):
+    """Продажи товара за день (обновляется при оформлении заказа)"""
+    __tablename__ = "sales_product_daily"
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)  # без внешнего ключа: история остается после удаления товара
+    product_name = Column(String, nullable=False)
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """Результат операции по ключу идемпотентности (idempotency.IdempotencyLayer)"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)  # user_id:операция:токен
+    scope = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=True)
+    result = Column(Text, nullable=True)  # JSON результата
+    created_at = Column(Float, nullable=False, index=True)  # unix time
+
+
+class OutboxMessage(Base):
+    """Исходящее уведомление, записанное в транзакции заказа (outbox.OutboxDispatcher)"""
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # например admin_order
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String, default="pending", nullable=False)  # pending / sent / failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(Float, nullable=False)  # unix time
+    created_at = Column(Float, nullable=False)
+    sent_at = Column(Float, nullable=True)
+    last_error = Column(String, nullable=True)
+
+
+class ProductImage(Base):
+    """Фото товара по URL, уже загруженное в Telegram (images.ImagePipeline)"""
+    __tablename__ = "product_images"
+
+    url = Column(String, primary_key=True)
+    file_id = Column(String, nullable=False)
+    width = Column(Integer, nullable=True)  # размер фото в Telegram
+    height = Column(Integer, nullable=True)
+    size_bytes = Column(Integer, nullable=True)
+    created_at = Column(Float, nullable=False)  # unix time
+
+
 # ========== СЕССИИ И ENGINE ==========
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,
-    future=True,
-)
+def _engine_options() -> dict:
+    """Параметры engine с учетом профиля SQLite"""
+    options = {"echo": False, "future": True}
+    if SQLITE_PRODUCTION:
+        # Таймаут драйвера совпадает с busy_timeout
+        options["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if not IS_SQLITE_MEMORY:
+            # По умолчанию aiosqlite работает с NullPool и открывает файл на каждую сессию
+            options["poolclass"] = AsyncAdaptedQueuePool
+            options["pool_size"] = SQLITE_POOL_SIZE
+            options["max_overflow"] = SQLITE_MAX_OVERFLOW
+    return options
+
+
+engine = create_async_engine(DATABASE_URL, **_engine_options())
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Применить прагмы профиля к новому соединению SQLite"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+
+if SQLITE_PRODUCTION:
+    event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
 
 async_session_maker = async_sessionmaker(
     engine,
@@ -184,12 +319,76 @@ async def get_session() -> AsyncSession:
             await session.close()
 
 
+async def check_sqlite_profile() -> dict:
+    """Самопроверка: прочитать активные прагмы SQLite и записать их в лог"""
+    if not IS_SQLITE:
+        return {}
+
+    active = {}
+    async with engine.connect() as conn:
+        for pragma in SQLITE_PRAGMAS:
+            result = await conn.execute(text(f"PRAGMA {pragma}"))
+            active[pragma] = result.scalar()
+
+    logger.info(f"SQLite профиль '{SQLITE_PROFILE}', активные прагмы: {active}")
+
+    if SQLITE_PRODUCTION and not IS_SQLITE_MEMORY and str(active.get("journal_mode")).lower() != "wal":
+        logger.warning(f"⚠️ SQLite не перешел в режим WAL (journal_mode={active.get('journal_mode')})")
+
+    return active
+
+
+def _alembic_config():
+    """Конфигурация Alembic (alembic.ini и migrations/ лежат рядом с этим модулем)"""
+    from alembic.config import Config
+
+    cfg = Config(os.path.join(BASE_DIR, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(BASE_DIR, "migrations"))
+    return cfg
+
+
+def _schema_state(sync_conn):
+    """Текущая ревизия схемы и признак старой базы без таблицы alembic_version"""
+    from alembic.runtime.migration import MigrationContext
+    from sqlalchemy import inspect
+
+    current = MigrationContext.configure(sync_conn).get_current_revision()
+    is_legacy = current is None and inspect(sync_conn).has_table("users")
+    return current, is_legacy
+
+
+def _run_migrations(sync_conn, cfg, stamp_legacy: bool) -> None:
+    """Применить миграции в переданном соединении"""
+    from alembic import command
+
+    cfg.attributes["connection"] = sync_conn
+    if stamp_legacy:
+        # База создана create_all до перехода на миграции - ее схема соответствует первой ревизии
+        command.stamp(cfg, LEGACY_REVISION)
+    command.upgrade(cfg, "head")
+
+
 async def init_db():
-    """Инициализация БД (создание таблиц) - миграция"""
-    async with engine.begin() as conn:
-        # Создаем таблицы (SQLAlchemy автоматически обновит структуру)
-        await conn.run_sync(Base.metadata.create_all)
-
-        # Для SQLite миграция будет выполнена автоматически,
-        # так как мы используем ту же таблицу с новыми полями
-        print("✅ База данных инициализирована (миграция выполнена)")
\ No newline at end of file
+    """Инициализация БД: проверка версии схемы и, при необходимости, миграции"""
+    from alembic.script import ScriptDirectory
+
+    cfg = _alembic_config()
+    head = ScriptDirectory.from_config(cfg).get_current_head()
+
+    # Быстрый путь: схема актуальна - никаких DDL и рефлексии
+    async with engine.connect() as conn:
+        current, is_legacy = await conn.run_sync(_schema_state)
+
+    if current == head:
+        logger.info(f"✅ Схема БД актуальна (ревизия {current})")
+    else:
+        if not DB_AUTO_MIGRATE:
+            raise RuntimeError(
+                f"Схема БД устарела (ревизия {current}, нужна {head}): выполните alembic upgrade head"
+            )
+        logger.info(f"Миграция схемы БД: {current or ('старая база' if is_legacy else 'пустая база')} -> {head}")
+        async with engine.begin() as conn:
+            await conn.run_sync(_run_migrations, cfg, is_legacy)
+        logger.info(f"✅ Схема БД обновлена до ревизии {head}")
+
+    await check_sqlite_profile()
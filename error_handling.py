@@ -1,15 +1,159 @@
 """
 Обработка ошибок для Barkery Shop
 """
+import asyncio
 import logging
+import os
 import traceback
 import json
+import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional, Callable, Any
+from typing import Dict, List, Optional, Callable, Any
 
 logger = logging.getLogger(__name__)
 
+
+class ErrorSink:
+    """
+    Асинхронная запись ошибок в JSON lines.
+
+    Записи попадают в ограниченную очередь без ожидания, фоновая задача
+    забирает их пачками и дописывает в файл в потоке (asyncio.to_thread):
+    цикл событий не ждет диска, а поток ошибок дает одну запись на пачку,
+    а не файл на ошибку. Файл ротируется по размеру. Когда очередь
+    заполнена, действует policy: "drop_oldest" - вытеснить самую старую
+    запись, "drop_new" - отбросить новую; put() вместо этого ждет места.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            max_queue: int = 1000,
+            batch_size: int = 200,
+            max_bytes: int = 10 * 1024 * 1024,
+            backup_count: int = 5,
+            policy: str = "drop_oldest"
+    ):
+        self.path = Path(path)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.policy = policy
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_errors = 0
+
+    def _ensure_started(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain_loop())
+        return self._queue
+
+    def submit(self, record: Dict) -> bool:
+        """Поставить запись в очередь без ожидания; False - запись отброшена"""
+        queue = self._ensure_started()
+        try:
+            queue.put_nowait(record)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.dropped += 1
+        if self.policy == "drop_oldest":
+            queue.get_nowait()
+            queue.task_done()
+            queue.put_nowait(record)
+            return True
+        return False
+
+    async def put(self, record: Dict) -> None:
+        """Поставить запись в очередь, дождавшись места (обратное давление)"""
+        await self._ensure_started().put(record)
+
+    async def _drain_loop(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.write_errors += 1
+                logger.error(f"Не удалось записать {len(batch)} ошибок в {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def _write_batch(self, batch: List[Dict]) -> None:
+        """Дописать пачку в файл (в потоке)"""
+        lines = "".join(json.dumps(_format_record(record), ensure_ascii=False, default=str) + "\n" for record in batch)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists() and self.path.stat().st_size + len(lines) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _rotate(self) -> None:
+        """errors.jsonl -> errors.jsonl.1 -> ... -> errors.jsonl.<backup_count>"""
+        for i in range(self.backup_count - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{i}")
+            if source.exists():
+                os.replace(source, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    async def flush(self) -> None:
+        """Дождаться записи всего, что уже в очереди"""
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "write_errors": self.write_errors
+        }
+
+
+def _format_record(record: Dict) -> Dict:
+    """Трейсбек форматируется при записи (в потоке): чтение исходников не блокирует цикл событий"""
+    error = record.pop("exception", None)
+    if error is not None:
+        record["traceback"] = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+    return record
+
+
+def new_error_id() -> str:
+    """Уникальный ID ошибки: время для читаемости и случайный суффикс"""
+    return f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+
+# Глобальные экземпляры
+error_sink = ErrorSink("logs/errors/errors.jsonl")
+admin_notification_sink = ErrorSink("logs/admin_notifications/notifications.jsonl", max_queue=200)
+
 class OrderErrorHandler:
     """Обработчик ошибок заказов"""
     
@@ -61,10 +205,10 @@ class EnhancedErrorHandler:
         """
         try:
             # Генерируем ID ошибки
-            error_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+            error_id = new_error_id()
 
             # Сохраняем детали ошибки
-            await EnhancedErrorHandler._save_error_details(
+            EnhancedErrorHandler._save_error_details(
                 error=error,
                 context=context,
                 user_id=user_id,
@@ -98,13 +242,13 @@ class EnhancedErrorHandler:
             return "❌ Произошла внутренняя ошибка. Попробуйте позже."
 
     @staticmethod
-    async def _save_error_details(
+    def _save_error_details(
             error: Exception,
             context: str,
             user_id: Optional[int],
             error_id: str
     ) -> Dict:
-        """Сохранение деталей ошибки в JSON файл"""
+        """Поставить детали ошибки в очередь записи (logs/errors/errors.jsonl)"""
         try:
             error_details = {
                 "error_id": error_id,
@@ -113,22 +257,12 @@ class EnhancedErrorHandler:
                 "error_message": str(error),
                 "context": context,
                 "user_id": user_id,
-                "traceback": traceback.format_exc(),
+                "exception": error,
                 "handled": True
             }
 
-            # Создаем директорию для ошибок если её нет
-            errors_dir = Path("logs/errors")
-            errors_dir.mkdir(parents=True, exist_ok=True)
-
-            # Сохраняем в JSON файл
-            error_file = errors_dir / f"error_{error_id}.json"
-            with open(error_file, 'w', encoding='utf-8') as f:
-                json.dump(error_details, f, indent=2, ensure_ascii=False, default=str)
-
-            logger.debug(f"Детали ошибки сохранены: {error_file}")
-
-            return {"success": True, "error_id": error_id, "file": str(error_file)}
+            queued = error_sink.submit(error_details)
+            return {"success": queued, "error_id": error_id}
 
         except Exception as e:
             logger.error(f"Не удалось сохранить детали ошибки: {e}")
@@ -187,19 +321,18 @@ class EnhancedErrorHandler:
             )
 
             # Временное решение - сохраняем уведомление в файл
-            notifications_dir = Path("logs/admin_notifications")
-            notifications_dir.mkdir(parents=True, exist_ok=True)
-
-            notification_file = notifications_dir / f"error_{error_id}.txt"
-            with open(notification_file, 'w', encoding='utf-8') as f:
-                f.write(admin_message)
+            admin_notification_sink.submit({
+                "error_id": error_id,
+                "timestamp": datetime.now().isoformat(),
+                "message": admin_message
+            })
 
             logger.critical(
                 f"КРИТИЧЕСКАЯ ОШИБКА #{error_id} | "
                 f"Контекст: {context} | "
                 f"Пользователь: {user_id} | "
                 f"Ошибка: {error_message} | "
-                f"Файл: {notification_file}"
+                f"Файл: {admin_notification_sink.path}"
             )
 
         except Exception as e:
@@ -291,12 +424,6 @@ class EnhancedErrorHandler:
 # Создаем экземпляр расширенного обработчика
 enhanced_error_handler = EnhancedErrorHandler()
 
-# ========== ВСПОМОГАТЕЛЬНЫЕ ИМПОРТЫ ==========
-
-# Импортируем asyncio для проверки async функций
-import asyncio
-
-
 # ========== ФУНКЦИИ ДЛЯ ОБРАТНОЙ СОВМЕСТИМОСТИ ==========
 
 async def handle_error_gracefully(
@@ -0,0 +1,298 @@
+"""
+Постоянное хранилище FSM на SQLite для Barkery Shop
+
+Состояния оформления заказа и админки переживают перезапуск бота.
+Чтение и запись идут через кэш в памяти; измененные ключи пишутся
+в БД в фоне пачками (write-behind) раз в flush_interval секунд или
+сразу при накоплении batch_size изменений, поэтому state.update_data
+не ждет записи в БД. Состояния без изменений дольше ttl удаляются.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import get_session, FSMStateRecord
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value: Any) -> Any:
+    """datetime/date в данных FSM (например, user_info.last_order_date)"""
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в FSM")
+
+
+def _json_object_hook(obj: Dict) -> Any:
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def dump_data(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, default=_json_default)
+
+
+def load_data(raw: Optional[str]) -> Dict[str, Any]:
+    return json.loads(raw, object_hook=_json_object_hook) if raw else {}
+
+
+def storage_key_to_str(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+
+class _Record:
+    """Состояние ключа в кэше"""
+
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict] = None, updated_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.updated_at = updated_at
+
+    @property
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_states с кэшем и отложенной записью"""
+
+    def __init__(
+            self,
+            flush_interval: float = 1.0,
+            batch_size: int = 200,
+            ttl_seconds: float = 24 * 3600,
+            max_cached: int = 10000,
+            purge_interval: float = 600
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ttl_seconds = ttl_seconds
+        self.max_cached = max_cached
+        self.purge_interval = purge_interval
+
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        # Ключи, измененные после последней записи в БД
+        self._dirty: Set[str] = set()
+        # Ключи, которые пишутся прямо сейчас (их нельзя вытеснять из кэша)
+        self._flushing: Set[str] = set()
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    # ---------- интерфейс aiogram ----------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        str_key = storage_key_to_str(key)
+        record = await self._get_record(str_key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(str_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get_record(storage_key_to_str(key))
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        # Проверяем сериализуемость сразу, а не при отложенной записи
+        dump_data(data)
+        str_key = storage_key_to_str(key)
+        record = await self._get_record(str_key)
+        record.data = data.copy()
+        self._mark_dirty(str_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get_record(storage_key_to_str(key))
+        return record.data.copy()
+
+    async def close(self) -> None:
+        """Остановить фоновую запись и сохранить все изменения"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    # ---------- кэш ----------
+
+    async def _get_record(self, key: str) -> _Record:
+        record = self._cache.get(key)
+        if record is None:
+            self.misses += 1
+            record = await self._load(key)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+
+        if record.updated_at and record.updated_at < time.time() - self.ttl_seconds:
+            # Состояние устарело - начинаем с чистого листа
+            record.state = None
+            record.data = {}
+            self._mark_dirty(key, record)
+        return record
+
+    async def _load(self, key: str) -> _Record:
+        async with get_session() as session:
+            result = await session.execute(
+                select(FSMStateRecord.state, FSMStateRecord.data, FSMStateRecord.updated_at)
+                .where(FSMStateRecord.key == key)
+            )
+            row = result.first()
+
+        # Пока шел запрос, ключ мог появиться в кэше - он свежее данных из БД
+        record = self._cache.get(key)
+        if record is not None:
+            return record
+
+        record = _Record(row.state, load_data(row.data), row.updated_at) if row else _Record()
+        self._cache[key] = record
+        self._evict()
+        return record
+
+    def _mark_dirty(self, key: str, record: _Record) -> None:
+        record.updated_at = time.time()
+        self._dirty.add(key)
+        self._ensure_started()
+        if len(self._dirty) >= self.batch_size:
+            self._flush_requested.set()
+
+    def _evict(self) -> None:
+        """Вытеснить самые старые ключи сверх max_cached (только уже записанные в БД)"""
+        if len(self._cache) <= self.max_cached:
+            return
+        for key in list(self._cache):
+            if len(self._cache) <= self.max_cached:
+                break
+            if key in self._dirty or key in self._flushing:
+                continue
+            del self._cache[key]
+
+    # ---------- запись в БД ----------
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._flush_requested = asyncio.Event()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_purge >= self.purge_interval:
+                    await self.purge_expired()
+            except Exception as e:
+                logger.error(f"Ошибка записи FSM в БД: {e}")
+
+    async def flush(self) -> int:
+        """Записать измененные ключи одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            keys: List[str] = list(self._dirty)
+            self._dirty.clear()
+            self._flushing.update(keys)
+            try:
+                upserts, deletes = [], []
+                for key in keys:
+                    record = self._cache.get(key)
+                    if record is None or record.is_empty:
+                        deletes.append(key)
+                    else:
+                        upserts.append({
+                            "key": key,
+                            "state": record.state,
+                            "data": dump_data(record.data),
+                            "updated_at": record.updated_at
+                        })
+
+                async with get_session() as session:
+                    if upserts:
+                        stmt = sqlite_insert(FSMStateRecord)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[FSMStateRecord.key],
+                            set_={
+                                "state": stmt.excluded.state,
+                                "data": stmt.excluded.data,
+                                "updated_at": stmt.excluded.updated_at
+                            }
+                        )
+                        await session.execute(stmt, upserts)
+                    if deletes:
+                        await session.execute(delete(FSMStateRecord).where(FSMStateRecord.key.in_(deletes)))
+            except Exception:
+                # Не теряем изменения: запишем их при следующей попытке
+                self._dirty.update(keys)
+                raise
+            finally:
+                self._flushing.difference_update(keys)
+
+            self.flushes += 1
+            self.rows_written += len(keys)
+            self._evict()
+            return len(keys)
+
+    async def purge_expired(self) -> int:
+        """Удалить состояния, которые не менялись дольше ttl"""
+        self._last_purge = time.monotonic()
+        cutoff = time.time() - self.ttl_seconds
+
+        for key in [k for k, r in self._cache.items()
+                    if r.updated_at and r.updated_at < cutoff and k not in self._dirty and k not in self._flushing]:
+            del self._cache[key]
+
+        async with get_session() as session:
+            result = await session.execute(delete(FSMStateRecord).where(FSMStateRecord.updated_at < cutoff))
+            removed = result.rowcount or 0
+        if removed:
+            logger.info(f"Удалено устаревших состояний FSM: {removed}")
+        return removed
+
+    def state_counts(self) -> Dict[str, int]:
+        """Число пользователей в каждом состоянии среди кэшированных и не устаревших ключей"""
+        cutoff = time.time() - self.ttl_seconds
+        counts: Dict[str, int] = {}
+        for record in list(self._cache.values()):
+            if record.state is not None and record.updated_at >= cutoff:
+                counts[record.state] = counts.get(record.state, 0) + 1
+        return counts
+
+    def stats(self) -> Dict:
+        """Состояние хранилища"""
+        return {
+            "cached": len(self._cache),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written
+        }
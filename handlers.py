@@ -2,10 +2,15 @@
 Barkery Bot - handlers.py
 ПОЛНАЯ ВЕРСИЯ С ЧИСТЫМ ИНТЕРФЕЙСОМ И КНОПКАМИ ДЛЯ АДРЕСА
 """
+import html
 import logging
+import uuid
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
+from aiogram.types import (
+    Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+)
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 # Импортируем модуль для чистого интерфейса
@@ -15,22 +20,40 @@ from keyboards import (
     main_menu_keyboard,
     categories_keyboard,
     products_keyboard,
-    product_card_keyboard,
+    build_product_card,
     cart_keyboard,
     order_confirmation_keyboard,
-    address_choice_keyboard  # Импортируем новую клавиатуру
+    address_choice_keyboard,  # Импортируем новую клавиатуру
+    search_results_keyboard,
+    product_price_text,
+    keyboard_cache,
+    page_count,
+    clamp_page,
+    CATEGORIES_PAGE_SIZE,
+    PRODUCTS_PAGE_SIZE
 )
-from services import cart_service, catalog_service, user_service, update_product_stock_and_availability
-from admin import check_and_notify_out_of_stock
-from database import get_session, CartItem, Category
-from sqlalchemy import select
+from services import cart_service, catalog_service, user_service, checkout_service, product_card_service
 from error_handling import order_error_handler
+from state_store import ExpiringKeyedStore
+from shared_state import shared_state
+from catalog_cache import catalog_cache, is_product_visible
+from idempotency import idempotency
+from images import image_pipeline
+from search import product_search
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Храним предварительные количества для каждого пользователя и товара
-temp_quantities = {}
+# Храним предварительные количества для каждого пользователя и товара.
+# Записи живут 6 часов, общий размер ограничен; при REDIS_URL - общие для всех процессов
+temp_quantities = shared_state.keyed_store("temp_qty", ttl_seconds=6 * 3600, max_size=200000)
+
+# Данные открытой карточки товара на время серии нажатий +/-:
+# (user_id, (message_id, product_id)) -> (версия каталога, card)
+card_contexts = ExpiringKeyedStore(ttl_seconds=30, max_size=20000)
+
+# Последний запрос /search пользователя (для листания search:p<n>)
+search_queries = ExpiringKeyedStore(ttl_seconds=3600, max_size=20000)
 
 # ========== СОСТОЯНИЯ ДЛЯ ЗАКАЗА ==========
 
@@ -42,34 +65,56 @@ class OrderForm(StatesGroup):
     waiting_save_address = State()    # Новый шаг: спросить сохранить ли адрес
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
-def get_temp_quantity_key(user_id: int, product_id: int) -> str:
-    """Ключ для хранения временного количества"""
-    return f"{user_id}_{product_id}"
+async def get_temp_quantity(user_id: int, product_id: int) -> int:
+    """Получить временное количество"""
+    return await temp_quantities.get(user_id, product_id, 0)
 
-def update_temp_quantity(user_id: int, product_id: int, delta: int) -> int:
+async def update_temp_quantity(user_id: int, product_id: int, delta: int) -> int:
     """Обновить временное количество с проверками"""
-    key = get_temp_quantity_key(user_id, product_id)
-    current = temp_quantities.get(key, 0)
+    current = await get_temp_quantity(user_id, product_id)
     new_quantity = current + delta
 
     # Не может быть меньше 0
     if new_quantity < 0:
         new_quantity = 0
 
-    temp_quantities[key] = new_quantity
+    await temp_quantities.set(user_id, product_id, new_quantity)
     return new_quantity
 
-def reset_temp_quantity(user_id: int, product_id: int):
+async def reset_temp_quantity(user_id: int, product_id: int):
     """Сбросить временное количество"""
-    key = get_temp_quantity_key(user_id, product_id)
-    temp_quantities[key] = 0
+    await temp_quantities.pop(user_id, product_id)
+
+async def clear_temp_quantities(user_id: int):
+    """Удалить все временные количества пользователя"""
+    await temp_quantities.drop_user(user_id)
+    card_contexts.drop_user(user_id)
+
+async def get_card_for_taps(user_id: int, telegram_id: int, message_id: int, product_id: int):
+    """
+    Карточка товара для нажатий +/-: при серии нажатий берется из памяти,
+    из БД перечитывается только после изменения каталога или истечения TTL
+    """
+    key = (message_id, product_id)
+    cached = card_contexts.get(telegram_id, key)
+    if cached is not None and cached[0] == catalog_cache.version:
+        return cached[1]
+
+    card = await product_card_service.get_card(user_id, product_id)
+    if card:
+        card_contexts.set(telegram_id, key, (catalog_cache.version, card))
+    return card
 
 # ========== ОСНОВНЫЕ КОМАНДЫ ==========
 
 @router.message(Command("start"))
-async def cmd_start(message: Message):
-    """Команда /start с очисткой предыдущих сообщений"""
+async def cmd_start(message: Message, user_id: int, command: CommandObject):
+    """Команда /start с очисткой предыдущих сообщений; /start p<id> - карточка товара (ссылка из inline-поиска)"""
     try:
+        if command.args and command.args.startswith("p") and command.args[1:].isdigit():
+            if await send_product_card(message, user_id, int(command.args[1:])):
+                return
+
         # Очищаем предыдущие сообщения
         await clean_ui.clean_navigation(
             user_id=message.from_user.id,
@@ -78,12 +123,7 @@ async def cmd_start(message: Message):
             delete_text=True
         )
 
-        user = await cart_service.get_or_create_user(
-            telegram_id=message.from_user.id,
-            username=message.from_user.username,
-            full_name=message.from_user.full_name
-        )
-
+        # Пользователь создан UserIdentityMiddleware (user_id)
         welcome_text = (
             "🐕 Добро пожаловать в Barkery Shop!\n\n"
             "Магазин натуральных собачьих лакомств 🦴\n\n"
@@ -99,6 +139,124 @@ async def cmd_start(message: Message):
         logger.error(f"Ошибка в /start: {e}")
         await message.answer("❌ Ошибка запуска бота")
 
+async def send_product_card(message: Message, user_id: int, product_id: int) -> bool:
+    """Отправить карточку товара новым сообщением (False - товар не найден или скрыт)"""
+    card = await product_card_service.get_card(user_id, product_id)
+    if not card or not is_product_visible(card["product"]):
+        return False
+
+    temp_qty = await get_temp_quantity(message.from_user.id, product_id)
+    caption, keyboard = build_product_card(card, card["product"]["category_id"], temp_qty)
+    photo_url = card["product"].get("image_url")
+    if photo_url:
+        await image_pipeline.send_photo(
+            photo_url,
+            lambda photo: message.answer_photo(photo=photo, caption=caption, reply_markup=keyboard)
+        )
+    else:
+        await message.answer(caption, reply_markup=keyboard)
+    return True
+
+
+# ========== ПОИСК ==========
+
+async def show_search_results(message: Message, query: str, page: int = 0, callback: CallbackQuery = None):
+    """Страница результатов поиска: новым сообщением или правкой сообщения callback"""
+    result = await product_search.search(query, page)
+    if not result["success"]:
+        text, keyboard = "❌ Ошибка поиска, попробуйте позже", main_menu_keyboard()
+    elif not result["items"]:
+        text = f"🔍 По запросу «{html.escape(query)}» ничего не найдено" if page == 0 else "🔍 Больше ничего не найдено"
+        keyboard = main_menu_keyboard()
+    else:
+        text = f"🔍 Результаты по запросу «{html.escape(query)}»" + (f" (стр. {page + 1})" if page else "") + ":"
+        keyboard = search_results_keyboard(result["items"], page, result["has_next"])
+
+    if callback is not None:
+        await clean_ui.safe_edit_or_send(callback=callback, text=text, keyboard=keyboard)
+    else:
+        await message.answer(text, reply_markup=keyboard)
+
+
+@router.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject):
+    """Команда /search <запрос>"""
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(
+            "🔍 Поиск товаров\n\n"
+            "Напишите запрос после команды, например: /search печенье с уткой\n"
+            "Искать можно и в любом чате: начните сообщение с имени бота."
+        )
+        return
+
+    try:
+        search_queries.set(message.from_user.id, "search", query)
+        await show_search_results(message, query)
+    except Exception as e:
+        logger.error(f"Ошибка поиска: {e}")
+        await message.answer("❌ Ошибка поиска")
+
+
+@router.callback_query(F.data.startswith("search:"))
+async def search_page(callback: CallbackQuery):
+    """Листание результатов /search"""
+    try:
+        query = search_queries.get(callback.from_user.id, "search")
+        if query is None:
+            await callback.answer("Повторите поиск: /search <запрос>", show_alert=True)
+            return
+        page = _parse_page(callback.data.split(":")[1])
+        await show_search_results(callback.message, query, page, callback=callback)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка листания поиска: {e}")
+        await callback.answer("❌ Ошибка", show_alert=True)
+
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    """Inline-режим: @бот <запрос> в любом чате"""
+    query = inline_query.query.strip()
+    page = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    if not query:
+        await inline_query.answer([], cache_time=300)
+        return
+
+    result = await product_search.search(query, page)
+    if not result["success"]:
+        await inline_query.answer([], cache_time=5)
+        return
+
+    me = await inline_query.bot.me()
+    results = []
+    for product in result["items"]:
+        description = (product.get("description") or "").strip()
+        open_button = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="🛒 Открыть в магазине", url=f"https://t.me/{me.username}?start=p{product['id']}")
+        ]])
+        image_url = product.get("image_url") or ""
+        results.append(InlineQueryResultArticle(
+            id=str(product["id"]),
+            title=product["name"],
+            description=product_price_text(product),
+            thumbnail_url=image_url if image_url.startswith("http") else None,
+            input_message_content=InputTextMessageContent(
+                message_text=(
+                    f"🦴 {html.escape(product['name'])}\n💰 {product_price_text(product)}"
+                    + (f"\n\n{html.escape(description)}" if description else "")
+                )
+            ),
+            reply_markup=open_button
+        ))
+
+    await inline_query.answer(
+        results,
+        cache_time=30,
+        next_offset=str(page + 1) if result["has_next"] else ""
+    )
+
+
 @router.message(Command("help"))
 async def cmd_help(message: Message):
     """Команда /help"""
@@ -106,7 +264,8 @@ async def cmd_help(message: Message):
         "🐾 Помощь по боту Barkery Shop\n\n"
         "📦 Каталог - просмотр товаров по категориям\n"
         "🛒 Корзина - ваши выбранные товары\n"
-        "👤 Профиль - ваши данные\n\n"
+        "👤 Профиль - ваши данные\n"
+        "🔍 /search - поиск товаров по названию\n\n"
         "📱 Как сделать заказ:\n"
         "1. Выберите товары в каталоге\n"
         "2. Добавьте их в корзину\n"
@@ -129,10 +288,28 @@ async def main_menu_handler(callback: CallbackQuery):
     )
     await callback.answer()
 
-@router.callback_query(F.data == "catalog")
+def _catalog_version():
+    """Версия каталога для кэша клавиатур (None - каталог не в памяти, без кэша)"""
+    return catalog_cache.version if catalog_cache.snapshot is not None else None
+
+
+def _parse_page(part: str) -> int:
+    """p<n> -> n"""
+    return int(part[1:]) if part.startswith("p") and part[1:].isdigit() else 0
+
+
+@router.callback_query(F.data == "page_info")
+async def page_info(callback: CallbackQuery):
+    """Кнопка с номером страницы"""
+    await callback.answer()
+
+
+@router.callback_query((F.data == "catalog") | F.data.startswith("catalog:"))
 async def show_categories(callback: CallbackQuery):
-    """Показать категории"""
+    """Показать категории (catalog или catalog:p<n>)"""
     try:
+        _, _, page_part = callback.data.partition(":")
+        page = _parse_page(page_part)
         categories = await catalog_service.get_categories()
 
         # Добавляем виртуальную категорию "Гипоаллергенные"
@@ -151,10 +328,15 @@ async def show_categories(callback: CallbackQuery):
             )
             return
 
+        page = clamp_page(page, len(categories_with_hypo), CATEGORIES_PAGE_SIZE)
+        keyboard = keyboard_cache.get(
+            ("categories", page), _catalog_version(),
+            lambda: categories_keyboard(categories_with_hypo, page)
+        )
         await clean_ui.safe_edit_or_send(
             callback=callback,
             text="📦 Каталог\n\nВыберите категорию:",
-            keyboard=categories_keyboard(categories_with_hypo)
+            keyboard=keyboard
         )
 
     except Exception as e:
@@ -164,9 +346,14 @@ async def show_categories(callback: CallbackQuery):
 # Обновляем обработку категорий:
 @router.callback_query(F.data.startswith("category:"))
 async def show_products(callback: CallbackQuery):
-    """Показать товары категории"""
+    """
+    Показать товары категории: category:<id>, страница category:<id>:p<n>,
+    возврат из карточки на страницу товара category:<id>:i<product_id>
+    """
     try:
-        category_id = int(callback.data.split(":")[1])
+        parts = callback.data.split(":")
+        category_id = int(parts[1])
+        page_part = parts[2] if len(parts) > 2 else ""
 
         # Проверяем, это гипоаллергенная категория или обычная
         if category_id == 999:
@@ -177,9 +364,8 @@ async def show_products(callback: CallbackQuery):
             # Обычные товары категории
             products = await catalog_service.get_products_by_category(category_id)
             # Получаем название категории
-            async with get_session() as session:
-                category = await session.get(Category, category_id)
-                category_name = category.name if category else f"Категория {category_id}"
+            category = await catalog_service.get_category(category_id)
+            category_name = category["name"] if category else f"Категория {category_id}"
 
         if not products:
             await clean_ui.safe_edit_or_send(
@@ -188,10 +374,23 @@ async def show_products(callback: CallbackQuery):
             )
             return
 
+        if page_part.startswith("i") and page_part[1:].isdigit():
+            product_id = int(page_part[1:])
+            position = next((i for i, p in enumerate(products) if p["id"] == product_id), 0)
+            page = position // PRODUCTS_PAGE_SIZE
+        else:
+            page = clamp_page(_parse_page(page_part), len(products), PRODUCTS_PAGE_SIZE)
+
+        keyboard = keyboard_cache.get(
+            ("products", category_id, page), _catalog_version(),
+            lambda: products_keyboard(products, category_id, page)
+        )
+        pages = page_count(len(products), PRODUCTS_PAGE_SIZE)
+        page_text = f" (стр. {page + 1}/{pages})" if pages > 1 else ""
         await clean_ui.safe_edit_or_send(
             callback=callback,
-            text=f"📦 Товары категории: {category_name}\n\nВыберите товар:",
-            keyboard=products_keyboard(products, category_id)
+            text=f"📦 Товары категории: {category_name}{page_text}\n\nВыберите товар:",
+            keyboard=keyboard
         )
 
     except Exception as e:
@@ -199,7 +398,7 @@ async def show_products(callback: CallbackQuery):
         await callback.answer("❌ Ошибка загрузки товаров", show_alert=True)
 
 @router.callback_query(F.data.startswith("product:"))
-async def show_product(callback: CallbackQuery):
+async def show_product(callback: CallbackQuery, user_id: int):
     """Показать карточку товара с чистым интерфейсом"""
     try:
         parts = callback.data.split(":")
@@ -209,61 +408,23 @@ async def show_product(callback: CallbackQuery):
         product_id = int(parts[1])
         category_id = int(parts[2])
 
-        product = await catalog_service.get_product(product_id)
-        if not product:
+        # Товар, категория и количество в корзине - одним запросом
+        card = await product_card_service.get_card(user_id, product_id)
+        if not card:
             await callback.answer("❌ Товар не найден", show_alert=True)
             return
 
-        # Получаем количество в корзине
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        async with get_session() as session:
-            stmt = select(CartItem).where(
-                CartItem.user_id == user.id,
-                CartItem.product_id == product_id
-            )
-            result = await session.execute(stmt)
-            cart_item = result.scalar_one_or_none()
-            current_in_cart = cart_item.quantity if cart_item else 0
-
         # Получаем временное количество (предварительное)
-        temp_key = get_temp_quantity_key(callback.from_user.id, product_id)
-        temp_qty = temp_quantities.get(temp_key, 0)
-
-        # Формируем описание/подпись
-        description = product.get("description", "") or ""
-        caption = (
-            f"🦴 {product['name']}\n\n"
-            f"{description}\n\n"
-        )
+        temp_qty = await get_temp_quantity(callback.from_user.id, product_id)
 
-        # Отображение цены в зависимости от типа товара
-        if product.get('unit_type', 'grams') == 'grams':
-            price_text = f"💰 Цена: {product['price']} RSD/100г\n"
-            stock_text = f"📦 В наличии: {product['stock_grams']}г\n"
-            cart_text = f"🛒 В корзине: {current_in_cart}г\n"
-        else:
-            price_text = f"💰 Цена: {product['price']} RSD/шт\n"
-            stock_text = f"📦 В наличии: {product['stock_grams']}шт\n"
-            cart_text = f"🛒 В корзине: {current_in_cart}шт\n"
-
-        caption += price_text
-        caption += cart_text
-        caption += "\nВыберите количество:"
-
-        keyboard = product_card_keyboard(
-            product_id,
-            category_id,
-            temp_qty,
-            product.get("unit_type", "grams"),
-            product.get("measurement_step", 100)
-        )
+        caption, keyboard = build_product_card(card, category_id, temp_qty)
 
         # Используем clean_ui для чистого показа товара
         await clean_ui.smart_show_product(
             callback=callback,
             text=caption,
             keyboard=keyboard,
-            photo_url=product.get('image_url')
+            photo_url=card["product"].get('image_url')
         )
 
     except Exception as e:
@@ -297,7 +458,10 @@ async def back_to_products(callback: CallbackQuery):
         await clean_ui.safe_edit_or_send(
             callback=callback,
             text="📦 Товары\n\nВыберите товар:",
-            keyboard=products_keyboard(products, category_id)
+            keyboard=keyboard_cache.get(
+                ("products", category_id, 0), _catalog_version(),
+                lambda: products_keyboard(products, category_id)
+            )
         )
 
     except Exception as e:
@@ -307,7 +471,7 @@ async def back_to_products(callback: CallbackQuery):
 # ========== УПРАВЛЕНИЕ КОЛИЧЕСТВОМ ==========
 
 @router.callback_query(F.data.startswith("qty_"))
-async def handle_quantity(callback: CallbackQuery):
+async def handle_quantity(callback: CallbackQuery, user_id: int):
     """Обработка изменения предварительного количества с обновлением фото"""
     try:
         parts = callback.data.split(":")
@@ -322,31 +486,20 @@ async def handle_quantity(callback: CallbackQuery):
             await callback.answer("📊 Предварительное количество")
             return
 
-        # Получаем данные о товаре
-        product = await catalog_service.get_product(product_id)
-        if not product:
+        # Получаем данные о товаре и количество в корзине (при серии нажатий - из памяти)
+        card = await get_card_for_taps(user_id, callback.from_user.id, callback.message.message_id, product_id)
+        if not card:
             await callback.answer("❌ Товар не найден", show_alert=True)
             return
-
-        user = await cart_service.get_or_create_user(callback.from_user.id)
+        product = card["product"]
+        current_in_cart = card["cart_quantity"]
 
         # Определяем дельту с учетом шага измерения товара
         measurement_step = product.get('measurement_step', 100)
         delta = -measurement_step if action == "qty_dec" else measurement_step
 
-        # Получаем текущее количество в корзине
-        async with get_session() as session:
-            stmt = select(CartItem).where(
-                CartItem.user_id == user.id,
-                CartItem.product_id == product_id
-            )
-            result = await session.execute(stmt)
-            cart_item = result.scalar_one_or_none()
-            current_in_cart = cart_item.quantity if cart_item else 0
-
         # Получаем текущее временное количество
-        temp_key = get_temp_quantity_key(callback.from_user.id, product_id)
-        current_temp = temp_quantities.get(temp_key, 0)
+        current_temp = await get_temp_quantity(callback.from_user.id, product_id)
 
         # Проверяем общее количество (в корзине + новое временное)
         new_temp = current_temp + delta
@@ -365,56 +518,33 @@ async def handle_quantity(callback: CallbackQuery):
             await callback.answer(f"❌ Максимально можно добавить: {max_can_add}{unit_suffix}", show_alert=True)
             if max_can_add <= 0:
                 return
+            answered = True
+        else:
+            answered = False
 
         # Обновляем временное количество
-        temp_quantities[temp_key] = new_temp
-
-        # Формируем описание/подпись
-        description = product.get("description", "") or ""
-        caption = (
-            f"🦴 {product['name']}\n\n"
-            f"{description}\n\n"
-        )
+        await temp_quantities.set(callback.from_user.id, product_id, new_temp)
 
-        # Отображение цены в зависимости от типа товара
-        if product.get('unit_type', 'grams') == 'grams':
-            price_text = f"💰 Цена: {product['price']} RSD/100г\n"
-            stock_text = f"📦 В наличии: {product['stock_grams']}г\n"
-            cart_text = f"🛒 В корзине: {current_in_cart}г\n"
-        else:
-            price_text = f"💰 Цена: {product['price']} RSD/шт\n"
-            stock_text = f"📦 В наличии: {product['stock_grams']}шт\n"
-            cart_text = f"🛒 В корзине: {current_in_cart}шт\n"
-
-        caption += price_text
-        caption += cart_text
-        caption += "\nВыберите количество:"
-
-        keyboard = product_card_keyboard(
-            product_id,
-            category_id,
-            new_temp,
-            product.get("unit_type", "grams"),
-            product.get("measurement_step", 100)
-        )
+        caption, keyboard = build_product_card(card, category_id, new_temp)
 
-        # Обновляем сообщение через clean_ui
-        await clean_ui.handle_product_quantity_change(
+        # Карточка обновится одной правкой после паузы в нажатиях
+        await clean_ui.schedule_product_card_update(
             callback=callback,
             text=caption,
             keyboard=keyboard
         )
 
-        # Показываем информацию о предварительном количестве
-        unit_suffix = "г" if product.get('unit_type', 'grams') == 'grams' else "шт"
-        await callback.answer(f"Предварительное количество: {new_temp}{unit_suffix}")
+        # Показываем информацию о предварительном количестве (на колбэк отвечаем один раз)
+        if not answered:
+            unit_suffix = "г" if product.get('unit_type', 'grams') == 'grams' else "шт"
+            await callback.answer(f"Предварительное количество: {new_temp}{unit_suffix}")
 
     except Exception as e:
         logger.error(f"Ошибка изменения количества: {e}")
         await callback.answer("❌ Ошибка", show_alert=True)
 
 @router.callback_query(F.data.startswith("cart_add:"))
-async def add_to_cart(callback: CallbackQuery):
+async def add_to_cart(callback: CallbackQuery, user_id: int):
     """Добавить товар в корзину (предварительное количество)"""
     try:
         parts = callback.data.split(":")
@@ -425,59 +555,36 @@ async def add_to_cart(callback: CallbackQuery):
         quantity = int(parts[2])
         category_id = int(parts[3])
 
+        # Кнопка могла еще не обновиться после быстрых нажатий +/- -
+        # актуальное количество хранится в памяти
+        quantity = await get_temp_quantity(callback.from_user.id, product_id) or quantity
+
         if quantity <= 0:
             await callback.answer("⚠️ Сначала выберите количество", show_alert=True)
             return
 
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        result = await cart_service.add_to_cart(user.id, product_id, quantity)
+        # Двойное нажатие "В корзину" добавляет товар один раз
+        result = await idempotency.run(
+            user_id, ("cart_add", callback.message.message_id, product_id, quantity),
+            cart_service.add_to_cart, user_id, product_id, quantity,
+            ttl=3
+        )
 
-        if result["success"]:
+        if result["success"] and result.get("duplicate"):
+            await callback.answer("✅ Уже добавлено в корзину")
+        elif result["success"]:
             # Сбрасываем временное количество
-            reset_temp_quantity(callback.from_user.id, product_id)
-
-            # Обновляем отображение с новым количеством в корзине
-            product = await catalog_service.get_product(product_id)
-
-            # Получаем обновленное количество в корзине
-            async with get_session() as session:
-                stmt = select(CartItem).where(
-                    CartItem.user_id == user.id,
-                    CartItem.product_id == product_id
-                )
-                result2 = await session.execute(stmt)
-                cart_item = result2.scalar_one_or_none()
-                current_in_cart = cart_item.quantity if cart_item else 0
-
-            # Формируем описание/подпись
-            description = product.get("description", "") or ""
-            caption = (
-                f"🦴 {product['name']}\n\n"
-                f"{description}\n\n"
-            )
-
-            # Отображение цены в зависимости от типа товара
-            if product.get('unit_type', 'grams') == 'grams':
-                price_text = f"💰 Цена: {product['price']} RSD/100г\n"
-                stock_text = f"📦 В наличии: {product['stock_grams']}г\n"
-                cart_text = f"✅ В корзине: {current_in_cart}г\n"
-            else:
-                price_text = f"💰 Цена: {product['price']} RSD/шт\n"
-                stock_text = f"📦 В наличии: {product['stock_grams']}шт\n"
-                cart_text = f"✅ В корзине: {current_in_cart}шт\n"
+            await reset_temp_quantity(callback.from_user.id, product_id)
+            card_contexts.pop(callback.from_user.id, (callback.message.message_id, product_id))
 
-            caption += price_text
-            caption += cart_text
-            caption += f"\nТовар добавлен в корзину!"
+            # Количество в корзине уже известно из результата - повторно не читаем
+            card = await product_card_service.get_card(user_id, product_id, cart_quantity=result["quantity"])
+            if not card:
+                await callback.answer("❌ Товар не найден", show_alert=True)
+                return
 
             # Обновляем сообщение с сброшенным счетчиком
-            keyboard = product_card_keyboard(
-                product_id,
-                category_id,
-                0,
-                product.get("unit_type", "grams"),
-                product.get("measurement_step", 100)
-            )
+            caption, keyboard = build_product_card(card, category_id, 0, added=True)
 
             # Обновляем сообщение через clean_ui
             await clean_ui.handle_product_quantity_change(
@@ -486,7 +593,7 @@ async def add_to_cart(callback: CallbackQuery):
                 keyboard=keyboard
             )
 
-            unit_suffix = "г" if product.get("unit_type", "grams") == "grams" else "шт"
+            unit_suffix = "г" if card["product"].get("unit_type", "grams") == "grams" else "шт"
             await callback.answer(f"✅ Добавлено в корзину: {quantity}{unit_suffix}")
         else:
             await callback.answer(result["error"], show_alert=True)
@@ -498,11 +605,10 @@ async def add_to_cart(callback: CallbackQuery):
 # ========== КОРЗИНА ==========
 
 @router.callback_query(F.data.in_(["cart", "cart_check"]))
-async def universal_cart_handler(callback: CallbackQuery):
+async def universal_cart_handler(callback: CallbackQuery, user_id: int):
     """Универсальный обработчик кнопки корзины - для всех мест"""
     try:
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        cart_data = await cart_service.get_cart(user.id)
+        cart_data = await cart_service.get_cart(user_id)
 
         if not cart_data["items"]:
             # Корзина пуста - показываем всплывающее сообщение
@@ -533,25 +639,27 @@ async def universal_cart_handler(callback: CallbackQuery):
         await callback.answer("❌ Ошибка", show_alert=True)
 
 @router.callback_query(F.data == "cart_clear")
-async def clear_cart(callback: CallbackQuery):
+async def clear_cart(callback: CallbackQuery, user_id: int):
     """Очистить корзину с перенаправлением в главное меню"""
     try:
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        cart_data = await cart_service.get_cart(user.id)
+        # Очищаем корзину (повторное нажатие не очищает второй раз)
+        result = await idempotency.run(
+            user_id, ("cart_clear", callback.message.message_id),
+            cart_service.clear_cart, user_id,
+            ttl=3
+        )
 
-        if not cart_data["items"]:
-            await callback.answer("🛒 Корзина уже пуста", show_alert=True)
+        if result.get("duplicate"):
+            await callback.answer()
             return
 
-        # Очищаем корзину
-        result = await cart_service.clear_cart(user.id)
+        if result["success"] and not result["removed_items"]:
+            await callback.answer("🛒 Корзина уже пуста", show_alert=True)
+            return
 
         if result["success"]:
             # Очищаем временные количества
-            user_prefix = f"{callback.from_user.id}_"
-            keys_to_remove = [k for k in temp_quantities.keys() if k.startswith(user_prefix)]
-            for key in keys_to_remove:
-                temp_quantities.pop(key, None)
+            await clear_temp_quantities(callback.from_user.id)
 
             # Показываем сообщение
             await callback.answer("✅ Корзина очищена", show_alert=False)
@@ -572,22 +680,24 @@ async def clear_cart(callback: CallbackQuery):
 # ========== ОБРАБОТКА ЗАКАЗА (НОВАЯ ВЕРСИЯ С КНОПКАМИ ДЛЯ АДРЕСА) ==========
 
 @router.callback_query(F.data == "order_create")
-async def start_order(callback: CallbackQuery, state: FSMContext):
+async def start_order(callback: CallbackQuery, state: FSMContext, user_id: int):
     """Начать оформление заказа - НОВАЯ ВЕРСИЯ"""
     try:
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        cart_data = await cart_service.get_cart(user.id)
+        cart_data = await cart_service.get_cart(user_id)
 
         if not cart_data["items"]:
             await callback.answer("🛒 Корзина пуста!", show_alert=True)
             return
 
         # Получаем информацию о пользователе
-        user_info = await user_service.get_user_info(user.id)
+        user_info = await user_service.get_user_info(user_id)
 
-        # Сохраняем данные о корзине и пользователе
+        # Сохраняем данные о корзине и пользователе;
+        # checkout_token - ключ идемпотентности этого оформления
         await state.update_data(
-            user_id=user.id,
+            checkout_token=uuid.uuid4().hex,
+            placed_order=None,
+            user_id=user_id,
             cart_items=cart_data["items"],
             total_amount=cart_data["total_price"],
             user_info=user_info
@@ -976,142 +1086,18 @@ async def process_telegram_login(message: Message, state: FSMContext):
 
 # ========== ОБРАБОТЧИК ПОДТВЕРЖДЕНИЯ ЗАКАЗА ==========
 
+@router.callback_query(F.data == "order_confirm")
+async def confirm_order(callback: CallbackQuery, state: FSMContext, user_id: int):
     """Подтверждение и создание заказа"""
     try:
         data = await state.get_data()
 
-        # Получаем user_id напрямую
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        user_id = user.id
-
-        # Получаем информацию о пользователе для недостающих данных
-        user_info = await user_service.get_user_info(user_id)
-
-        # Заполняем недостающие данные с использованием правильных имен полей
-        if not data.get("pet_name"):
-            if user_info and user_info.get("pet_name"):
-                data["pet_name"] = user_info.get("pet_name")
-            else:
-                data["pet_name"] = "Гость"
-
-        if not data.get("telegram_login"):
-            # ИСПРАВЛЕНО: используем telegram_username из БД
-            telegram_username = user_info.get("telegram_username") if user_info else None
-            data["telegram_login"] = telegram_username if telegram_username else callback.from_user.username or "unknown"
-
-        if not data.get("address"):
-            data["address"] = user_info.get("address") if user_info and user_info.get("address") else "Адрес не указан"
-
-        # Обновляем информацию о пользователе в БД
-        user_update_data = {
-            "pet_name": data.get("pet_name"),
-            "telegram_login": data.get("telegram_login")
-        }
-
-        # Очищаем None значения
-        user_update_data = {k: v for k, v in user_update_data.items() if v is not None}
-
-        # Обновляем пользователя
-        await user_service.update_user_info(user_id, **user_update_data)
-
-        async with get_session() as session:
-            # Создаем заказ
-            from database import Order, OrderItem
-            import datetime
-
-            order = Order(
-                user_id=user_id,
-                customer_name=data["pet_name"],
-                phone=f"@{data['telegram_login']}",
-                address=data['address'],
-                total_amount=data['total_amount'],
-                status="pending",
-                created_at=datetime.datetime.now()
-            )
-
-            session.add(order)
-            await session.commit()
-            await session.refresh(order)
-
-            # Создаем элементы заказа
-            for item_data in data['cart_items']:
-                order_item = OrderItem(
-                    order_id=order.id,
-                    product_id=item_data['product_id'],
-                    product_name=item_data['product_name'],
-                    price_per_100g=item_data['price_per_100g'],
-                    quantity=item_data['quantity']
-                )
-                session.add(order_item)
-
-                # Обновляем остатки товара
-                stock_result = await update_product_stock_and_availability(
-                    item_data['product_id'],
-                    item_data['quantity']
-                )
-
-                if stock_result["success"] and stock_result.get("hidden"):
-                    logger.info(f"Товар {stock_result['product_name']} автоматически скрыт после заказа")
-
-                    # Уведомления о закончившемся товаре (опционально)
-                    try:
-                        notified = await check_and_notify_out_of_stock(
-                            callback.bot,
-                            item_data['product_id'],
-                            item_data['product_name'],
-                            ordering_user_id=user_id
-                        )
-                        if notified > 0:
-                            logger.info(f"Уведомлено {notified} пользователей о закончившемся товаре")
-                    except Exception as notify_error:
-                        logger.error(f"Ошибка уведомления: {notify_error}")
-
-            await session.commit()
-
-            # Очищаем корзину
-            await cart_service.clear_cart(user_id)
-
-            # Уведомление админу
-            try:
-                from notifications import notify_admin
-                await notify_admin(callback.bot, data, order.id)
-            except Exception as admin_error:
-                logger.error(f"Ошибка отправки уведомления админу: {admin_error}")
-
-            await state.clear()
-
-            success_text = (
-                "🎉 *Заказ успешно оформлен!*\n\n"
-                f"📦 *Номер заказа:* #{order.id}\n"
-                f"💰 *Сумма:* {order.total_amount:.0f} RSD\n\n"
-                "📞 *Что дальше?*\n"
-                "1. Мы свяжемся с вами для подтверждения заказа\n"
-                "2. Подготовим ваши лакомства\n"
-                "3. Согласуем условия самовывоза или доставки\n\n"
-                "*Спасибо за покупку!* 🐶"
-            )
-
-            # ВМЕСТО safe_edit_message используем clean_ui
-            await clean_ui.safe_edit_or_send(
-                callback=callback,
-                text=success_text,
-                keyboard=main_menu_keyboard()
-            )
-
-            await callback.answer()
-
-    except Exception as e:
-        logger.error(f"Ошибка подтверждения заказа: {e}")
-        await callback.answer("❌ Ошибка создания заказа", show_alert=True)
-
-        # ========== ИСПРАВЛЕННЫЙ ОБРАБОТЧИК ПОДТВЕРЖДЕНИЯ ЗАКАЗА ==========
+        # Повторное нажатие после оформления: состояние уже сброшено,
+        # но результат оформления сохранен - показываем тот же заказ
+        if data.get("placed_order"):
+            await show_order_placed(callback, data["placed_order"])
+            return
 
-@router.callback_query(F.data == "order_confirm")
-async def confirm_order(callback: CallbackQuery, state: FSMContext):
-    """Подтверждение и создание заказа"""
-    try:
-        data = await state.get_data()
-        
         if not data:
             await callback.answer("❌ Данные заказа не найдены", show_alert=True)
             await clean_ui.safe_edit_or_send(
@@ -1121,10 +1107,6 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
             )
             return
 
-        # Получаем user_id напрямую
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        user_id = user.id
-
         # Получаем информацию о пользователе для недостающих данных
         user_info = await user_service.get_user_info(user_id)
 
@@ -1164,84 +1146,64 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
             if user_update_data:
                 await user_service.update_user_info(user_id, **user_update_data)
 
-        async with get_session() as session:
-            # Создаем заказ
-            from database import Order, OrderItem
-            import datetime
-
-            order = Order(
-                user_id=user_id,
-                customer_name=data["pet_name"],
-                phone=f"@{data['telegram_login']}",
-                address=data['address'],
-                total_amount=data['total_amount'],
-                status="pending",
-                created_at=datetime.datetime.now()
-            )
-
-            session.add(order)
-            await session.commit()
-            await session.refresh(order)
-
-            # Создаем элементы заказа
-            for item_data in data['cart_items']:
-                order_item = OrderItem(
-                    order_id=order.id,
-                    product_id=item_data['product_id'],
-                    product_name=item_data['product_name'],
-                    price_per_100g=item_data['price_per_100g'],
-                    quantity=item_data['quantity']
-                )
-                session.add(order_item)
+        # Заказ, списание остатков и очистка корзины - одной транзакцией.
+        # Двойное нажатие или повторная доставка callback получают тот же заказ
+        checkout_key = ("checkout", data.get("checkout_token") or callback.id)
+        result = await idempotency.run(
+            user_id, checkout_key, checkout_service.checkout,
+            user_id=user_id,
+            customer_name=data["pet_name"],
+            phone=f"@{data['telegram_login']}",
+            address=data['address'],
+            cart_items=data['cart_items'],
+            total_amount=data['total_amount'],
+            idempotency_key=checkout_key,
+            ttl=600
+        )
 
-                # Обновляем остатки товара
-                try:
-                    await update_product_stock_and_availability(
-                        item_data['product_id'],
-                        item_data['quantity']
-                    )
-                except Exception as stock_error:
-                    logger.error(f"Ошибка обновления остатков: {stock_error}")
+        if not result["success"]:
+            await state.clear()
 
-            await session.commit()
+            if result["error"] == "insufficient_stock":
+                shortage_lines = "\n".join([
+                    f"• {item['product_name'] or item['product_id']}: доступно "
+                    f"{item['available']}{'г' if item['unit_type'] == 'grams' else 'шт'}"
+                    for item in result["shortages"]
+                ])
+                await callback.answer("❌ Недостаточно товара на складе", show_alert=True)
+                await clean_ui.safe_edit_or_send(
+                    callback=callback,
+                    text=(
+                        "❌ Заказ не оформлен: некоторых товаров уже не хватает\n\n"
+                        f"{shortage_lines}\n\n"
+                        "Измените количество в корзине и оформите заказ снова."
+                    ),
+                    keyboard=main_menu_keyboard()
+                )
+            else:
+                await callback.answer("❌ Корзина пуста", show_alert=True)
+                await clean_ui.safe_edit_or_send(
+                    callback=callback,
+                    text="🐕 Главное меню\n\nВыберите действие:",
+                    keyboard=main_menu_keyboard()
+                )
+            return
 
-            # Очищаем корзину
-            await cart_service.clear_cart(user_id)
+        order_id = result["order_id"]
 
+        # Повтор уже оформленного заказа - только показываем результат.
+        # Уведомление админу записано в outbox вместе с заказом
+        if not result.get("duplicate"):
             # Очищаем временные количества
-            user_prefix = f"{callback.from_user.id}_"
-            keys_to_remove = [k for k in temp_quantities.keys() if k.startswith(user_prefix)]
-            for key in keys_to_remove:
-                temp_quantities.pop(key, None)
-
-            # Уведомление админу
-            try:
-                from notifications import notify_admin
-                await notify_admin(callback.bot, data, order.id)
-            except Exception as admin_error:
-                logger.error(f"Ошибка отправки уведомления админу: {admin_error}")
-
-            # Очищаем состояние
-            await state.clear()
-
-            success_text = (
-                "🎉 *Заказ успешно оформлен!*\n\n"
-                f"📦 *Номер заказа:* #{order.id}\n"
-                f"💰 *Сумма:* {order.total_amount:.0f} RSD\n\n"
-                "📞 *Что дальше?*\n"
-                "1. Мы свяжемся с вами для подтверждения заказа\n"
-                "2. Подготовим ваши лакомства\n"
-                "3. Согласуем условия самовывоза или доставки\n\n"
-                "*Спасибо за покупку!* 🐶"
-            )
+            await clear_temp_quantities(callback.from_user.id)
 
-            await clean_ui.safe_edit_or_send(
-                callback=callback,
-                text=success_text,
-                keyboard=main_menu_keyboard()
-            )
+        # Очищаем состояние, оставляя токен и результат оформления
+        # для нажатий, которые придут после завершения
+        placed_order = {"order_id": order_id, "total_amount": result["total_amount"]}
+        await state.set_state(None)
+        await state.set_data({"checkout_token": data.get("checkout_token"), "placed_order": placed_order})
 
-            await callback.answer()
+        await show_order_placed(callback, placed_order)
 
     except Exception as e:
         logger.error(f"Ошибка подтверждения заказа: {e}")
@@ -1253,20 +1215,39 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
             keyboard=main_menu_keyboard()
         )
 
+async def show_order_placed(callback: CallbackQuery, placed_order: dict):
+    """Экран оформленного заказа"""
+    success_text = (
+        "🎉 *Заказ успешно оформлен!*\n\n"
+        f"📦 *Номер заказа:* #{placed_order['order_id']}\n"
+        f"💰 *Сумма:* {placed_order['total_amount']:.0f} RSD\n\n"
+        "📞 *Что дальше?*\n"
+        "1. Мы свяжемся с вами для подтверждения заказа\n"
+        "2. Подготовим ваши лакомства\n"
+        "3. Согласуем условия самовывоза или доставки\n\n"
+        "*Спасибо за покупку!* 🐶"
+    )
+
+    await clean_ui.safe_edit_or_send(
+        callback=callback,
+        text=success_text,
+        keyboard=main_menu_keyboard()
+    )
+
+    await callback.answer()
+
 # ========== ПРОФИЛЬ ==========
 
 @router.callback_query(F.data == "profile")
-async def show_profile(callback: CallbackQuery):
+async def show_profile(callback: CallbackQuery, user_id: int):
     """Показать профиль"""
     try:
-        user = await cart_service.get_or_create_user(callback.from_user.id)
-        user_info = await user_service.get_user_info(user.id)
+        user_info = await user_service.get_user_info(user_id)
 
         if not user_info:
             profile_text = (
                 f"👤 Ваш профиль\n\n"
-                f"🆔 ID: {user.id}\n"
-                f"📅 Зарегистрирован: {user.created_at.strftime('%d.%m.%Y')}\n\n"
+                f"🆔 ID: {user_id}\n\n"
                 "Данные будут заполнены после первого заказа."
             )
         else:
@@ -1,9 +1,11 @@
 """
 Мониторинг здоровья бота
 """
+import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +22,10 @@ class HealthMonitor:
             "db_size_mb": 0,
             "uptime_hours": 0
         }
+        # Последний результат check_health для /healthz
+        self._last_health: Optional[Dict] = None
+        self._last_health_at = 0.0
+        self._health_task: Optional[asyncio.Task] = None
 
     async def check_health(self) -> Dict:
         """Проверка состояния системы"""
@@ -41,7 +47,7 @@ class HealthMonitor:
                     self.stats["db_size_mb"] = round(os.path.getsize(db_path) / (1024 * 1024), 2)
 
             # 2. Проверка бекапов
-            from backup import backup_manager
+            from backup_service import backup_manager
             backup_stats = await backup_manager.get_backup_stats()
 
             # 3. Рассчитываем аптайм
@@ -84,6 +90,25 @@ class HealthMonitor:
                 "timestamp": datetime.now().isoformat()
             }
 
+    async def cached_health(self, max_age: float = 30) -> Dict:
+        """
+        Результат check_health не старше max_age секунд: частые проверки
+        (балансировщик, Prometheus) не обращаются к SQLite каждый раз,
+        а одновременные запросы ждут одну проверку.
+        """
+        if self._last_health is not None and time.monotonic() - self._last_health_at < max_age:
+            return self._last_health
+
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._refresh_health())
+        return await asyncio.shield(self._health_task)
+
+    async def _refresh_health(self) -> Dict:
+        health = await self.check_health()
+        self._last_health = health
+        self._last_health_at = time.monotonic()
+        return health
+
     def increment_message(self):
         self.stats["total_messages"] += 1
 
@@ -0,0 +1,173 @@
+"""
+Идемпотентность операций по кнопкам Barkery Shop
+
+Двойное нажатие или повторная доставка callback не должны выполнять
+операцию дважды. Ключ операции - (пользователь, операция, токен):
+для заказа токен оформления из FSM, для корзины - сообщение и товар.
+- Одновременные повторы ждут результат первого вызова (in-flight map),
+  а не выполняют работу заново.
+- Готовый результат хранится в памяти ttl секунд, повтор получает его
+  копию с duplicate=True.
+- Для заказа результат пишется в idempotency_keys в транзакции заказа:
+  уникальный ключ не дает создать второй заказ даже из другого процесса
+  или после перезапуска. Старые ключи удаляет фоновая задача, а не
+  транзакция заказа.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import delete, select
+
+from database import get_session, IdempotencyKey
+from state_store import ExpiringKeyedStore
+
+logger = logging.getLogger(__name__)
+
+
+def durable_key(user_id: int, key: Tuple) -> str:
+    """Ключ строки idempotency_keys"""
+    return ":".join(str(part) for part in (user_id, *key))
+
+
+class IdempotencyLayer:
+    """In-flight map и кэш результатов по (user_id, ключ)"""
+
+    def __init__(self, max_ttl_seconds: float = 3600, max_size: int = 50000, retention_days: float = 7):
+        # (user_id, key) -> Future первого вызова
+        self._inflight: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+        # (user_id, key) -> (результат, срок действия)
+        self._results = ExpiringKeyedStore(ttl_seconds=max_ttl_seconds, max_size=max_size)
+        self.retention_seconds = retention_days * 86400
+        self._purge_task: Optional[asyncio.Task] = None
+
+        self.executed = 0
+        self.joined = 0
+        self.replayed = 0
+
+    async def run(
+            self,
+            user_id: int,
+            key: Tuple,
+            func: Callable[..., Awaitable[Dict]],
+            /,
+            *args,
+            ttl: float = 60,
+            **kwargs
+    ) -> Dict:
+        """
+        Выполнить func(*args, **kwargs) один раз для (user_id, key).
+        Повтор во время выполнения ждет первый вызов, повтор в течение ttl
+        получает сохраненный результат; у повторов result["duplicate"] = True.
+        """
+        cached = self._results.get(user_id, key)
+        if cached is not None and cached[1] > time.monotonic():
+            self.replayed += 1
+            return _replay(cached[0])
+
+        future = self._inflight.get((user_id, key))
+        if future is not None:
+            self.joined += 1
+            return _replay(await asyncio.shield(future))
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[(user_id, key)] = future
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Ожидающих может не быть - помечаем исключение полученным
+            future.exception()
+            raise
+        else:
+            self.executed += 1
+            self._results.set(user_id, key, (result, time.monotonic() + ttl))
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop((user_id, key), None)
+
+    # ---------- результаты в БД ----------
+
+    async def stored_result(self, user_id: int, key: Tuple) -> Optional[Dict]:
+        """Результат из idempotency_keys (операция уже выполнена другим процессом или до перезапуска)"""
+        async with get_session() as session:
+            raw = (await session.execute(
+                select(IdempotencyKey.result).where(IdempotencyKey.key == durable_key(user_id, key))
+            )).scalar_one_or_none()
+        return _replay(json.loads(raw)) if raw else None
+
+    async def claim(self, session, user_id: int, key: Tuple) -> IdempotencyKey:
+        """
+        Занять ключ в транзакции session. Второй вызов с тем же ключом
+        получит IntegrityError при flush (уникальный ключ), и его транзакция
+        откатится вместе со всей работой.
+        """
+        record = IdempotencyKey(
+            key=durable_key(user_id, key),
+            scope=str(key[0]),
+            user_id=user_id,
+            created_at=time.time()
+        )
+        session.add(record)
+        await session.flush()
+        return record
+
+    @staticmethod
+    def complete(record: IdempotencyKey, result: Dict) -> None:
+        """Сохранить результат в занятый ключ (до commit транзакции)"""
+        record.result = json.dumps(result, ensure_ascii=False, default=str)
+
+    async def purge(self) -> int:
+        """Удалить ключи старше retention_days (отдельной транзакцией)"""
+        async with get_session() as session:
+            result = await session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.created_at < time.time() - self.retention_seconds)
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"Удалено старых ключей идемпотентности: {result.rowcount}")
+        return result.rowcount
+
+    def start_purge(self, interval: float = 3600) -> None:
+        """Удалять старые ключи раз в interval секунд в фоне"""
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(self._purge_loop(interval))
+
+    async def _purge_loop(self, interval: float) -> None:
+        while True:
+            try:
+                await self.purge()
+            except Exception as e:
+                logger.warning(f"Не удалось удалить старые ключи идемпотентности: {e}")
+            await asyncio.sleep(interval)
+
+    async def stop_purge(self) -> None:
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            await asyncio.gather(self._purge_task, return_exceptions=True)
+            self._purge_task = None
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._inflight),
+            "results": len(self._results),
+            "executed": self.executed,
+            "joined": self.joined,
+            "replayed": self.replayed
+        }
+
+
+def _replay(result: Any) -> Any:
+    if isinstance(result, dict):
+        return {**result, "duplicate": True}
+    return result
+
+
+# Глобальный экземпляр
+idempotency = IdempotencyLayer()
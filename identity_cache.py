@@ -0,0 +1,106 @@
+"""
+Кэш соответствия telegram_id -> внутренний ID пользователя
+
+LRU с ограниченным размером и TTL. Заполняется при первом обращении
+пользователя и обновляется из БД только когда истек TTL или
+изменился Telegram username.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityCache:
+    """LRU-кэш идентификаторов пользователей"""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # telegram_id -> (user_id, username, expires_at)
+        self._items: "OrderedDict[int, Tuple[int, str, float]]" = OrderedDict()
+        # Одновременные промахи по одному пользователю ждут один запрос к БД
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int, username: Optional[str] = None) -> Optional[int]:
+        """Получить user_id из кэша (None - нужно обратиться к БД)"""
+        entry = self._items.get(telegram_id)
+        if entry is None:
+            return None
+
+        user_id, cached_username, expires_at = entry
+        if expires_at < time.monotonic() or (username is not None and username != cached_username):
+            self._items.pop(telegram_id, None)
+            return None
+
+        self._items.move_to_end(telegram_id)
+        return user_id
+
+    def set(self, telegram_id: int, user_id: int, username: str = "") -> None:
+        """Запомнить user_id пользователя"""
+        self._items[telegram_id] = (user_id, username or "", time.monotonic() + self.ttl_seconds)
+        self._items.move_to_end(telegram_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, telegram_id: int) -> None:
+        """Удалить пользователя из кэша"""
+        self._items.pop(telegram_id, None)
+
+    def clear(self) -> None:
+        """Очистить кэш"""
+        self._items.clear()
+
+    async def resolve(self, telegram_id: int, username: str = "", full_name: str = "") -> int:
+        """Получить внутренний ID пользователя, при необходимости создав его"""
+        username = username or ""
+        user_id = self.get(telegram_id, username)
+        if user_id is not None:
+            self.hits += 1
+            return user_id
+
+        self.misses += 1
+
+        inflight = self._inflight.get(telegram_id)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[telegram_id] = future
+        try:
+            from services import cart_service
+            user = await cart_service.get_or_create_user(
+                telegram_id=telegram_id,
+                username=username,
+                full_name=full_name or ""
+            )
+            self.set(telegram_id, user.id, username)
+            future.set_result(user.id)
+            return user.id
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, не даем asyncio ругаться на него
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(telegram_id, None)
+
+    def stats(self) -> Dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+# Глобальный экземпляр
+identity_cache = IdentityCache()
@@ -0,0 +1,313 @@
+"""
+Фото товаров для Barkery Shop
+
+image_url товара - file_id Telegram (фото загружено админом) или
+внешний URL (импорт каталога, ссылка). По URL Telegram скачивает фото
+при каждой отправке, поэтому URL отправляется один раз, а дальше - по
+file_id из таблицы product_images (в памяти - словарь URL -> file_id).
+Если Telegram не смог скачать URL (слишком большой файл, неудобный
+формат), бот сам скачивает фото, уменьшает до max_side и пережимает в
+JPEG в отдельном потоке (нужен Pillow, без него файл уходит как есть)
+и загружает байтами. /warm_images заранее загружает все фото каталога.
+"""
+import asyncio
+import io
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from config import settings
+from database import get_session, Product, ProductImage
+from outbound import outbound, PRIORITY_CLEANUP
+
+logger = logging.getLogger(__name__)
+
+
+def is_remote(url: Optional[str]) -> bool:
+    """Внешняя ссылка (а не file_id Telegram)"""
+    return bool(url) and url.startswith(("http://", "https://"))
+
+
+def downscale(data: bytes, max_side: int, quality: int) -> Tuple[bytes, Optional[int], Optional[int]]:
+    """
+    Уменьшить изображение до max_side по большей стороне и пережать в JPEG.
+    Вызывается в отдельном потоке. Без Pillow возвращает исходные байты.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data, None, None
+
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_side, max_side))
+        if image.mode != "RGB":
+            # Прозрачность - на белый фон
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue(), image.width, image.height
+
+
+class ImagePipeline:
+    """Кэш URL -> file_id и загрузка фото в Telegram"""
+
+    def __init__(
+            self,
+            max_side: int = 1280,
+            jpeg_quality: int = 85,
+            max_download_bytes: int = 20 * 1024 * 1024,
+            download_timeout: float = 30,
+            concurrency: int = 4
+    ):
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.max_download_bytes = max_download_bytes
+        self.download_timeout = download_timeout
+        self.concurrency = concurrency
+
+        self._file_ids: Dict[str, str] = {}
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._warm_task: Optional[asyncio.Task] = None
+        self._pillow_warned = False
+
+        self.hits = 0
+        self.misses = 0
+        self.uploaded = 0
+        self.failed = 0
+
+    async def load(self) -> int:
+        """Загрузить соответствия URL -> file_id из БД"""
+        async with get_session() as session:
+            result = await session.execute(select(ProductImage.url, ProductImage.file_id))
+            self._file_ids = dict(result.all())
+        logger.info(f"🖼️ Фото товаров в кэше file_id: {len(self._file_ids)}")
+        return len(self._file_ids)
+
+    # ---------- отправка ----------
+
+    def photo(self, url: str) -> str:
+        """Что передать в send_photo: file_id из кэша, иначе сам url"""
+        if not is_remote(url):
+            return url
+        file_id = self._file_ids.get(url)
+        if file_id is None:
+            self.misses += 1
+            return url
+        self.hits += 1
+        return file_id
+
+    async def send_photo(self, url: str, send: Callable[[object], Awaitable[Message]]) -> Message:
+        """
+        Отправить фото url: send(photo) делает сам запрос (send_photo с подписью,
+        клавиатурой и т.д.). После первой отправки URL запоминается его file_id.
+        """
+        photo = self.photo(url)
+        if not is_remote(url):
+            return await send(photo)
+
+        try:
+            message = await send(photo)
+        except TelegramBadRequest as e:
+            # Устаревший file_id или Telegram не смог скачать URL - загружаем сами
+            logger.warning(f"Фото {url} не отправлено ({e}), загружаем файлом")
+            if photo != url:
+                await self.forget(url)
+            data, _, _ = await self.prepare(await self.fetch(url))
+            message = await send(BufferedInputFile(data, filename="product.jpg"))
+            self.uploaded += 1
+
+        if photo == url or url not in self._file_ids:
+            await self.remember(url, message)
+        return message
+
+    # ---------- загрузка ----------
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.download_timeout))
+        return self._http
+
+    async def fetch(self, url: str) -> bytes:
+        """Скачать файл по URL (не больше max_download_bytes)"""
+        async with self._session().get(url) as response:
+            response.raise_for_status()
+            if response.content_length and response.content_length > self.max_download_bytes:
+                raise ValueError(f"файл больше {self.max_download_bytes / (1024 * 1024):g} МБ")
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                data += chunk
+                if len(data) > self.max_download_bytes:
+                    raise ValueError(f"файл больше {self.max_download_bytes / (1024 * 1024):g} МБ")
+            return bytes(data)
+
+    async def prepare(self, data: bytes) -> Tuple[bytes, Optional[int], Optional[int]]:
+        """Уменьшить и пережать фото в отдельном потоке"""
+        result = await asyncio.to_thread(downscale, data, self.max_side, self.jpeg_quality)
+        if result[1] is None and not self._pillow_warned:
+            self._pillow_warned = True
+            logger.warning("Pillow не установлен, фото загружаются без уменьшения: pip install Pillow")
+        return result
+
+    async def upload(self, bot, chat_id: int, data: bytes, notify: bool = False) -> Message:
+        """Загрузить уже подготовленное фото в чат chat_id (фоновый приоритет)"""
+        message = await outbound.send(
+            chat_id,
+            lambda: bot.send_photo(
+                chat_id=chat_id,
+                photo=BufferedInputFile(data, filename="product.jpg"),
+                disable_notification=not notify
+            ),
+            priority=PRIORITY_CLEANUP
+        )
+        self.uploaded += 1
+        return message
+
+    async def ingest_url(self, bot, url: str, chat_id: int, notify: bool = False) -> Message:
+        """Скачать, уменьшить и загрузить фото по URL, запомнить file_id"""
+        data, _, _ = await self.prepare(await self.fetch(url))
+        message = await self.upload(bot, chat_id, data, notify)
+        await self.remember(url, message)
+        return message
+
+    async def ingest_file(self, bot, file_id: str, chat_id: int) -> str:
+        """Картинка, присланная файлом: уменьшить и загрузить как фото, вернуть file_id фото"""
+        buffer = await bot.download(file_id)
+        data, _, _ = await self.prepare(buffer.getvalue())
+        message = await self.upload(bot, chat_id, data, notify=True)
+        return message.photo[-1].file_id
+
+    # ---------- кэш ----------
+
+    async def remember(self, url: str, message: Message) -> None:
+        """Запомнить file_id самого большого размера фото из отправленного сообщения"""
+        if not message.photo:
+            return
+        size = message.photo[-1]
+        self._file_ids[url] = size.file_id
+        try:
+            stmt = sqlite_insert(ProductImage).values(
+                url=url,
+                file_id=size.file_id,
+                width=size.width,
+                height=size.height,
+                size_bytes=size.file_size,
+                created_at=time.time()
+            )
+            async with get_session() as session:
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[ProductImage.url],
+                    set_={
+                        "file_id": stmt.excluded.file_id,
+                        "width": stmt.excluded.width,
+                        "height": stmt.excluded.height,
+                        "size_bytes": stmt.excluded.size_bytes,
+                        "created_at": stmt.excluded.created_at
+                    }
+                ))
+        except Exception as e:
+            # file_id остается в памяти, после перезапуска URL отправится заново
+            logger.error(f"Не удалось сохранить file_id фото {url}: {e}")
+
+    async def forget(self, url: str) -> None:
+        self._file_ids.pop(url, None)
+        async with get_session() as session:
+            await session.execute(delete(ProductImage).where(ProductImage.url == url))
+
+    # ---------- прогрев ----------
+
+    async def warm_all(self, bot, chat_id: int) -> Dict:
+        """
+        Загрузить в Telegram все фото каталога по URL, которых еще нет в кэше.
+        Служебные сообщения в чате chat_id потом удаляются.
+        """
+        async with get_session() as session:
+            result = await session.execute(
+                select(Product.image_url).where(Product.image_url.like("http%")).distinct()
+            )
+            urls = [url for url in result.scalars().all() if is_remote(url)]
+
+        todo = [url for url in urls if url not in self._file_ids]
+        message_ids: List[int] = []
+        errors: List[str] = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def warm(url: str) -> None:
+            async with semaphore:
+                try:
+                    message = await self.ingest_url(bot, url, chat_id)
+                    message_ids.append(message.message_id)
+                except Exception as e:
+                    self.failed += 1
+                    errors.append(f"{url}: {e}")
+
+        started = time.monotonic()
+        await asyncio.gather(*(warm(url) for url in todo))
+
+        for i in range(0, len(message_ids), 100):
+            batch = message_ids[i:i + 100]
+            outbound.post(chat_id, lambda batch=batch: bot.delete_messages(chat_id=chat_id, message_ids=batch),
+                          delete=True)
+
+        logger.info(
+            f"🖼️ Прогрев фото: {len(message_ids)} загружено, {len(errors)} ошибок, "
+            f"{len(urls) - len(todo)} уже были в кэше ({time.monotonic() - started:.1f}с)"
+        )
+        return {
+            "success": True,
+            "total": len(urls),
+            "cached": len(urls) - len(todo),
+            "uploaded": len(message_ids),
+            "failed": len(errors),
+            "errors": errors[:10],
+            "seconds": time.monotonic() - started
+        }
+
+    def start_warm(self, bot, chat_id: int, on_done: Callable[[Dict], Awaitable[None]]) -> bool:
+        """Прогрев в фоне (False - уже идет)"""
+        if self._warm_task is not None and not self._warm_task.done():
+            return False
+
+        async def run():
+            try:
+                result = await self.warm_all(bot, chat_id)
+            except Exception as e:
+                logger.error(f"Ошибка прогрева фото: {e}")
+                result = {"success": False, "error": str(e)}
+            await on_done(result)
+
+        self._warm_task = asyncio.create_task(run())
+        return True
+
+    async def close(self) -> None:
+        if self._warm_task is not None and not self._warm_task.done():
+            self._warm_task.cancel()
+            await asyncio.gather(self._warm_task, return_exceptions=True)
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    def stats(self) -> Dict:
+        return {
+            "cached": len(self._file_ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "uploaded": self.uploaded,
+            "failed": self.failed
+        }
+
+
+# Глобальный экземпляр
+image_pipeline = ImagePipeline(
+    max_side=settings.image_max_side,
+    jpeg_quality=settings.image_jpeg_quality,
+    max_download_bytes=int(settings.image_max_download_mb * 1024 * 1024)
+)
@@ -1,9 +1,39 @@
 """
 Все клавиатуры для Barkery Shop (только Inline)
 """
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+# Кнопок на странице каталога (лимит Telegram - 100 кнопок на сообщение)
+CATEGORIES_PAGE_SIZE = 10
+PRODUCTS_PAGE_SIZE = 10
+
+
+def page_count(total: int, page_size: int) -> int:
+    """Число страниц (минимум одна)"""
+    return max(1, -(-total // page_size))
+
+
+def clamp_page(page: int, total: int, page_size: int) -> int:
+    """Номер страницы в допустимых пределах"""
+    return min(max(page, 0), page_count(total, page_size) - 1)
+
+
+def _page_nav_row(builder: InlineKeyboardBuilder, prefix: str, page: int, pages: int) -> None:
+    """Ряд ◀️ стр ▶️ с callback <prefix>p<n>"""
+    if pages <= 1:
+        return
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"{prefix}p{page - 1}"))
+    buttons.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="page_info"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"{prefix}p{page + 1}"))
+    builder.row(*buttons)
+
 # ========== ПОЛЬЗОВАТЕЛЬСКИЕ КЛАВИАТУРЫ ==========
 
 def main_menu_keyboard() -> InlineKeyboardMarkup:
@@ -25,11 +55,13 @@ def main_menu_keyboard() -> InlineKeyboardMarkup:
 
     return builder.as_markup()
 
-def categories_keyboard(categories: list) -> InlineKeyboardMarkup:
-    """Клавиатура с категориями"""
+def categories_keyboard(categories: list, page: int = 0) -> InlineKeyboardMarkup:
+    """Клавиатура с категориями (страница page, callback листания catalog:p<n>)"""
     builder = InlineKeyboardBuilder()
 
-    for category in categories:
+    page = clamp_page(page, len(categories), CATEGORIES_PAGE_SIZE)
+    start = page * CATEGORIES_PAGE_SIZE
+    for category in categories[start:start + CATEGORIES_PAGE_SIZE]:
         builder.row(
             InlineKeyboardButton(
                 text=f"📦 {category['name']}",
@@ -37,6 +69,8 @@ def categories_keyboard(categories: list) -> InlineKeyboardMarkup:
             )
         )
 
+    _page_nav_row(builder, "catalog:", page, page_count(len(categories), CATEGORIES_PAGE_SIZE))
+
     builder.row(
         InlineKeyboardButton(text="⬅️ Главная", callback_data="main_menu"),
         InlineKeyboardButton(text="🛒 Корзина", callback_data="cart_check")  # Было cart
@@ -45,27 +79,35 @@ def categories_keyboard(categories: list) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def products_keyboard(products: list, category_id: int) -> InlineKeyboardMarkup:
-    """Клавиатура с товарами категории - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
-    builder = InlineKeyboardBuilder()
+def product_price_text(product: dict) -> str:
+    """Цена за 100 г для весовых товаров, за штуку для штучных"""
+    if product.get('unit_type', 'grams') == 'grams':
+        return f"{product['price']} RSD/100г"
+    return f"{product['price']} RSD/шт"
 
-    for product in products:
-        # ИСПРАВЛЕНО: Определяем отображение цены в зависимости от типа товара
-        unit_type = product.get('unit_type', 'grams')
-        if unit_type == 'grams':
-            price_text = f"{product['price']} RSD/100г"
-        else:  # pieces
-            price_text = f"{product['price']} RSD/шт"
 
-        stock_status = "✅" if product['available'] and product['stock_grams'] > 0 else "⏳"
+def product_button_text(product: dict) -> str:
+    """Кнопка товара в списке: наличие, название, цена"""
+    stock_status = "✅" if product['available'] and product['stock_grams'] > 0 else "⏳"
+    return f"{stock_status} {product['name']} - {product_price_text(product)}"
+
 
+def products_keyboard(products: list, category_id: int, page: int = 0) -> InlineKeyboardMarkup:
+    """Клавиатура с товарами категории (страница page, callback листания category:<id>:p<n>)"""
+    builder = InlineKeyboardBuilder()
+
+    page = clamp_page(page, len(products), PRODUCTS_PAGE_SIZE)
+    start = page * PRODUCTS_PAGE_SIZE
+    for product in products[start:start + PRODUCTS_PAGE_SIZE]:
         builder.row(
             InlineKeyboardButton(
-                text=f"{stock_status} {product['name']} - {price_text}",
+                text=product_button_text(product),
                 callback_data=f"product:{product['id']}:{category_id}"
             )
         )
 
+    _page_nav_row(builder, f"category:{category_id}:", page, page_count(len(products), PRODUCTS_PAGE_SIZE))
+
     builder.row(
         InlineKeyboardButton(text="⬅️ Назад", callback_data="catalog"),
         InlineKeyboardButton(text="🛒 Корзина", callback_data="cart_check")
@@ -73,6 +115,35 @@ def products_keyboard(products: list, category_id: int) -> InlineKeyboardMarkup:
 
     return builder.as_markup()
 
+def search_results_keyboard(products: list, page: int, has_next: bool) -> InlineKeyboardMarkup:
+    """Результаты /search: товары страницы и листание search:p<n>"""
+    builder = InlineKeyboardBuilder()
+
+    for product in products:
+        builder.row(
+            InlineKeyboardButton(
+                text=product_button_text(product),
+                callback_data=f"product:{product['id']}:{product['category_id']}"
+            )
+        )
+
+    if page > 0 or has_next:
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"search:p{page - 1}"))
+        buttons.append(InlineKeyboardButton(text=f"{page + 1}", callback_data="page_info"))
+        if has_next:
+            buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"search:p{page + 1}"))
+        builder.row(*buttons)
+
+    builder.row(
+        InlineKeyboardButton(text="📦 Каталог", callback_data="catalog"),
+        InlineKeyboardButton(text="🛒 Корзина", callback_data="cart_check")
+    )
+
+    return builder.as_markup()
+
+
 def product_card_keyboard(product_id: int, category_id: int, current_qty: int = 0, unit_type: str = 'grams', measurement_step: int = 100) -> InlineKeyboardMarkup:
     """Карточка товара с кнопками +/-"""
     builder = InlineKeyboardBuilder()
@@ -117,12 +188,50 @@ def product_card_keyboard(product_id: int, category_id: int, current_qty: int =
 
     # Ряд 3: Навигация
     builder.row(
-        InlineKeyboardButton(text="⬅️ Назад", callback_data=f"category:{category_id}"),
+        # Возврат на страницу списка, где был товар
+        InlineKeyboardButton(text="⬅️ Назад", callback_data=f"category:{category_id}:i{product_id}"),
         InlineKeyboardButton(text="🛒 Корзина", callback_data="cart_check")  # Добавить, если нет
     )
 
     return builder.as_markup()
 
+def build_product_card(card: dict, category_id: int, temp_qty: int = 0, added: bool = False) -> tuple:
+    """
+    Подпись и клавиатура карточки товара.
+    card - результат ProductCardService.get_card, чистая функция без обращений к БД
+    """
+    product = card["product"]
+    current_in_cart = card["cart_quantity"]
+    unit_type = product.get("unit_type", "grams")
+
+    description = product.get("description", "") or ""
+    caption = (
+        f"🦴 {product['name']}\n\n"
+        f"{description}\n\n"
+    )
+
+    # Отображение цены в зависимости от типа товара
+    cart_icon = "✅" if added else "🛒"
+    if unit_type == 'grams':
+        caption += f"💰 Цена: {product['price']} RSD/100г\n"
+        caption += f"{cart_icon} В корзине: {current_in_cart}г\n"
+    else:
+        caption += f"💰 Цена: {product['price']} RSD/шт\n"
+        caption += f"{cart_icon} В корзине: {current_in_cart}шт\n"
+
+    caption += "\nТовар добавлен в корзину!" if added else "\nВыберите количество:"
+
+    keyboard = product_card_keyboard(
+        product["id"],
+        category_id,
+        temp_qty,
+        unit_type,
+        product.get("measurement_step", 100)
+    )
+
+    return caption, keyboard
+
+
 def cart_keyboard(cart_items: list, total_price: float) -> InlineKeyboardMarkup:
     """Клавиатура корзины"""
     builder = InlineKeyboardBuilder()
@@ -378,3 +487,52 @@ def address_choice_keyboard() -> InlineKeyboardMarkup:
     )
     
     return builder.as_markup()
+
+
+# ========== КЭШ СТРАНИЦ КАТАЛОГА ==========
+
+class KeyboardCache:
+    """
+    Готовые страницы клавиатур каталога для одной версии каталога.
+    При смене версии (любое изменение товаров или категорий) кэш очищается.
+    """
+
+    def __init__(self, max_size: int = 2000):
+        self.max_size = max_size
+        self.version: Optional[int] = None
+        self._items: "OrderedDict[Hashable, InlineKeyboardMarkup]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: Optional[int], build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+        """Страница key для версии version; version=None (каталог не в памяти) - без кэша"""
+        if version is None:
+            self.misses += 1
+            return build()
+        if version != self.version:
+            self._items.clear()
+            self.version = version
+
+        markup = self._items.get(key)
+        if markup is not None:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return markup
+
+        self.misses += 1
+        markup = build()
+        self._items[key] = markup
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return markup
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.version = None
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._items)}
+
+
+# Глобальный экземпляр
+keyboard_cache = KeyboardCache()
@@ -1,14 +1,16 @@
 """
 Конфигурация логирования для Barkery Shop
 """
+import asyncio
 import logging
 import sys
 import time
+from array import array
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from datetime import datetime
 from functools import wraps
-from typing import Callable, Any
+from typing import Callable, Any, Dict, Iterable, List, Optional
 
 def setup_logging():
     """Настройка логирования для всего приложения"""
@@ -104,12 +106,159 @@ class OperationLogger:
         logger.info(log_entry)
 
 
-class PerformanceMonitor:
-    """Мониторинг производительности"""
+# ========== МЕТРИКИ ЗАДЕРЖЕК ==========
+
+# Лог-линейные гистограммы (как в HDR Histogram): каждый диапазон [2^k, 2^(k+1))
+# делится на HIST_SUB_BUCKETS равных частей. Память фиксирована, относительная
+# ошибка значения - не больше 1/(2*HIST_SUB_BUCKETS) (середина корзины).
+HIST_SUB_BUCKET_BITS = 4
+HIST_SUB_BUCKETS = 1 << HIST_SUB_BUCKET_BITS
+HIST_MAX_VALUE_US = (1 << 32) - 1  # ~71 минута, больше - в последнюю корзину
+
+
+def _bucket_index(value_us: int) -> int:
+    if value_us < HIST_SUB_BUCKETS:
+        return value_us
+    shift = value_us.bit_length() - HIST_SUB_BUCKET_BITS - 1
+    return (shift + 1) * HIST_SUB_BUCKETS + (value_us >> shift) - HIST_SUB_BUCKETS
+
+
+def _bucket_value(index: int) -> float:
+    """Середина диапазона корзины (мкс)"""
+    if index < HIST_SUB_BUCKETS:
+        return float(index)
+    shift = index // HIST_SUB_BUCKETS - 1
+    low = (index % HIST_SUB_BUCKETS + HIST_SUB_BUCKETS) << shift
+    return low + ((1 << shift) - 1) / 2
+
+
+HIST_BUCKETS = _bucket_index(HIST_MAX_VALUE_US) + 1
+_ZERO_COUNTS = bytes(8 * HIST_BUCKETS)
+
+
+class LatencyHistogram:
+    """Гистограмма задержек в микросекундах"""
+
+    __slots__ = ("counts", "count", "total_us", "min_us", "max_us")
 
     def __init__(self):
-        self.operations = {}
+        self.counts = array('Q', _ZERO_COUNTS)
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+
+    def record(self, value_us: int) -> None:
+        if value_us > HIST_MAX_VALUE_US:
+            value_us = HIST_MAX_VALUE_US
+        self.counts[_bucket_index(value_us)] += 1
+        if not self.count or value_us < self.min_us:
+            self.min_us = value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+        self.count += 1
+        self.total_us += value_us
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if not other.count:
+            return
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.min_us = other.min_us if not self.count else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+        self.count += other.count
+        self.total_us += other.total_us
+
+    def cumulative(self, bounds_us: Iterable[int]) -> List[int]:
+        """Число значений не больше каждой границы (границы по возрастанию, точность - корзина)"""
+        result = []
+        counts = self.counts
+        seen = 0
+        index = 0
+        for bound in bounds_us:
+            last = _bucket_index(min(bound, HIST_MAX_VALUE_US))
+            while index <= last:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def percentiles(self, quantiles: Iterable[float]) -> Dict[float, float]:
+        """Значения (мкс) для квантилей за один проход по корзинам"""
+        quantiles = sorted(quantiles)
+        result = {}
+        if not self.count:
+            return {q: 0.0 for q in quantiles}
+
+        seen = 0
+        pending = iter(quantiles)
+        q = next(pending)
+        for index, n in enumerate(self.counts):
+            if not n:
+                continue
+            seen += n
+            while q is not None and seen >= q * self.count:
+                # Крайние значения известны точно
+                result[q] = float(min(max(_bucket_value(index), self.min_us), self.max_us))
+                q = next(pending, None)
+            if q is None:
+                break
+        return result
+
+
+class OperationMetrics:
+    """
+    Метрики одной операции: гистограмма с момента запуска и кольцо
+    гистограмм по slot_seconds для скользящего окна.
+    """
+
+    __slots__ = ("total", "slots", "slot_epochs", "slot_ns", "errors")
+
+    def __init__(self, window_slots: int, slot_seconds: float):
+        self.total = LatencyHistogram()
+        self.slots: List[Optional[LatencyHistogram]] = [None] * window_slots
+        self.slot_epochs = [-1] * window_slots
+        self.slot_ns = int(slot_seconds * 1e9)
+        self.errors = 0
+
+    def record(self, duration_ns: int, now_ns: int) -> None:
+        value_us = duration_ns // 1000
+        self.total.record(value_us)
+
+        epoch = now_ns // self.slot_ns
+        i = epoch % len(self.slots)
+        if self.slot_epochs[i] != epoch:
+            # Слот устарел - начинаем его заново
+            self.slots[i] = LatencyHistogram()
+            self.slot_epochs[i] = epoch
+        self.slots[i].record(value_us)
+
+    def window(self, now_ns: int) -> LatencyHistogram:
+        """Гистограмма за последние window_slots слотов"""
+        merged = LatencyHistogram()
+        oldest = now_ns // self.slot_ns - len(self.slots) + 1
+        for epoch, histogram in zip(self.slot_epochs, self.slots):
+            if histogram is not None and epoch >= oldest:
+                merged.merge(histogram)
+        return merged
+
+
+class PerformanceMonitor:
+    """
+    Мониторинг производительности: гистограммы задержек по операциям.
+    Запись - несколько арифметических операций без блокировок и await,
+    поэтому в asyncio она атомарна и ей можно оборачивать каждый обработчик.
+    """
+
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, window_seconds: float = 300, window_slots: int = 10):
+        self.operations: Dict[str, OperationMetrics] = {}
         self.slow_threshold = 1.0  # 1 секунда
+        self.window_seconds = window_seconds
+        self.window_slots = window_slots
 
     def track_operation(self, operation_name: str):
         """Декоратор для отслеживания времени выполнения"""
@@ -133,107 +282,90 @@ class PerformanceMonitor:
 
     async def _measure_performance(self, func: Callable, operation_name: str, *args, **kwargs) -> Any:
         """Измерение производительности асинхронной функции"""
-        start_time = time.time()
-
+        start = time.perf_counter_ns()
         try:
             result = await func(*args, **kwargs)
-            execution_time = time.time() - start_time
-
-            self._record_operation(operation_name, execution_time, success=True)
-
-            # Логируем медленные операции
-            if execution_time > self.slow_threshold:
-                logger = logging.getLogger("performance")
-                logger.warning(
-                    f"Медленная операция: {operation_name} "
-                    f"заняла {execution_time:.2f}с"
-                )
-
-            return result
-
         except Exception as e:
-            execution_time = time.time() - start_time
-            self._record_operation(operation_name, execution_time, success=False)
-
-            logger = logging.getLogger("performance")
-            logger.error(
-                f"Ошибка в операции {operation_name} "
-                f"после {execution_time:.2f}с: {e}"
+            duration = time.perf_counter_ns() - start
+            self.record(operation_name, duration, success=False)
+            logging.getLogger("performance").error(
+                f"Ошибка в операции {operation_name} после {duration / 1e9:.2f}с: {e}"
             )
             raise
 
+        self.record(operation_name, time.perf_counter_ns() - start)
+        return result
+
     def _measure_performance_sync(self, func: Callable, operation_name: str, *args, **kwargs) -> Any:
         """Измерение производительности синхронной функции"""
-        start_time = time.time()
-
+        start = time.perf_counter_ns()
         try:
             result = func(*args, **kwargs)
-            execution_time = time.time() - start_time
-
-            self._record_operation(operation_name, execution_time, success=True)
-
-            if execution_time > self.slow_threshold:
-                logger = logging.getLogger("performance")
-                logger.warning(
-                    f"Медленная синхронная операция: {operation_name} "
-                    f"заняла {execution_time:.2f}с"
-                )
-
-            return result
-
         except Exception as e:
-            execution_time = time.time() - start_time
-            self._record_operation(operation_name, execution_time, success=False)
-
-            logger = logging.getLogger("performance")
-            logger.error(
-                f"Ошибка в синхронной операции {operation_name} "
-                f"после {execution_time:.2f}с: {e}"
+            duration = time.perf_counter_ns() - start
+            self.record(operation_name, duration, success=False)
+            logging.getLogger("performance").error(
+                f"Ошибка в синхронной операции {operation_name} после {duration / 1e9:.2f}с: {e}"
             )
             raise
 
-    def _record_operation(self, name: str, duration: float, success: bool):
-        """Запись информации об операции"""
-        if name not in self.operations:
-            self.operations[name] = {
-                "count": 0,
-                "total_time": 0.0,
-                "success_count": 0,
-                "error_count": 0,
-                "max_time": 0.0,
-                "min_time": float('inf')
-            }
-
-        op_stats = self.operations[name]
-        op_stats["count"] += 1
-        op_stats["total_time"] += duration
-
-        if success:
-            op_stats["success_count"] += 1
-        else:
-            op_stats["error_count"] += 1
-
-        op_stats["max_time"] = max(op_stats["max_time"], duration)
-        op_stats["min_time"] = min(op_stats["min_time"], duration)
-
-    def get_stats(self) -> dict:
-        """Получить статистику производительности"""
-        stats = {}
+        self.record(operation_name, time.perf_counter_ns() - start)
+        return result
 
-        for name, data in self.operations.items():
-            avg_time = data["total_time"] / data["count"] if data["count"] > 0 else 0
+    def record(self, name: str, duration_ns: int, success: bool = True) -> None:
+        """Записать длительность операции (наносекунды perf_counter_ns)"""
+        metrics = self.operations.get(name)
+        if metrics is None:
+            metrics = self.operations[name] = OperationMetrics(
+                self.window_slots, self.window_seconds / self.window_slots
+            )
+        metrics.record(duration_ns, time.perf_counter_ns())
+        if not success:
+            metrics.errors += 1
 
-            stats[name] = {
-                "count": data["count"],
-                "avg_time_seconds": round(avg_time, 3),
-                "max_time_seconds": round(data["max_time"], 3),
-                "min_time_seconds": round(data["min_time"], 3),
-                "success_rate": round(data["success_count"] / data["count"] * 100, 1) if data["count"] > 0 else 0,
-                "errors": data["error_count"]
-            }
+        if duration_ns > self.slow_threshold * 1e9:
+            logging.getLogger("performance").warning(
+                f"Медленная операция: {name} заняла {duration_ns / 1e9:.2f}с"
+            )
 
+    def _summary(self, histogram: LatencyHistogram, errors: Optional[int] = None) -> dict:
+        p = histogram.percentiles(self.QUANTILES)
+        summary = {
+            "count": histogram.count,
+            "avg_time_seconds": round(histogram.total_us / histogram.count / 1e6, 3) if histogram.count else 0,
+            "max_time_seconds": round(histogram.max_us / 1e6, 3),
+            "min_time_seconds": round(histogram.min_us / 1e6, 3),
+            "p50_ms": round(p[0.5] / 1000, 2),
+            "p90_ms": round(p[0.9] / 1000, 2),
+            "p99_ms": round(p[0.99] / 1000, 2),
+            "p999_ms": round(p[0.999] / 1000, 2)
+        }
+        if errors is not None:
+            summary["errors"] = errors
+            summary["success_rate"] = round((histogram.count - errors) / histogram.count * 100, 1) if histogram.count else 0
+        return summary
+
+    def get_stats(self, window: bool = False) -> dict:
+        """
+        Статистика производительности с перцентилями.
+        window=True - только за последние window_seconds (без счетчика ошибок).
+        """
+        now = time.perf_counter_ns()
+        stats = {}
+        for name, metrics in list(self.operations.items()):
+            if window:
+                histogram = metrics.window(now)
+                if histogram.count:
+                    stats[name] = self._summary(histogram)
+            else:
+                stats[name] = self._summary(metrics.total, metrics.errors)
         return stats
 
+    def slowest(self, limit: int = 10, window: bool = True, by: str = "p99_ms") -> List[tuple]:
+        """Самые медленные операции: [(имя, статистика)] по убыванию by"""
+        stats = self.get_stats(window=window)
+        return sorted(stats.items(), key=lambda item: item[1][by], reverse=True)[:limit]
+
     def reset_stats(self):
         """Сбросить статистику"""
         self.operations = {}
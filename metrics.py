@@ -0,0 +1,343 @@
+"""
+Метрики Prometheus и проверка здоровья Barkery Shop
+
+Небольшой aiohttp-сервер (METRICS_PORT) отдает:
+- /metrics - текстовый формат Prometheus: гистограммы обработчиков,
+  апдейтов, запросов к БД и Telegram API из PerformanceMonitor, запросы
+  к БД по экранам, пул соединений, очередь отправки, состояния FSM,
+  кэши и размер файла БД;
+- /healthz - результат check_health из кэша (HEALTH_CACHE_SECONDS),
+  чтобы частые проверки не обращались к SQLite.
+Все значения собираются из памяти процесса в момент запроса.
+"""
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+from config import settings
+from logging_config import PerformanceMonitor, performance_monitor
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_BUCKETS_US = [int(b * 1e6) for b in LATENCY_BUCKETS]
+
+# Префикс операции PerformanceMonitor -> (семейство метрик, имена меток)
+OPERATION_FAMILIES = (
+    ("message:", "barkery_handler", ("event", "handler")),
+    ("callback:", "barkery_handler", ("event", "handler")),
+    ("update:", "barkery_update", ("label",)),
+    ("api:", "barkery_telegram_request", ("method",)),
+    ("db:query", "barkery_db_query", ()),
+)
+
+HEALTH_STATUS_CODES = {"healthy": 200, "warning": 200}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _split_operation(name: str) -> Tuple[str, Tuple[str, ...], Tuple]:
+    """Имя операции -> (семейство, имена меток, значения меток)"""
+    for prefix, family, label_names in OPERATION_FAMILIES:
+        if not name.startswith(prefix):
+            continue
+        rest = name[len(prefix):]
+        if len(label_names) == 2:
+            return family, label_names, (prefix[:-1], rest)
+        if label_names:
+            return family, label_names, (rest,)
+        return family, (), ()
+    return "barkery_operation", ("operation",), (name,)
+
+
+class MetricsText:
+    """Сборщик текстового формата Prometheus: строки группируются по семействам"""
+
+    def __init__(self):
+        # семейство -> [HELP, TYPE, строки значений]
+        self.families: Dict[str, List[str]] = {}
+
+    def family(self, name: str, kind: str, help_text: str) -> None:
+        if name not in self.families:
+            self.families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+    def sample(self, name: str, value, labels: Optional[Dict] = None, family: Optional[str] = None) -> None:
+        """family - имя семейства, если отличается от name (_bucket/_sum/_count гистограмм)"""
+        label_text = _labels(labels.keys(), labels.values()) if labels else ""
+        self.families[family or name].append(f"{name}{label_text} {value}")
+
+    def render(self) -> str:
+        return "\n".join(line for lines in self.families.values() for line in lines) + "\n"
+
+
+class MetricsExporter:
+    """Сбор метрик процесса и HTTP-сервер /metrics и /healthz"""
+
+    def __init__(self, monitor: PerformanceMonitor = performance_monitor):
+        self.monitor = monitor
+        self.storage = None
+        self.webhook_handler = None
+        self.started_at = time.time()
+        self._runner: Optional[web.AppRunner] = None
+
+    def attach(self, storage=None, webhook_handler=None) -> None:
+        """Подключить источники, которые создаются при запуске бота"""
+        if storage is not None:
+            self.storage = storage
+        if webhook_handler is not None:
+            self.webhook_handler = webhook_handler
+
+    # ---------- сбор ----------
+
+    def render(self) -> str:
+        out = MetricsText()
+        out.family("barkery_start_time_seconds", "gauge", "Время запуска процесса (unix)")
+        out.sample("barkery_start_time_seconds", round(self.started_at, 3))
+
+        for collect in (
+                self._collect_operations,
+                self._collect_updates,
+                self._collect_webhook,
+                self._collect_db,
+                self._collect_outbound,
+                self._collect_outbox,
+                self._collect_errors,
+                self._collect_fsm,
+                self._collect_caches
+        ):
+            try:
+                collect(out)
+            except Exception as e:
+                # Одна сломанная группа не должна ронять весь /metrics
+                logger.error(f"Ошибка сбора метрик {collect.__name__}: {e}")
+        return out.render()
+
+    def _collect_operations(self, out: MetricsText) -> None:
+        """Гистограммы задержек PerformanceMonitor (с момента запуска) и ошибки"""
+        for name, metrics in sorted(self.monitor.operations.items()):
+            family, label_names, label_values = _split_operation(name)
+            histogram = metrics.total
+            labels = dict(zip(label_names, label_values))
+
+            metric = f"{family}_duration_seconds"
+            out.family(metric, "histogram", f"Длительность ({family.replace('barkery_', '')}), секунды")
+            for bound, count in zip(LATENCY_BUCKETS, histogram.cumulative(_BUCKETS_US)):
+                out.sample(f"{metric}_bucket", count, {**labels, "le": bound}, family=metric)
+            out.sample(f"{metric}_bucket", histogram.count, {**labels, "le": "+Inf"}, family=metric)
+            out.sample(f"{metric}_sum", histogram.total_us / 1e6, labels, family=metric)
+            out.sample(f"{metric}_count", histogram.count, labels, family=metric)
+
+            if family != "barkery_db_query":
+                out.family(f"{family}_errors_total", "counter", f"Ошибки ({family.replace('barkery_', '')})")
+                out.sample(f"{family}_errors_total", metrics.errors, labels)
+
+    def _collect_updates(self, out: MetricsText) -> None:
+        """Запросы к БД и время БД/API по экранам (request_metrics.update_stats)"""
+        from request_metrics import update_stats
+
+        # (метрика, описание, индекс в строке UpdateStats, наносекунды -> секунды)
+        families = (
+            ("barkery_update_db_queries_total", "Запросы к БД при обработке апдейтов", 1, False),
+            ("barkery_update_db_seconds_total", "Время БД при обработке апдейтов", 3, True),
+            ("barkery_update_api_calls_total", "Запросы к Telegram API при обработке апдейтов", 4, False),
+            ("barkery_update_api_seconds_total", "Время Telegram API при обработке апдейтов", 5, True),
+        )
+        rows = list(update_stats.labels.items())
+        for metric, help_text, index, nanoseconds in families:
+            out.family(metric, "counter", help_text)
+            for label, row in rows:
+                out.sample(metric, row[index] / 1e9 if nanoseconds else row[index], {"label": label})
+
+    def _collect_webhook(self, out: MetricsText) -> None:
+        if self.webhook_handler is None:
+            return
+        stats = self.webhook_handler.stats()
+        out.family("barkery_webhook_in_flight", "gauge", "Обновления webhook в обработке")
+        out.sample("barkery_webhook_in_flight", stats["in_flight"])
+        out.family("barkery_webhook_updates_total", "counter", "Обработанные обновления webhook")
+        out.sample("barkery_webhook_updates_total", stats["processed"], {"result": "ok"})
+        out.sample("barkery_webhook_updates_total", stats["failed"], {"result": "failed"})
+        out.sample("barkery_webhook_updates_total", stats["rejected"], {"result": "rejected"})
+
+    def _collect_db(self, out: MetricsText) -> None:
+        from backup_service import backup_manager
+        from database import engine
+
+        pool = engine.pool
+        if hasattr(pool, "checkedout"):
+            out.family("barkery_db_pool_connections", "gauge", "Соединения пула БД")
+            out.sample("barkery_db_pool_connections", pool.checkedout(), {"state": "checked_out"})
+            out.sample("barkery_db_pool_connections", pool.checkedin(), {"state": "idle"})
+            out.family("barkery_db_pool_size", "gauge", "Размер пула БД")
+            out.sample("barkery_db_pool_size", pool.size())
+            out.family("barkery_db_pool_overflow", "gauge", "Соединения сверх размера пула")
+            out.sample("barkery_db_pool_overflow", max(pool.overflow(), 0))
+
+        db_path = backup_manager.get_db_path()
+        if db_path is not None:
+            out.family("barkery_db_file_bytes", "gauge", "Размер файлов SQLite")
+            for kind, path in (("main", db_path), ("wal", db_path + "-wal")):
+                if os.path.exists(path):
+                    out.sample("barkery_db_file_bytes", os.path.getsize(path), {"file": kind})
+
+    def _collect_outbound(self, out: MetricsText) -> None:
+        from outbound import outbound
+
+        stats = outbound.stats()
+        out.family("barkery_outbound_queued", "gauge", "Сообщения в очереди отправки")
+        out.sample("barkery_outbound_queued", stats["queued"], {"kind": "ready"})
+        out.sample("barkery_outbound_queued", stats["deferred"], {"kind": "deferred"})
+        out.family("barkery_outbound_total", "counter", "Сообщения очереди отправки по результату")
+        for result in ("sent", "coalesced", "retried", "failed"):
+            out.sample("barkery_outbound_total", stats[result], {"result": result})
+
+    def _collect_outbox(self, out: MetricsText) -> None:
+        from outbox import outbox
+
+        stats = outbox.stats()
+        out.family("barkery_outbox_total", "counter", "Записи outbox по результату")
+        for result in ("sent", "retried", "failed"):
+            out.sample("barkery_outbox_total", stats[result], {"result": result})
+        out.family("barkery_outbox_digests_total", "counter", "Сводки о нескольких заказах")
+        out.sample("barkery_outbox_digests_total", stats["digests"])
+
+    def _collect_errors(self, out: MetricsText) -> None:
+        from error_handling import error_sink
+
+        stats = error_sink.stats()
+        out.family("barkery_error_log_queued", "gauge", "Ошибки в очереди записи")
+        out.sample("barkery_error_log_queued", stats["queued"])
+        out.family("barkery_error_log_total", "counter", "Записи журнала ошибок по результату")
+        for result in ("written", "dropped", "write_errors"):
+            out.sample("barkery_error_log_total", stats[result], {"result": result})
+
+    def _collect_fsm(self, out: MetricsText) -> None:
+        storage = self.storage
+        if storage is None:
+            return
+
+        if hasattr(storage, "state_counts"):
+            counts = storage.state_counts()
+        elif hasattr(storage, "storage"):
+            # MemoryStorage aiogram
+            counts: Dict[str, int] = {}
+            for record in list(storage.storage.values()):
+                if record.state is not None:
+                    counts[record.state] = counts.get(record.state, 0) + 1
+        else:
+            return
+
+        out.family("barkery_fsm_states", "gauge", "Пользователи в состояниях FSM (активные ключи)")
+        for state, count in sorted(counts.items()):
+            out.sample("barkery_fsm_states", count, {"state": state})
+
+        if hasattr(storage, "stats"):
+            stats = storage.stats()
+            out.family("barkery_fsm_dirty_keys", "gauge", "Ключи FSM, еще не записанные в БД")
+            out.sample("barkery_fsm_dirty_keys", stats["dirty"])
+            self._cache_metrics(out, "fsm", stats["hits"], stats["misses"], stats["cached"])
+
+    def _collect_caches(self, out: MetricsText) -> None:
+        from catalog_cache import catalog_cache
+        from identity_cache import identity_cache
+        from images import image_pipeline
+        from keyboards import keyboard_cache
+        from search import product_search
+        from shared_state import shared_state
+
+        stats = identity_cache.stats()
+        self._cache_metrics(out, "identity", stats["hits"], stats["misses"], stats["size"])
+
+        stats = keyboard_cache.stats()
+        self._cache_metrics(out, "keyboards", stats["hits"], stats["misses"], stats["size"])
+
+        stats = product_search.stats()
+        self._cache_metrics(out, "search", stats["hits"], stats["misses"], stats["size"])
+
+        # Фото товаров по URL: попадание - отправка по сохраненному file_id
+        stats = image_pipeline.stats()
+        self._cache_metrics(out, "images", stats["hits"], stats["misses"], stats["cached"])
+
+        stats = catalog_cache.stats()
+        out.family("barkery_catalog_version", "gauge", "Версия снимка каталога")
+        out.sample("barkery_catalog_version", stats["version"])
+        if stats["loaded"]:
+            out.family("barkery_catalog_items", "gauge", "Объекты в снимке каталога")
+            out.sample("barkery_catalog_items", stats["categories"], {"kind": "categories"})
+            out.sample("barkery_catalog_items", stats["products"], {"kind": "products"})
+            out.family("barkery_catalog_remote_updates_total", "counter",
+                       "Изменения каталога из других процессов")
+            out.sample("barkery_catalog_remote_updates_total", stats["remote_patches"], {"kind": "patch"})
+            out.sample("barkery_catalog_remote_updates_total", stats["remote_reloads"], {"kind": "reload"})
+
+        stats = shared_state.stats()
+        if "lock_waits" in stats:
+            out.family("barkery_lock_waits_total", "counter", "Ожидания распределенной блокировки")
+            out.sample("barkery_lock_waits_total", stats["lock_waits"])
+            out.family("barkery_lock_timeouts_total", "counter", "Таймауты распределенной блокировки")
+            out.sample("barkery_lock_timeouts_total", stats["lock_timeouts"])
+        elif "locks" in stats:
+            out.family("barkery_locks", "gauge", "Активные блокировки")
+            out.sample("barkery_locks", stats["locks"])
+
+    @staticmethod
+    def _cache_metrics(out: MetricsText, cache: str, hits: int, misses: int, size: int) -> None:
+        out.family("barkery_cache_requests_total", "counter", "Обращения к кэшам")
+        out.sample("barkery_cache_requests_total", hits, {"cache": cache, "result": "hit"})
+        out.sample("barkery_cache_requests_total", misses, {"cache": cache, "result": "miss"})
+        out.family("barkery_cache_hit_ratio", "gauge", "Доля попаданий в кэш с момента запуска")
+        total = hits + misses
+        out.sample("barkery_cache_hit_ratio", round(hits / total, 4) if total else 0, {"cache": cache})
+        out.family("barkery_cache_entries", "gauge", "Записи в кэше")
+        out.sample("barkery_cache_entries", size, {"cache": cache})
+
+    # ---------- HTTP ----------
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def handle_healthz(self, request: web.Request) -> web.Response:
+        from health_check import health_monitor
+
+        health = await health_monitor.cached_health(max_age=settings.health_cache_seconds)
+        return web.Response(
+            text=json.dumps(health, ensure_ascii=False, default=str),
+            status=HEALTH_STATUS_CODES.get(health.get("status"), 503),
+            content_type="application/json"
+        )
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/healthz", self.handle_healthz)
+        return app
+
+    async def start(self, host: str, port: int) -> None:
+        if self._runner is not None:
+            return
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=host, port=port).start()
+        logger.info(f"📈 Метрики: http://{host}:{port}/metrics, проверка: /healthz")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Глобальный экземпляр
+metrics_exporter = MetricsExporter()
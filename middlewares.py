@@ -0,0 +1,134 @@
+"""
+Middleware для роутеров Barkery Shop
+"""
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+
+from identity_cache import IdentityCache, identity_cache
+from logging_config import PerformanceMonitor, performance_monitor
+from request_metrics import UpdateContext, UpdateStats, callback_prefix, current_update, update_stats
+
+logger = logging.getLogger(__name__)
+
+
+class UserIdentityMiddleware(BaseMiddleware):
+    """
+    Подставляет в данные обработчика user_id - внутренний ID пользователя.
+    ID берется из кэша, поэтому обработчикам не нужен get_or_create_user.
+    """
+
+    def __init__(self, cache: IdentityCache = identity_cache):
+        self.cache = cache
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is not None and not from_user.is_bot:
+            data["user_id"] = await self.cache.resolve(
+                telegram_id=from_user.id,
+                username=from_user.username,
+                full_name=from_user.full_name
+            )
+        return await handler(event, data)
+
+
+class PerformanceMiddleware(BaseMiddleware):
+    """
+    Замеряет время каждого обработчика в PerformanceMonitor.
+    Операция называется "<тип события>:<имя обработчика>", например message:admin_panel.
+    Внутренний middleware: вызывается только для обработчика, прошедшего фильтры.
+    """
+
+    def __init__(self, event_type: str, monitor: PerformanceMonitor = performance_monitor):
+        self.event_type = event_type
+        self.monitor = monitor
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        ctx = current_update.get()
+        if ctx is not None:
+            ctx.handler = name
+        start = time.perf_counter_ns()
+        success = False
+        try:
+            result = await handler(event, data)
+            success = True
+            return result
+        finally:
+            self.monitor.record(f"{self.event_type}:{name}", time.perf_counter_ns() - start, success)
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: полное время обработки, число запросов
+    к БД, время БД и Telegram API. Метка - имя обработчика (его ставит
+    PerformanceMiddleware) и для callback - префикс данных (product:, qty_inc:).
+    Учитываются запросы к API, которые обработчик дожидается сам;
+    отправки через очередь outbound идут вне апдейта.
+    """
+
+    def __init__(self, stats: UpdateStats = update_stats, monitor: PerformanceMonitor = performance_monitor):
+        self.stats = stats
+        self.monitor = monitor
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        ctx = UpdateContext()
+        token = current_update.set(ctx)
+        start = time.perf_counter_ns()
+        success = False
+        try:
+            result = await handler(event, data)
+            success = True
+            return result
+        finally:
+            duration = time.perf_counter_ns() - start
+            current_update.reset(token)
+
+            # Необработанные апдейты - одной меткой, чтобы не плодить метки от старых кнопок
+            label = ctx.handler or "unhandled"
+            if ctx.handler and isinstance(event, Update) and event.callback_query is not None:
+                label = f"{label} {callback_prefix(event.callback_query.data)}"
+            self.stats.record(label, ctx, duration)
+            self.monitor.record(f"update:{label}", duration, success)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Время запросов к Telegram API: в текущий апдейт и в PerformanceMonitor (api:<метод>)"""
+
+    def __init__(self, monitor: PerformanceMonitor = performance_monitor):
+        self.monitor = monitor
+
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter_ns()
+        success = False
+        try:
+            response = await make_request(bot, method)
+            success = True
+            return response
+        finally:
+            duration = time.perf_counter_ns() - start
+            ctx = current_update.get()
+            if ctx is not None:
+                ctx.api_calls += 1
+                ctx.api_ns += duration
+            self.monitor.record(f"api:{method.__api_method__}", duration, success)
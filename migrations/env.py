@@ -0,0 +1,83 @@
+"""
+Окружение Alembic для Barkery Shop
+
+Работает в двух режимах:
+- из командной строки (alembic upgrade head) - создает свой async engine по DATABASE_URL;
+- из database.init_db - использует уже открытое соединение бота
+  (передается через config.attributes["connection"]).
+"""
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import Base, DATABASE_URL, IS_SQLITE, SQLITE_PRODUCTION, _engine_options, _apply_sqlite_pragmas
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def _include_name(name, type_, parent_names) -> bool:
+    """Полнотекстовый индекс (products_fts и его служебные таблицы) ведут миграции, а не модели"""
+    if type_ == "table":
+        return not name.startswith("products_fts")
+    return True
+
+
+def _configure_and_run(connection) -> None:
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_name=_include_name,
+        # SQLite не умеет большинство ALTER TABLE - Alembic пересоздает таблицы
+        render_as_batch=IS_SQLITE,
+        compare_type=True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline() -> None:
+    """Сгенерировать SQL без подключения к БД (alembic upgrade head --sql)"""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        include_name=_include_name,
+        literal_binds=True,
+        render_as_batch=IS_SQLITE,
+        dialect_opts={"paramstyle": "named"}
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    """Миграции из командной строки через отдельный engine"""
+    engine = create_async_engine(DATABASE_URL, **_engine_options())
+    if SQLITE_PRODUCTION:
+        event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    try:
+        async with engine.begin() as connection:
+            await connection.run_sync(_configure_and_run)
+    finally:
+        await engine.dispose()
+
+
+def run_migrations_online() -> None:
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        # Вызов из database.init_db: соединение и транзакцией управляет бот
+        _configure_and_run(connection)
+        return
+
+    if config.config_file_name is not None:
+        fileConfig(config.config_file_name)
+    asyncio.run(run_async_migrations())
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,44 @@
+"""catalog and order indexes
+
+Составной индекс для выборки видимых товаров категории и индекс
+order_items(order_id) для состава заказа. Заодно добавляет колонку
+products.is_hypoallergenic в базы, созданные до ее появления
+(create_all не менял существующие таблицы).
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 18:40:02
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    product_columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('products')}
+    if 'is_hypoallergenic' not in product_columns:
+        with op.batch_alter_table('products', schema=None) as batch_op:
+            batch_op.add_column(
+                sa.Column('is_hypoallergenic', sa.Boolean(), nullable=False, server_default=sa.false())
+            )
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index('ix_products_category_active_available', ['category_id', 'is_active', 'available'], unique=False)
+
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_items_order_id'), ['order_id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_items_order_id'))
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_category_active_available')
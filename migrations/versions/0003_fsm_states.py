@@ -0,0 +1,37 @@
+"""fsm states
+
+Таблица для постоянного хранилища FSM (fsm_storage.SQLiteStorage).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 18:55:40
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('fsm_states',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('state', sa.String(), nullable=True),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('fsm_states', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_fsm_states_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('fsm_states', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_fsm_states_updated_at'))
+
+    op.drop_table('fsm_states')
@@ -0,0 +1,66 @@
+"""sales rollups
+
+Сводные таблицы продаж по дням и по товарам для статистики
+(statistics.StatisticsService). Заполняются из существующих заказов;
+дальше обновляются при оформлении заказа.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 19:20:11
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('sales_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('sales_product_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('product_name', sa.String(), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'product_id')
+    )
+
+    # Бэкфилл из существующих заказов (та же логика, что и StatisticsService.rebuild)
+    op.execute("""
+        INSERT INTO sales_daily (day, orders, units, revenue)
+        SELECT date(o.created_at), count(o.id), coalesce(sum(i.units), 0), sum(o.total_amount)
+        FROM orders o
+        LEFT JOIN (SELECT order_id, sum(quantity) AS units FROM order_items GROUP BY order_id) i
+            ON i.order_id = o.id
+        GROUP BY date(o.created_at)
+    """)
+    op.execute("""
+        INSERT INTO sales_product_daily (day, product_id, product_name, orders, units, revenue)
+        SELECT date(o.created_at), oi.product_id, max(oi.product_name), count(DISTINCT oi.order_id),
+               sum(oi.quantity),
+               sum(CASE WHEN p.unit_type = 'pieces' THEN oi.price_per_100g * oi.quantity
+                        ELSE oi.price_per_100g * oi.quantity / 100.0 END)
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        LEFT JOIN products p ON p.id = oi.product_id
+        WHERE oi.product_id IS NOT NULL
+        GROUP BY date(o.created_at), oi.product_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('sales_product_daily')
+    op.drop_table('sales_daily')
@@ -0,0 +1,77 @@
+"""products fts
+
+Полнотекстовый индекс товаров (search.ProductSearch): FTS5 по названию
+и описанию. Таблица без собственного содержимого (content=''), в индекс
+попадает текст с ё -> е; синхронизируется триггерами на products.
+Batch-миграции, пересоздающие products, удаляют триггеры - их нужно
+создать заново (create_triggers).
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 21:05:12
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _normalized(column: str) -> str:
+    """Текст для индекса: ё -> е (unicode61 их не сводит)"""
+    return f"replace(replace(coalesce({column}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_triggers() -> None:
+    new = f"new.id, {_normalized('new.name')}, {_normalized('new.description')}"
+    old = f"'delete', old.id, {_normalized('old.name')}, {_normalized('old.description')}"
+    op.execute(f"""
+        CREATE TRIGGER products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, name, description) VALUES ({new});
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ({old});
+        END
+    """)
+    # Остатки меняются при каждом заказе - индекс трогаем только при смене текста
+    op.execute(f"""
+        CREATE TRIGGER products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ({old});
+            INSERT INTO products_fts(rowid, name, description) VALUES ({new});
+        END
+    """)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    op.execute("""
+        CREATE VIRTUAL TABLE products_fts USING fts5(
+            name, description,
+            content='',
+            tokenize='porter unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    op.execute(f"""
+        INSERT INTO products_fts(rowid, name, description)
+        SELECT id, {_normalized('name')}, {_normalized('description')} FROM products
+    """)
+    create_triggers()
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS products_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS products_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS products_fts_ai")
+    op.execute("DROP TABLE IF EXISTS products_fts")
@@ -0,0 +1,35 @@
+"""product images
+
+Соответствие URL фото товара -> file_id в Telegram (images.ImagePipeline):
+фото по URL скачивается и загружается один раз, дальше отправляется по file_id.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 22:10:37
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('product_images',
+    sa.Column('url', sa.String(), nullable=False),
+    sa.Column('file_id', sa.String(), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('size_bytes', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('url')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('product_images')
@@ -1,9 +1,12 @@
 """
 Уведомления для админа
 """
+import html
 import logging
 from datetime import datetime
+from typing import List, Tuple
 from config import settings
+from outbound import outbound, PRIORITY_ADMIN
 
 logger = logging.getLogger(__name__)
 
@@ -19,11 +22,15 @@ async def notify_admin(bot, order_data: dict, order_id: int):
         # Форматируем сообщение
         admin_message = format_admin_notification(order_data, order_id)
         
-        # Отправляем админу
-        await bot.send_message(
-            chat_id=settings.admin_id,
-            text=admin_message,
-            parse_mode="HTML"
+        # Отправляем админу (после ответов покупателям)
+        await outbound.send(
+            settings.admin_id,
+            lambda: bot.send_message(
+                chat_id=settings.admin_id,
+                text=admin_message,
+                parse_mode="HTML"
+            ),
+            priority=PRIORITY_ADMIN
         )
         
         logger.info(f"✅ Уведомление отправлено админу {settings.admin_id}")
@@ -40,30 +47,86 @@ def format_admin_notification(order_data: dict, order_id: int) -> str:
     # Формируем список товаров
     items_text = ""
     for item in order_data.get("cart_items", []):
-        items_text += f"• {item['product_name']}: {item['quantity']}{'г' if item.get('unit_type', 'grams') == 'grams' else 'шт'} - {item['total_price']:.0f} RSD\n"
+        items_text += f"• {_escape(item['product_name'])}: {item['quantity']}{'г' if item.get('unit_type', 'grams') == 'grams' else 'шт'} - {item['total_price']:.0f} RSD\n"
     
     notification = (
         f"🛎️ <b>НОВЫЙ ЗАКАЗ #{order_id}</b>\n\n"
-        f"👤 <b>Покупатель:</b> {order_data.get('pet_name', 'Не указано')}\n"
-        f"📱 <b>Telegram:</b> @{order_data.get('telegram_login', 'Не указан')}\n"
-        f"📍 <b>Адрес доставки:</b>\n{order_data['address']}\n\n"
+        f"👤 <b>Покупатель:</b> {_escape(order_data.get('pet_name', 'Не указано'))}\n"
+        f"📱 <b>Telegram:</b> @{_escape(order_data.get('telegram_login', 'Не указан'))}\n"
+        f"📍 <b>Адрес доставки:</b>\n{_escape(order_data['address'])}\n\n"
         f"📦 <b>Состав заказа:</b>\n{items_text}\n"
         f"💰 <b>Итого:</b> {order_data['total_amount']:.0f} RSD\n"
-        f"📅 <b>Дата:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
-        f"🆔 <b>User ID:</b> {order_data.get('user_id', 'Не указан')}"
+        f"📅 <b>Дата:</b> {_order_time(order_data).strftime('%d.%m.%Y %H:%M')}\n"
+        f"🆔 <b>User ID:</b> {_escape(order_data.get('user_id', 'Не указан'))}"
     )
     
     return notification
 
 
+# Лимит длины сообщения Telegram (с запасом)
+MESSAGE_LIMIT = 4000
+
+
+def _escape(value) -> str:
+    """Данные покупателя в HTML-сообщении: <, > и & ломают разметку"""
+    return html.escape(str(value), quote=False)
+
+
+def _order_time(order_data: dict) -> datetime:
+    """Время оформления заказа (уведомление может уйти позже)"""
+    created_at = order_data.get("created_at")
+    return datetime.fromisoformat(created_at) if created_at else datetime.now()
+
+
+def format_orders_digest(orders: List[dict]) -> List[str]:
+    """
+    Одна сводка на несколько заказов, пришедших почти одновременно.
+    orders - данные заказов (как для format_admin_notification) с ключом order_id.
+    Возвращает одно или несколько сообщений в пределах лимита Telegram.
+    """
+    return [text for text, _ in split_orders_digest(orders)]
+
+
+def split_orders_digest(orders: List[dict]) -> List[Tuple[str, List[dict]]]:
+    """Сообщения сводки вместе с заказами, которые попали в каждое из них"""
+    total = sum(order["total_amount"] for order in orders)
+    header = f"🛎️ <b>НОВЫЕ ЗАКАЗЫ: {len(orders)}</b> на {total:.0f} RSD\n"
+
+    parts = []
+    current, current_orders = header, []
+    for order in orders:
+        items = ", ".join(
+            f"{_escape(item['product_name'])} {item['quantity']}{'г' if item.get('unit_type', 'grams') == 'grams' else 'шт'}"
+            for item in order.get("cart_items", [])
+        )
+        block = (
+            f"\n<b>#{order['order_id']}</b> {_order_time(order).strftime('%H:%M')} - "
+            f"{_escape(order.get('pet_name', 'Не указано'))}, @{_escape(order.get('telegram_login', 'Не указан'))}\n"
+            f"📍 {_escape(order['address'])}\n"
+            f"📦 {items}\n"
+            f"💰 {order['total_amount']:.0f} RSD\n"
+        )
+        if current_orders and len(current) + len(block) > MESSAGE_LIMIT:
+            parts.append((current, current_orders))
+            current, current_orders = header, []
+        current += block
+        current_orders.append(order)
+    parts.append((current, current_orders))
+    return parts
+
+
 async def send_backup_notification(bot, backup_file: str):
     """Уведомление о создании резервной копии"""
     try:
         if settings.admin_id:
-            await bot.send_message(
-                chat_id=settings.admin_id,
-                text=f"📂 <b>Создана резервная копия БД</b>\n\nФайл: <code>{backup_file}</code>",
-                parse_mode="HTML"
+            await outbound.send(
+                settings.admin_id,
+                lambda: bot.send_message(
+                    chat_id=settings.admin_id,
+                    text=f"📂 <b>Создана резервная копия БД</b>\n\nФайл: <code>{backup_file}</code>",
+                    parse_mode="HTML"
+                ),
+                priority=PRIORITY_ADMIN
             )
     except Exception as e:
         logger.error(f"Ошибка уведомления о бекапе: {e}")
@@ -0,0 +1,351 @@
+"""
+Планировщик исходящих запросов к Telegram для Barkery Shop
+
+Все отправки, редактирования и удаления сообщений идут через одну
+очередь с приоритетами: ответы пользователю раньше уведомлений админу,
+а уведомления раньше фоновых удалений. Частота ограничивается общим
+token bucket и отдельным bucket на каждый чат, TelegramRetryAfter
+обрабатывается автоматически, а повторные редактирования одного
+сообщения склеиваются - отправляется только последнее.
+Удаления не расходуют лимит чата: у них свой общий bucket, поэтому
+фоновая очистка не задерживает ответы пользователю.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (меньше - важнее)
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_CLEANUP = 2
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд будет доступен токен (0 - уже доступен)"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        """Запретить запросы на указанное время (ответ RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self) -> bool:
+        """Bucket полон и не заблокирован - его можно удалить"""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Job:
+    """Запрос в очереди"""
+
+    __slots__ = ("chat_id", "call", "priority", "coalesce_key", "delete", "futures", "attempts")
+
+    def __init__(self, chat_id: Optional[int], call: Callable[[], Awaitable[Any]],
+                 priority: int, coalesce_key: Optional[Hashable], delete: bool = False):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.coalesce_key = coalesce_key
+        self.delete = delete
+        self.futures: List[asyncio.Future] = []
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """Очередь исходящих запросов с ограничением частоты"""
+
+    def __init__(
+            self,
+            global_rate: float = 25,
+            chat_rate: float = 3,
+            chat_burst: float = 10,
+            delete_rate: float = 20,
+            workers: int = 8,
+            max_retries: int = 3
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        # Удаления: общий лимит вместо лимита чата
+        self._deletes = TokenBucket(delete_rate, delete_rate)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # Отложенные запросы: таймер -> запрос
+        self._timers: Dict[asyncio.TimerHandle, _Job] = {}
+        # coalesce_key -> запрос, который еще не начал выполняться
+        self._pending: Dict[Hashable, _Job] = {}
+        self._seq = itertools.count()
+        # Сколько запросов выполняется прямо сейчас
+        self._busy = 0
+
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _ensure_started(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.workers):
+            self._tasks.add(asyncio.create_task(self._worker()))
+
+    def submit(
+            self,
+            chat_id: Optional[int],
+            call: Callable[[], Awaitable[Any]],
+            priority: int = PRIORITY_USER,
+            coalesce_key: Optional[Hashable] = None,
+            delete: bool = False
+    ) -> asyncio.Future:
+        """
+        Поставить запрос в очередь, вернуть future с результатом.
+        call - функция без аргументов, создающая запрос (например lambda: bot.send_message(...)).
+        Запросы с одинаковым coalesce_key, ожидающие в очереди, заменяются последним.
+        delete=True - удаление сообщений: расходует лимит удалений, а не лимит чата.
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+
+        if coalesce_key is not None:
+            job = self._pending.get(coalesce_key)
+            if job is not None:
+                # Предыдущий вариант еще не отправлен - отправим только новый
+                job.call = call
+                job.priority = min(job.priority, priority)
+                job.futures.append(future)
+                self.coalesced += 1
+                return future
+
+        job = _Job(chat_id, call, priority, coalesce_key, delete)
+        job.futures.append(future)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = job
+        self._enqueue(job)
+        return future
+
+    async def send(
+            self,
+            chat_id: Optional[int],
+            call: Callable[[], Awaitable[Any]],
+            priority: int = PRIORITY_USER,
+            coalesce_key: Optional[Hashable] = None,
+            delete: bool = False
+    ) -> Any:
+        """Выполнить запрос через очередь и дождаться результата"""
+        return await self.submit(chat_id, call, priority, coalesce_key, delete)
+
+    def post(
+            self,
+            chat_id: Optional[int],
+            call: Callable[[], Awaitable[Any]],
+            priority: int = PRIORITY_CLEANUP,
+            coalesce_key: Optional[Hashable] = None,
+            delete: bool = False
+    ) -> asyncio.Future:
+        """Поставить запрос в очередь без ожидания (ошибки только логируются)"""
+        future = self.submit(chat_id, call, priority, coalesce_key, delete)
+        future.add_done_callback(_log_background_error)
+        return future
+
+    def _enqueue(self, job: _Job) -> None:
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _defer(self, job: _Job, delay: float) -> None:
+        """Вернуть запрос в очередь через delay секунд"""
+        handle = None
+
+        def requeue():
+            self._timers.pop(handle, None)
+            self._enqueue(job)
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._timers[handle] = job
+
+    def _chat_bucket(self, chat_id: Optional[int]) -> Optional[TokenBucket]:
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                self._prune_buckets()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        """Удалить bucket'ы чатов, которые давно ничего не отправляли"""
+        for chat_id in [cid for cid, bucket in self._chats.items() if bucket.is_idle()]:
+            del self._chats[chat_id]
+
+    async def _worker(self) -> None:
+        while True:
+            entry = await self._queue.get()
+            job = entry[2]
+            try:
+                # Общий лимит: ждем, но сначала возвращаем запрос в очередь,
+                # чтобы после паузы взять самый приоритетный
+                global_delay = self._global.delay()
+                if global_delay > 0:
+                    self._enqueue(job)
+                    await asyncio.sleep(global_delay)
+                    continue
+
+                # Лимит чата (у удалений - свой): откладываем запрос, не блокируя остальные чаты
+                bucket = self._deletes if job.delete else self._chat_bucket(job.chat_id)
+                chat_delay = bucket.delay() if bucket is not None else 0
+                if chat_delay > 0:
+                    self._defer(job, chat_delay)
+                    continue
+
+                self._global.consume()
+                if bucket is not None:
+                    bucket.consume()
+                self._busy += 1
+                try:
+                    await self._execute(job)
+                finally:
+                    self._busy -= 1
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, job: _Job) -> None:
+        # С этого момента новые редактирования пойдут отдельным запросом
+        if job.coalesce_key is not None and self._pending.get(job.coalesce_key) is job:
+            del self._pending[job.coalesce_key]
+
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as e:
+            # Ограничение Telegram относится к чату, даже если это было удаление
+            (self._chat_bucket(job.chat_id) or self._global).block(e.retry_after)
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                self._finish(job, exception=e)
+                return
+            self.retried += 1
+            logger.warning(f"Telegram просит подождать {e.retry_after} с (чат {job.chat_id})")
+            newer = self._pending.get(job.coalesce_key) if job.coalesce_key is not None else None
+            if newer is not None:
+                # Пока ждали, пришла более свежая версия - отправится она
+                newer.futures.extend(job.futures)
+                return
+            if job.coalesce_key is not None:
+                self._pending[job.coalesce_key] = job
+            self._defer(job, e.retry_after)
+        except asyncio.CancelledError:
+            self._finish(job, exception=asyncio.CancelledError())
+            raise
+        except Exception as e:
+            self.failed += 1
+            self._finish(job, exception=e)
+        else:
+            self.sent += 1
+            self._finish(job, result=result)
+
+    @staticmethod
+    def _finish(job: _Job, result: Any = None, exception: Optional[BaseException] = None) -> None:
+        for future in job.futures:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    async def close(self, timeout: float = 10) -> None:
+        """Дождаться отправки очереди и остановить обработчики"""
+        if not self._tasks:
+            return
+        # Отложенные запросы лежат в таймерах, а не в очереди - ждем и их
+        deadline = time.monotonic() + timeout
+        while self._busy or self._timers or not self._queue.empty():
+            if time.monotonic() >= deadline:
+                logger.warning(
+                    f"Не отправлено запросов при остановке: {self._queue.qsize() + len(self._timers)}"
+                )
+                break
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        # Неотправленные запросы завершаем ошибкой, чтобы ожидающие не зависли
+        dropped = list(self._timers.values())
+        for handle in self._timers:
+            handle.cancel()
+        self._timers.clear()
+        while not self._queue.empty():
+            dropped.append(self._queue.get_nowait()[2])
+        self._pending.clear()
+        error = RuntimeError("Очередь исходящих запросов остановлена")
+        for job in dropped:
+            self._finish(job, exception=error)
+
+    def stats(self) -> Dict:
+        """Состояние очереди"""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "deferred": len(self._timers),
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+
+def _log_background_error(future: asyncio.Future) -> None:
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.debug(f"Фоновый запрос к Telegram не выполнен: {error}")
+
+
+# Глобальный экземпляр
+outbound = OutboundScheduler(
+    global_rate=settings.outbound_global_rate,
+    chat_rate=settings.outbound_chat_rate,
+    chat_burst=settings.outbound_chat_burst,
+    delete_rate=settings.outbound_delete_rate,
+    workers=settings.outbound_workers
+)
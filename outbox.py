@@ -0,0 +1,260 @@
+"""
+Transactional outbox для уведомлений Barkery Shop
+
+Уведомление админу о заказе пишется в таблицу outbox в транзакции
+заказа: нет заказа - нет уведомления, есть заказ - уведомление не
+потеряется. Покупатель не ждет отправки, ее делает фоновый диспетчер:
+- после заказа ждет digest_window секунд и отправляет все накопившиеся
+  записи: одну - обычным уведомлением, несколько - одной сводкой;
+- раз в poll_interval проверяет таблицу (записи других процессов,
+  повторы, записи, оставшиеся с прошлого запуска);
+- при ошибке повторяет с экспоненциальной задержкой, после
+  max_attempts попыток помечает запись failed.
+Доставка "хотя бы один раз": запись помечается sent после отправки,
+при падении между ними уведомление придет повторно.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, select, update
+
+from config import settings
+from database import get_session, OutboxMessage
+from outbound import outbound, PRIORITY_ADMIN
+
+logger = logging.getLogger(__name__)
+
+# Виды записей
+KIND_ADMIN_ORDER = "admin_order"
+
+
+class OutboxDispatcher:
+    """Фоновая доставка записей outbox с повторами и сводками"""
+
+    def __init__(
+            self,
+            batch_size: int = 50,
+            digest_window: float = 2.0,
+            poll_interval: float = 10,
+            base_delay: float = 5,
+            max_delay: float = 600,
+            max_attempts: int = 10,
+            lease_seconds: float = 60,
+            retention_days: float = 7
+    ):
+        self.batch_size = batch_size
+        self.digest_window = digest_window
+        self.poll_interval = poll_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        # На это время взятая запись не достается другому диспетчеру
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_days * 86400
+
+        self.bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+
+        self.sent = 0
+        self.digests = 0
+        self.retried = 0
+        self.failed = 0
+
+    @staticmethod
+    def add(session, kind: str, payload: Dict) -> OutboxMessage:
+        """Добавить запись в транзакцию session (отправится после commit)"""
+        now = time.time()
+        message = OutboxMessage(
+            kind=kind,
+            payload=json.dumps(payload, ensure_ascii=False, default=str),
+            status="pending",
+            attempts=0,
+            next_attempt_at=now,
+            created_at=now
+        )
+        session.add(message)
+        return message
+
+    # ---------- фоновая задача ----------
+
+    def start(self, bot) -> None:
+        self.bot = bot
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+            logger.info("📮 Диспетчер уведомлений запущен")
+
+    def wake(self) -> None:
+        """Появились новые записи (вызывать после commit)"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Остановить диспетчер и отправить то, что уже можно отправить"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await asyncio.wait_for(self.dispatch_due(), timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Уведомления не отправлены при остановке (отправятся после запуска): {e}")
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                # Ждем, пока подтянутся заказы, оформленные почти одновременно
+                await asyncio.sleep(self.digest_window)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            try:
+                # Полная пачка - возможно, в таблице есть еще
+                while await self.dispatch_due() >= self.batch_size:
+                    pass
+                await self._maybe_purge()
+            except Exception as e:
+                logger.error(f"Ошибка диспетчера уведомлений: {e}")
+
+    # ---------- доставка ----------
+
+    async def dispatch_due(self) -> int:
+        """Отправить записи, срок которых наступил. Возвращает число взятых записей"""
+        if self.bot is None:
+            return 0
+
+        rows = await self._claim()
+        if not rows:
+            return 0
+
+        by_kind: Dict[str, List] = {}
+        for row in rows:
+            by_kind.setdefault(row.kind, []).append(row)
+
+        for kind, kind_rows in by_kind.items():
+            try:
+                await self._deliver(kind, [json.loads(row.payload) for row in kind_rows])
+            except Exception as e:
+                await self._mark_failed(kind_rows, e)
+            else:
+                await self._mark_sent(kind_rows)
+        return len(rows)
+
+    async def _claim(self) -> List:
+        """Взять пачку записей: сдвигаем next_attempt_at на время аренды"""
+        now = time.time()
+        due = (
+            select(OutboxMessage.id)
+            .where(OutboxMessage.status == "pending", OutboxMessage.next_attempt_at <= now)
+            .order_by(OutboxMessage.id)
+            .limit(self.batch_size)
+        )
+        async with get_session() as session:
+            result = await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_(due))
+                .values(next_attempt_at=now + self.lease_seconds)
+                .returning(OutboxMessage.id, OutboxMessage.kind, OutboxMessage.payload, OutboxMessage.attempts)
+                .execution_options(synchronize_session=False)
+            )
+            rows = sorted(result.all(), key=lambda row: row.id)
+            await session.commit()
+        return rows
+
+    async def _deliver(self, kind: str, payloads: List[Dict]) -> None:
+        if kind != KIND_ADMIN_ORDER:
+            raise ValueError(f"неизвестный вид записи: {kind}")
+
+        from aiogram.exceptions import TelegramBadRequest
+        from notifications import format_admin_notification, split_orders_digest
+
+        if len(payloads) == 1:
+            await self._send_admin(format_admin_notification(payloads[0], payloads[0]["order_id"]))
+        else:
+            self.digests += 1
+            for text, orders in split_orders_digest(payloads):
+                try:
+                    await self._send_admin(text)
+                except TelegramBadRequest as e:
+                    # Сводку не приняли (разметка, длина) - отправляем заказы по одному
+                    logger.warning(f"Сводка заказов отклонена, отправляем по одному: {e}")
+                    for order in orders:
+                        await self._send_admin(format_admin_notification(order, order["order_id"]))
+        logger.info(f"✅ Уведомление о заказах отправлено админу ({len(payloads)} шт.)")
+
+    async def _send_admin(self, text: str) -> None:
+        await outbound.send(
+            settings.admin_id,
+            lambda: self.bot.send_message(chat_id=settings.admin_id, text=text, parse_mode="HTML"),
+            priority=PRIORITY_ADMIN
+        )
+
+    async def _mark_sent(self, rows: List) -> None:
+        async with get_session() as session:
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_([row.id for row in rows]))
+                .values(status="sent", sent_at=time.time(), attempts=OutboxMessage.attempts + 1, last_error=None)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        self.sent += len(rows)
+
+    async def _mark_failed(self, rows: List, error: Exception) -> None:
+        """Повтор через base_delay * 2^попытка (не больше max_delay) или failed"""
+        now = time.time()
+        async with get_session() as session:
+            for row in rows:
+                attempts = row.attempts + 1
+                if attempts >= self.max_attempts:
+                    values: Dict[str, Any] = {"status": "failed"}
+                    self.failed += 1
+                    logger.error(f"❌ Уведомление #{row.id} не отправлено после {attempts} попыток: {error}")
+                else:
+                    delay = min(self.base_delay * 2 ** row.attempts, self.max_delay)
+                    values = {"next_attempt_at": now + delay}
+                    self.retried += 1
+                    logger.warning(f"Уведомление #{row.id} не отправлено, повтор через {delay:.0f} с: {error}")
+                await session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id == row.id)
+                    .values(attempts=attempts, last_error=str(error)[:500], **values)
+                    .execution_options(synchronize_session=False)
+                )
+            await session.commit()
+
+    async def _maybe_purge(self) -> None:
+        """Удалять отправленные записи старше retention_days не чаще раза в час"""
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        async with get_session() as session:
+            result = await session.execute(
+                delete(OutboxMessage)
+                .where(OutboxMessage.status == "sent", OutboxMessage.created_at < now - self.retention_seconds)
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"Удалено старых записей outbox: {result.rowcount}")
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "sent": self.sent,
+            "digests": self.digests,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+
+# Глобальный экземпляр
+outbox = OutboxDispatcher()
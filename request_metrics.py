@@ -0,0 +1,128 @@
+"""
+Метрики обработки апдейтов Barkery Shop
+
+На время обработки апдейта в contextvar лежит UpdateContext. Хуки
+SQLAlchemy (before/after_cursor_execute) замеряют каждый запрос и
+добавляют в контекст число запросов и время БД, middleware сессии
+бота - число и время запросов к Telegram API, PerformanceMiddleware -
+имя обработчика. После обработки контекст попадает в сводку
+UpdateStats по метке "<обработчик> <префикс callback>".
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+from logging_config import performance_monitor
+
+logger = logging.getLogger(__name__)
+
+_QUERY_START_KEY = "query_start_ns"
+
+
+class UpdateContext:
+    """Счетчики одного апдейта"""
+
+    __slots__ = ("handler", "queries", "db_ns", "api_calls", "api_ns")
+
+    def __init__(self):
+        self.handler: Optional[str] = None
+        self.queries = 0
+        self.db_ns = 0
+        self.api_calls = 0
+        self.api_ns = 0
+
+
+# Контекст текущего апдейта (None - код работает вне обработки апдейта)
+current_update: ContextVar[Optional[UpdateContext]] = ContextVar("current_update", default=None)
+
+
+def callback_prefix(data: Optional[str]) -> str:
+    """Префикс callback_data без параметров: product:12 -> product:, cart_check -> cart_check"""
+    if not data:
+        return ""
+    head, sep, _ = data.partition(":")
+    return head + sep
+
+
+# ---------- SQLAlchemy ----------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info[_QUERY_START_KEY] = time.perf_counter_ns()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop(_QUERY_START_KEY, None)
+    if start is None:
+        return
+    duration = time.perf_counter_ns() - start
+    performance_monitor.record("db:query", duration)
+    ctx = current_update.get()
+    if ctx is not None:
+        ctx.queries += 1
+        ctx.db_ns += duration
+
+
+def install_query_hooks(engine) -> None:
+    """
+    Время запросов к БД: все запросы - в PerformanceMonitor (db:query),
+    запросы апдейта - еще и в его контекст. engine - AsyncEngine.
+    """
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ---------- сводка ----------
+
+class UpdateStats:
+    """
+    Суммы по меткам апдейтов с момента запуска: сколько запросов к БД делает
+    экран и какая доля времени уходит на БД и на Telegram API.
+    """
+
+    def __init__(self):
+        # метка -> [апдейтов, запросов, max запросов, db_ns, api_calls, api_ns, total_ns]
+        self.labels: Dict[str, List[int]] = {}
+
+    def record(self, label: str, ctx: UpdateContext, duration_ns: int) -> None:
+        row = self.labels.get(label)
+        if row is None:
+            row = self.labels[label] = [0, 0, 0, 0, 0, 0, 0]
+        row[0] += 1
+        row[1] += ctx.queries
+        if ctx.queries > row[2]:
+            row[2] = ctx.queries
+        row[3] += ctx.db_ns
+        row[4] += ctx.api_calls
+        row[5] += ctx.api_ns
+        row[6] += duration_ns
+
+    def report(self, limit: int = 15, by: str = "avg_queries") -> List[Dict]:
+        """Метки по убыванию by (avg_queries, avg_ms, db_share, api_share)"""
+        rows = []
+        for label, (count, queries, max_queries, db_ns, api_calls, api_ns, total_ns) in list(self.labels.items()):
+            rows.append({
+                "label": label,
+                "count": count,
+                "avg_ms": round(total_ns / count / 1e6, 1),
+                "avg_queries": round(queries / count, 1),
+                "max_queries": max_queries,
+                "avg_db_ms": round(db_ns / count / 1e6, 1),
+                "avg_api_calls": round(api_calls / count, 1),
+                "avg_api_ms": round(api_ns / count / 1e6, 1),
+                "db_share": round(db_ns / total_ns * 100, 1) if total_ns else 0,
+                "api_share": round(api_ns / total_ns * 100, 1) if total_ns else 0
+            })
+        rows.sort(key=lambda row: row[by], reverse=True)
+        return rows[:limit]
+
+    def reset(self) -> None:
+        self.labels = {}
+
+
+# Глобальный экземпляр
+update_stats = UpdateStats()
@@ -0,0 +1,212 @@
+"""
+Полнотекстовый поиск товаров Barkery Shop
+
+Индекс - FTS5-таблица products_fts (миграция 0007), триггеры держат ее
+в синхронизации с products. Латиницу стеммит токенизатор porter,
+кириллицу - стеммер ниже на стороне запроса: каждое слово запроса
+сводится к основе и ищется по префиксу ("тортами" -> "торт"*), поэтому
+находятся все формы слова и недописанные слова. Ранжирование - bm25,
+название весит больше описания. Страницы результатов кэшируются на
+cache_ttl секунд по (запрос, страница, версия каталога).
+"""
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import column, select, table, text
+
+from database import get_session, Product, IS_SQLITE
+from catalog_cache import catalog_cache, product_to_dict
+from availability import visible_clause
+from logging_config import monitor_performance
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 8
+# Слов в запросе (остальные отбрасываются)
+MAX_TERMS = 6
+
+# Вес совпадения в названии и в описании для bm25
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+products_fts = table("products_fts", column("rowid"))
+
+
+# ---------- стеммер (Портер для русского языка) ----------
+
+_VOWELS = "аеиоуыэюя"
+_RV = re.compile(rf"^(.*?[{_VOWELS}])(.*)$")
+_PERFECTIVE_GERUND = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE = re.compile(r"(с[яь])$")
+_ADJECTIVE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN = re.compile(r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$")
+_DERIVATIONAL = re.compile(rf".*[^{_VOWELS}]+[{_VOWELS}].*ость?$")
+_SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+_WORD = re.compile(r"\w+")
+_CYRILLIC = re.compile(r"[а-я]")
+
+
+def normalize(value: str) -> str:
+    """Нижний регистр, ё -> е (так же, как текст в индексе)"""
+    return value.lower().replace("ё", "е")
+
+
+def stem(word: str) -> str:
+    """Основа русского слова; остальные слова возвращаются как есть"""
+    word = normalize(word)
+    if not _CYRILLIC.search(word):
+        return word
+    match = _RV.match(word)
+    if match is None:
+        return word
+    start, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub("", rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub("", rv, 1)
+        stripped = _ADJECTIVE.sub("", rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub("", stripped, 1)
+        else:
+            stripped = _VERB.sub("", rv, 1)
+            rv = _NOUN.sub("", rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    rv = re.sub(r"и$", "", rv)
+    if _DERIVATIONAL.match(rv):
+        rv = re.sub(r"ость?$", "", rv)
+    stripped = re.sub(r"ь$", "", rv)
+    if stripped == rv:
+        rv = _SUPERLATIVE.sub("", rv, 1)
+        rv = re.sub(r"нн$", "н", rv)
+    else:
+        rv = stripped
+
+    # Беглая гласная: ягненок/ягненка, огурец/огурца. Основа без суффикса
+    # (ягнен, огур) - префикс всех форм: "ягненк"* не нашел бы "ягненок"
+    stripped = re.sub(rf"([ое]|(?<=[^{_VOWELS}])ь?)[кц]$", "", start + rv)
+    return stripped if len(stripped) >= 3 else start + rv
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Запрос FTS5: все слова (до MAX_TERMS) должны встретиться,
+    каждое ищется по основе как префикс. None - искать нечего.
+    """
+    terms = []
+    for word in _WORD.findall(query):
+        term = stem(word)
+        if len(term) < 2 or term in terms:
+            continue
+        terms.append(term)
+        if len(terms) >= MAX_TERMS:
+            break
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+# ---------- поиск ----------
+
+class ProductSearch:
+    """Поиск видимых товаров по FTS5-индексу с кэшем страниц"""
+
+    def __init__(self, page_size: int = SEARCH_PAGE_SIZE, cache_ttl: float = 30, cache_size: int = 2000):
+        self.page_size = page_size
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # (запрос FTS, страница, версия каталога) -> (результат, срок действия)
+        self._cache: "OrderedDict[Tuple, Tuple[Dict, float]]" = OrderedDict()
+
+        self.searches = 0
+        self.hits = 0
+
+    async def search(self, query: str, page: int = 0) -> Dict:
+        """
+        Страница результатов: {"success", "query", "page", "items", "has_next"}.
+        items - товары в формате CatalogService, по убыванию релевантности.
+        """
+        page = max(page, 0)
+        match = build_match_query(query)
+        if match is None:
+            return {"success": True, "query": query, "page": page, "items": [], "has_next": False}
+
+        self.searches += 1
+        key = (match, page, catalog_cache.version)
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and cached[1] > now:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return {**cached[0], "query": query}
+
+        try:
+            items = await self._fetch(match, query, self.page_size + 1, page * self.page_size)
+        except Exception as e:
+            logger.error(f"Ошибка поиска '{query}': {e}")
+            return {"success": False, "error": str(e)}
+
+        result = {
+            "success": True,
+            "query": query,
+            "page": page,
+            "items": items[:self.page_size],
+            "has_next": len(items) > self.page_size
+        }
+        self._cache[key] = (result, now + self.cache_ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    @monitor_performance("search:fetch")
+    async def _fetch(self, match: str, query: str, limit: int, offset: int) -> List[Dict]:
+        if IS_SQLITE:
+            stmt = (
+                select(Product)
+                .join(products_fts, products_fts.c.rowid == Product.id)
+                .where(text("products_fts MATCH :match"), visible_clause())
+                .order_by(text(f"bm25(products_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT})"))
+                .limit(limit)
+                .offset(offset)
+            )
+            params = {"match": match}
+        else:
+            # Без FTS5 - поиск подстроки в названии (% и _ из запроса - обычные символы)
+            pattern = re.sub(r"([\\%_])", r"\\\1", query.strip())
+            stmt = (
+                select(Product)
+                .where(Product.name.ilike(f"%{pattern}%", escape="\\"), visible_clause())
+                .order_by(Product.name)
+                .limit(limit)
+                .offset(offset)
+            )
+            params = {}
+
+        async with get_session() as session:
+            result = await session.execute(stmt, params)
+            return [product_to_dict(p) for p in result.scalars().all()]
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "searches": self.searches,
+            "hits": self.hits,
+            "misses": self.searches - self.hits,
+            "size": len(self._cache)
+        }
+
+
+# Глобальный экземпляр
+product_search = ProductSearch()
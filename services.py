@@ -1,21 +1,30 @@
 from sqlalchemy import func
 """
 """
-import asyncio
-from collections import defaultdict
-from typing import Dict, List, Optional
-from sqlalchemy import select
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update, insert, delete, and_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import User, Product, Category, CartItem, Order, OrderItem, get_session
+from catalog_cache import catalog_cache, product_to_dict
+from shared_state import shared_state
+from availability import availability, available_value, min_stock, visible_clause
+from statistics import statistics_service, item_revenue
+from idempotency import idempotency
+from outbox import outbox, KIND_ADMIN_ORDER
+from config import settings
 
 
 class CartService:
     """Сервис корзины с улучшенной защитой от race condition"""
     
     def __init__(self):
-        # Блокировка на уровне пользователя+товар для более точного контроля
-        self._locks = defaultdict(asyncio.Lock)
+        # Блокировка на уровне пользователя+товар для более точного контроля.
+        # В памяти процесса или распределенная аренда в Redis (см. shared_state)
+        self._locks = shared_state
     
     def _get_lock_key(self, user_id: int, product_id: int = None) -> str:
         """Ключ для блокировки"""
@@ -50,59 +59,61 @@ class CartService:
     async def add_to_cart(self, user_id: int, product_id: int, quantity: int) -> Dict:
         """Добавить товар в корзину с улучшенной блокировкой"""
         lock_key = self._get_lock_key(user_id, product_id)
-        lock = self._locks[lock_key]
         
-        async with lock:
-            async with get_session() as session:
-                # Проверяем товар
-                product = await session.get(Product, product_id)
-                if not product or not product.available:
-                    return {"success": False, "error": "Товар недоступен"}
-                
-                # Проверка наличия с учетом типа товара
-                if product.unit_type == 'grams':
-                    stock = product.stock_grams
-                    unit_text = 'г'
-                else:  # pieces
-                    stock = product.stock_grams  # для штучных товаров хранится количество
-                    unit_text = 'шт'
-                
-                if quantity > stock:
-                    return {"success": False, "error": f"Недостаточно товара. Доступно: {stock}{unit_text}"}
-                
-                # Находим существующий элемент корзины
-                stmt = select(CartItem).where(
-                    CartItem.user_id == user_id,
-                    CartItem.product_id == product_id
+        async with self._locks.lock(lock_key):
+            return await self._add_to_cart_locked(user_id, product_id, quantity)
+
+    async def _add_to_cart_locked(self, user_id: int, product_id: int, quantity: int) -> Dict:
+        """Добавить товар в корзину; блокировку (пользователь, товар) держит вызывающий"""
+        async with get_session() as session:
+            # Проверяем товар
+            product = await session.get(Product, product_id)
+            if not product or not product.available:
+                return {"success": False, "error": "Товар недоступен"}
+            
+            # Проверка наличия с учетом типа товара
+            if product.unit_type == 'grams':
+                stock = product.stock_grams
+                unit_text = 'г'
+            else:  # pieces
+                stock = product.stock_grams  # для штучных товаров хранится количество
+                unit_text = 'шт'
+            
+            if quantity > stock:
+                return {"success": False, "error": f"Недостаточно товара. Доступно: {stock}{unit_text}"}
+            
+            # Находим существующий элемент корзины
+            stmt = select(CartItem).where(
+                CartItem.user_id == user_id,
+                CartItem.product_id == product_id
+            )
+            result = await session.execute(stmt)
+            cart_item = result.scalar_one_or_none()
+            
+            if cart_item:
+                cart_item.quantity = quantity
+            else:
+                cart_item = CartItem(
+                    user_id=user_id,
+                    product_id=product_id,
+                    quantity=quantity
                 )
-                result = await session.execute(stmt)
-                cart_item = result.scalar_one_or_none()
-                
-                if cart_item:
-                    cart_item.quantity = quantity
-                else:
-                    cart_item = CartItem(
-                        user_id=user_id,
-                        product_id=product_id,
-                        quantity=quantity
-                    )
-                    session.add(cart_item)
-                
-                await session.commit()
-                
-                return {
-                    "success": True,
-                    "message": f"{product.name} добавлен в корзину ({quantity}{unit_text})",
-                    "product_name": product.name,
-                    "quantity": quantity
-                }
+                session.add(cart_item)
+            
+            await session.commit()
+            
+            return {
+                "success": True,
+                "message": f"{product.name} добавлен в корзину ({quantity}{unit_text})",
+                "product_name": product.name,
+                "quantity": quantity
+            }
     
     async def update_cart_quantity(self, user_id: int, product_id: int, delta: int) -> Dict:
         """Обновить количество товара в корзине (для +/- кнопок)"""
         lock_key = self._get_lock_key(user_id, product_id)
-        lock = self._locks[lock_key]
         
-        async with lock:
+        async with self._locks.lock(lock_key):
             async with get_session() as session:
                 # Находим элемент корзины
                 stmt = select(CartItem).where(
@@ -134,12 +145,12 @@ class CartService:
                         "quantity": new_quantity,
                         "message": f"Количество обновлено: {new_quantity}" + ("г" if product.unit_type == "grams" else "шт")
                     }
-                else:
-                    # Если товара нет в корзине, но пытаемся добавить
-                    if delta > 0:
-                        return await self.add_to_cart(user_id, product_id, delta)
-                    else:
-                        return {"success": True, "quantity": 0, "message": "Товара нет в корзине"}
+                elif delta <= 0:
+                    return {"success": True, "quantity": 0, "message": "Товара нет в корзине"}
+
+            # Товара нет в корзине - добавляем под той же блокировкой: иначе
+            # одновременные нажатия (в том числе в разных процессах) затрут друг друга
+            return await self._add_to_cart_locked(user_id, product_id, delta)
     
     async def get_cart(self, user_id: int) -> Dict:
         """Получить содержимое корзины"""
@@ -181,9 +192,8 @@ class CartService:
     async def clear_cart(self, user_id: int) -> Dict:
         """Очистить корзину"""
         lock_key = self._get_lock_key(user_id)
-        lock = self._locks[lock_key]
         
-        async with lock:
+        async with self._locks.lock(lock_key):
             async with get_session() as session:
                 stmt = select(CartItem).where(CartItem.user_id == user_id)
                 result = await session.execute(stmt)
@@ -202,14 +212,14 @@ class CatalogService:
 
     async def get_hypoallergenic_products(self) -> List[Dict]:
         """Получить все гипоаллергенные товары"""
+        snapshot = catalog_cache.snapshot
+        if snapshot is not None:
+            return list(snapshot.hypoallergenic)
+
         async with get_session() as session:
             stmt = select(Product).where(
                 Product.is_hypoallergenic == True,
-                Product.available == True,
-                Product.is_active == True,
-                ((Product.hide_when_zero == False) |
-                 ((Product.unit_type == "grams") & (Product.stock_grams >= 100)) |
-                 ((Product.unit_type == "pieces") & (Product.stock_grams >= 1)))
+                visible_clause()
             ).order_by(Product.name)
 
             result = await session.execute(stmt)
@@ -243,27 +253,44 @@ class CatalogService:
             product.is_hypoallergenic = is_hypoallergenic
             await session.commit()
 
-            return {"success": True, "product": product}
+        catalog_cache.apply_product_fields(product_id, is_hypoallergenic=is_hypoallergenic)
+        return {"success": True, "product": product}
     
     async def get_categories(self) -> List[Dict]:
         """Получить все категории"""
+        snapshot = catalog_cache.snapshot
+        if snapshot is not None:
+            return list(snapshot.categories)
+
         async with get_session() as session:
             stmt = select(Category).order_by(Category.name)
             result = await session.execute(stmt)
             categories = result.scalars().all()
             
             return [{"id": cat.id, "name": cat.name} for cat in categories]
+
+    async def get_category(self, category_id: int) -> Optional[Dict]:
+        """Получить категорию по ID"""
+        snapshot = catalog_cache.snapshot
+        if snapshot is not None:
+            return snapshot.categories_by_id.get(category_id)
+
+        async with get_session() as session:
+            category = await session.get(Category, category_id)
+            if category:
+                return {"id": category.id, "name": category.name}
+            return None
     
     async def get_products_by_category(self, category_id: int) -> List[Dict]:
         """Получить товары категории"""
+        snapshot = catalog_cache.snapshot
+        if snapshot is not None:
+            return list(snapshot.products_by_category.get(category_id, ()))
+
         async with get_session() as session:
             stmt = select(Product).where(
                 Product.category_id == category_id,
-                Product.available == True,
-                Product.is_active == True,
-                ((Product.hide_when_zero == False) | 
-                 ((Product.unit_type == "grams") & (Product.stock_grams >= 100)) | 
-                 ((Product.unit_type == "pieces") & (Product.stock_grams >= 1)))
+                visible_clause()
             ).order_by(Product.name)
             
             result = await session.execute(stmt)
@@ -287,6 +314,10 @@ class CatalogService:
     
     async def get_product(self, product_id: int) -> Optional[Dict]:
         """Получить товар по ID"""
+        snapshot = catalog_cache.snapshot
+        if snapshot is not None:
+            return snapshot.products.get(product_id)
+
         async with get_session() as session:
             product = await session.get(Product, product_id)
             if product:
@@ -318,7 +349,9 @@ class CatalogService:
                     setattr(product, key, value)
             
             await session.commit()
-            return {"success": True, "product": product}
+
+        await catalog_cache.patch_product(product_id)
+        return {"success": True, "product": product}
 
 
 class UserService:
@@ -444,33 +477,25 @@ async def update_product_stock_and_availability(product_id: int, quantity_sold:
         if new_stock < 0:
             return {"success": False, "error": f"Недостаточно товара. Доступно: {old_stock}"}
 
-        product.stock_grams = new_stock
-
-        # Автоматическое скрытие товара при низких остатках
-        # Согласно требованиям: <100г для весового и <1шт для штучного
-        should_hide = False
-        reason = ""
-        
-        # Проверяем настройку hide_when_zero
-        if product.hide_when_zero:
-            if product.unit_type == 'grams':
-                # Для весового товара: скрываем если осталось меньше 100г
-                if new_stock < 100:
-                    should_hide = True
-                    reason = "осталось менее 100г"
-            else:  # pieces
-                # Для штучного товара: скрываем если осталось меньше 1шт
-                if new_stock < 1:
-                    should_hide = True
-                    reason = "осталось менее 1шт"
-        else:
+        # Автоматическое скрытие товара при низких остатках (правила в availability.py)
+        new_available = available_value(product_to_dict(product), stock=new_stock, restore=False)
+        should_hide = product.available and not new_available
+        reason = f"осталось менее {min_stock(product.unit_type)}{'г' if product.unit_type == 'grams' else 'шт'}"
+        if not product.hide_when_zero:
             logger.info(f"Автоскрытие отключено для товара {product.name}")
 
-        if should_hide:
-            product.available = False
+        product.stock_grams = new_stock
+        product.available = new_available
 
         await session.commit()
 
+        # Write-through: остатки и доступность уже известны, БД не перечитываем
+        catalog_cache.apply_product_fields(
+            product.id,
+            stock_grams=new_stock,
+            available=product.available
+        )
+
         if should_hide:
             logger.info(f"Товар {product.name} (ID: {product.id}) автоматически скрыт: {reason}")
 
@@ -483,10 +508,246 @@ async def update_product_stock_and_availability(product_id: int, quantity_sold:
             "reason": reason if should_hide else None
         }
 
+# ========== КАРТОЧКА ТОВАРА ==========
+
+class ProductCardService:
+    """Данные для карточки товара за один запрос к БД"""
+
+    async def get_card(self, user_id: int, product_id: int, cart_quantity: Optional[int] = None) -> Optional[Dict]:
+        """
+        Получить товар, название категории и количество товара в корзине пользователя.
+        Если количество в корзине уже известно (например, после добавления) - БД не трогаем.
+        """
+        snapshot = catalog_cache.snapshot
+        if snapshot is not None:
+            product = snapshot.products.get(product_id)
+            if not product:
+                return None
+
+            category = snapshot.categories_by_id.get(product["category_id"])
+            if cart_quantity is None:
+                async with get_session() as session:
+                    result = await session.execute(
+                        select(CartItem.quantity).where(
+                            CartItem.user_id == user_id,
+                            CartItem.product_id == product_id
+                        )
+                    )
+                    cart_quantity = result.scalar_one_or_none() or 0
+
+            return {
+                "product": product,
+                "category_name": category["name"] if category else None,
+                "cart_quantity": cart_quantity
+            }
+
+        # Каталог не загружен в память - всё одним запросом с JOIN
+        async with get_session() as session:
+            stmt = (
+                select(Product, Category.name, CartItem.quantity)
+                .outerjoin(Category, Category.id == Product.category_id)
+                .outerjoin(CartItem, and_(
+                    CartItem.product_id == Product.id,
+                    CartItem.user_id == user_id
+                ))
+                .where(Product.id == product_id)
+            )
+            row = (await session.execute(stmt)).first()
+            if row is None:
+                return None
+
+            product, category_name, quantity = row
+            return {
+                "product": product_to_dict(product),
+                "category_name": category_name,
+                "cart_quantity": cart_quantity if cart_quantity is not None else (quantity or 0)
+            }
+
+
+# ========== ОФОРМЛЕНИЕ ЗАКАЗА ОДНОЙ ТРАНЗАКЦИЕЙ ==========
+
+class CheckoutService:
+    """
+    Оформление заказа одной транзакцией:
+    условное списание остатков, заказ, позиции заказа и очистка корзины.
+    Если хотя бы одного товара не хватает - откатываем всё.
+    """
+
+    async def checkout(
+            self,
+            user_id: int,
+            customer_name: str,
+            phone: str,
+            address: str,
+            cart_items: List[Dict],
+            total_amount: float,
+            idempotency_key: Optional[Tuple] = None
+    ) -> Dict:
+        """
+        Создать заказ. Возвращает order_id или список нехватающих товаров.
+        С idempotency_key заказ создается не больше одного раза: повтор
+        получает результат первого оформления (duplicate=True).
+        """
+        logger = logging.getLogger(__name__)
+
+        # Сводим позиции по товару (на случай дублей в снимке корзины)
+        quantities: Dict[int, int] = {}
+        for item in cart_items:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+
+        if not quantities or any(q <= 0 for q in quantities.values()):
+            return {"success": False, "error": "empty_cart"}
+
+        async with get_session() as session:
+            claimed = None
+            if idempotency_key is not None:
+                try:
+                    claimed = await idempotency.claim(session, user_id, idempotency_key)
+                except IntegrityError:
+                    # Этот заказ уже оформлен (другим процессом или до перезапуска)
+                    await session.rollback()
+                    stored = await idempotency.stored_result(user_id, idempotency_key)
+                    logger.info(f"Повторное подтверждение заказа пользователя {user_id}")
+                    return stored or {"success": False, "error": "duplicate"}
+
+            shortages = []
+            changed_products = []
+
+            for product_id, quantity in quantities.items():
+                new_stock = Product.stock_grams - quantity
+                stmt = (
+                    update(Product)
+                    .where(Product.id == product_id, Product.stock_grams >= quantity)
+                    .values(
+                        stock_grams=new_stock,
+                        # При продаже товар только скрывается (правила в availability.py)
+                        available=availability(new_stock, restore=False)
+                    )
+                    .returning(Product.id, Product.name, Product.stock_grams, Product.available, Product.unit_type)
+                    .execution_options(synchronize_session=False)
+                )
+                row = (await session.execute(stmt)).first()
+                if row is None:
+                    shortages.append(product_id)
+                else:
+                    changed_products.append(row)
+
+            if shortages:
+                await session.rollback()
+
+                result = await session.execute(
+                    select(Product.id, Product.name, Product.stock_grams, Product.unit_type)
+                    .where(Product.id.in_(shortages))
+                )
+                found = {r.id: r for r in result.all()}
+                details = []
+                for product_id in shortages:
+                    product = found.get(product_id)
+                    details.append({
+                        "product_id": product_id,
+                        "product_name": product.name if product else None,
+                        "requested": quantities[product_id],
+                        "available": product.stock_grams if product else 0,
+                        "unit_type": product.unit_type if product else 'grams'
+                    })
+
+                logger.info(f"Заказ пользователя {user_id} отклонен: недостаточно товара {shortages}")
+                return {"success": False, "error": "insufficient_stock", "shortages": details}
+
+            order = Order(
+                user_id=user_id,
+                customer_name=customer_name,
+                phone=phone,
+                address=address,
+                total_amount=total_amount,
+                status="pending",
+                created_at=datetime.now()
+            )
+            session.add(order)
+            await session.flush()
+
+            await session.execute(insert(OrderItem), [
+                {
+                    "order_id": order.id,
+                    "product_id": item['product_id'],
+                    "product_name": item['product_name'],
+                    "price_per_100g": item['price_per_100g'],
+                    "quantity": item['quantity']
+                }
+                for item in cart_items
+            ])
+
+            await session.execute(delete(CartItem).where(CartItem.user_id == user_id))
+
+            # Сводки продаж для статистики - в той же транзакции
+            prices = {item['product_id']: item['price_per_100g'] for item in cart_items}
+            await statistics_service.record_order(session, order.created_at.date(), total_amount, [
+                {
+                    "product_id": row.id,
+                    "product_name": row.name,
+                    "quantity": quantities[row.id],
+                    "revenue": item_revenue(row.unit_type, prices[row.id], quantities[row.id])
+                }
+                for row in changed_products
+            ])
+
+            hidden = [
+                {"product_id": row.id, "product_name": row.name}
+                for row in changed_products if not row.available
+            ]
+            result = {
+                "success": True,
+                "order_id": order.id,
+                "total_amount": total_amount,
+                "hidden_products": hidden
+            }
+            if claimed is not None:
+                idempotency.complete(claimed, result)
+
+            # Уведомление админу - в той же транзакции, отправит outbox в фоне
+            notify = bool(settings.admin_id) and settings.admin_id != 123456789
+            if notify:
+                outbox.add(session, KIND_ADMIN_ORDER, {
+                    "order_id": order.id,
+                    "pet_name": customer_name,
+                    "telegram_login": phone.lstrip("@"),
+                    "address": address,
+                    "cart_items": [
+                        {
+                            "product_name": item['product_name'],
+                            "quantity": item['quantity'],
+                            "unit_type": item.get('unit_type', 'grams'),
+                            "total_price": item['total_price']
+                        }
+                        for item in cart_items
+                    ],
+                    "total_amount": total_amount,
+                    "user_id": user_id,
+                    "created_at": order.created_at.isoformat()
+                })
+            await session.commit()
+
+        if notify:
+            outbox.wake()
+
+        # Все позиции заказа - одной подменой снимка каталога
+        catalog_cache.apply_products_fields({
+            row.id: {"stock_grams": row.stock_grams, "available": row.available}
+            for row in changed_products
+        })
+        for row in changed_products:
+            if not row.available:
+                logger.info(f"Товар {row.name} (ID: {row.id}) автоматически скрыт после заказа #{order.id}")
+
+        return result
+
+
 # Создаем экземпляры сервисов
 cart_service = CartService()
 catalog_service = CatalogService()
 user_service = UserService()
+checkout_service = CheckoutService()
+product_card_service = ProductCardService()
 
 
 async def get_cart_items(telegram_id: int):
@@ -0,0 +1,378 @@
+"""
+Общее состояние бота: в памяти процесса или в Redis
+
+Предварительные количества, ID сообщений интерфейса, блокировки корзины
+и FSM хранятся в бэкенде, выбранном по REDIS_URL. Без Redis всё живет
+в памяти процесса (ExpiringKeyedStore, LockManager), с Redis - общее
+для нескольких процессов бота за балансировщиком webhook, а блокировки
+становятся распределенными арендами (SET NX PX с токеном владельца),
+которые продлеваются, пока блокировка удерживается. Журналы изменений
+(например, измененные товары каталога) позволяют процессам узнавать
+об изменениях, сделанных другими процессами.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Hashable, List, Optional, Tuple
+
+from config import settings
+from state_store import ExpiringKeyedStore, LockManager
+
+logger = logging.getLogger(__name__)
+
+# Удалить ключ аренды, только если он все еще принадлежит нам
+_RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Продлить аренду, только если она все еще принадлежит нам
+_RENEW_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Записать изменение в журнал: номер записи - следующее значение счетчика,
+# он же id записи в stream, поэтому пропуски видны по номерам
+_APPEND_CHANGE_SCRIPT = """
+local version = redis.call("incr", KEYS[1])
+redis.call("xadd", KEYS[2], "MAXLEN", "~", ARGV[2], version .. "-0", "change", ARGV[1])
+return version
+"""
+
+
+class LeaseLostError(RuntimeError):
+    """Аренда блокировки истекла или перехвачена, пока блокировка удерживалась"""
+
+
+class KeyedStore(ABC):
+    """Значения (user_id, key) с TTL"""
+
+    @abstractmethod
+    async def get(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        pass
+
+    @abstractmethod
+    async def set(self, user_id: int, key: Hashable, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    async def pop(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        pass
+
+    @abstractmethod
+    async def drop_user(self, user_id: int) -> int:
+        pass
+
+    @abstractmethod
+    async def incr(self, user_id: int, key: Hashable) -> int:
+        """Атомарно увеличить счетчик на 1 и вернуть новое значение"""
+        pass
+
+
+class LocalKeyedStore(KeyedStore):
+    """Хранилище в памяти процесса (обертка над ExpiringKeyedStore)"""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self._store = ExpiringKeyedStore(ttl_seconds=ttl_seconds, max_size=max_size)
+
+    async def get(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        return self._store.get(user_id, key, default)
+
+    async def set(self, user_id: int, key: Hashable, value: Any) -> None:
+        self._store.set(user_id, key, value)
+
+    async def pop(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        return self._store.pop(user_id, key, default)
+
+    async def drop_user(self, user_id: int) -> int:
+        return self._store.drop_user(user_id)
+
+    async def incr(self, user_id: int, key: Hashable) -> int:
+        value = self._store.get(user_id, key, 0) + 1
+        self._store.set(user_id, key, value)
+        return value
+
+    def stats(self) -> Dict:
+        return self._store.stats()
+
+
+class RedisKeyedStore(KeyedStore):
+    """
+    Хранилище в Redis: один hash на пользователя ({prefix}:{namespace}:{user_id}).
+    TTL продлевается при каждой записи и действует на все значения пользователя.
+    """
+
+    def __init__(self, redis, prefix: str, namespace: str, ttl_seconds: float):
+        self.redis = redis
+        self.prefix = f"{prefix}:{namespace}"
+        self.ttl_ms = int(ttl_seconds * 1000)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    async def get(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        raw = await self.redis.hget(self._key(user_id), str(key))
+        return json.loads(raw) if raw is not None else default
+
+    async def set(self, user_id: int, key: Hashable, value: Any) -> None:
+        name = self._key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(name, str(key), json.dumps(value))
+            pipe.pexpire(name, self.ttl_ms)
+            await pipe.execute()
+
+    async def pop(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        name = self._key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hget(name, str(key))
+            pipe.hdel(name, str(key))
+            raw, _ = await pipe.execute()
+        return json.loads(raw) if raw is not None else default
+
+    async def drop_user(self, user_id: int) -> int:
+        name = self._key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hlen(name)
+            pipe.delete(name)
+            count, _ = await pipe.execute()
+        return count
+
+    async def incr(self, user_id: int, key: Hashable) -> int:
+        name = self._key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(name, str(key), 1)
+            pipe.pexpire(name, self.ttl_ms)
+            value, _ = await pipe.execute()
+        return value
+
+
+class StateBackend(ABC):
+    """Бэкенд общего состояния"""
+
+    name = "base"
+    # Состояние общее для нескольких процессов
+    shared = False
+
+    @abstractmethod
+    def keyed_store(self, namespace: str, ttl_seconds: float, max_size: int = 100000) -> KeyedStore:
+        pass
+
+    @abstractmethod
+    def lock(self, key: Hashable):
+        """Асинхронный контекстный менеджер блокировки по ключу"""
+        pass
+
+    @abstractmethod
+    def fsm_storage(self):
+        """FSM-хранилище aiogram для этого бэкенда (None - использовать стандартное)"""
+        pass
+
+    @abstractmethod
+    async def publish_change(self, log: str, change: Dict) -> int:
+        """Добавить запись в журнал изменений log; возвращает ее номер"""
+        pass
+
+    @abstractmethod
+    async def log_version(self, log: str) -> int:
+        """Номер последней записи журнала (0 - записей не было)"""
+        pass
+
+    @abstractmethod
+    async def changes_since(self, log: str, version: int) -> List[Tuple[int, Dict]]:
+        """
+        Записи с номерами больше version по возрастанию. Журнал хранит
+        ограниченное число записей: если первая запись не version + 1,
+        часть изменений пропущена.
+        """
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        return {"backend": self.name}
+
+
+class InProcessBackend(StateBackend):
+    """Состояние в памяти одного процесса"""
+
+    name = "memory"
+
+    def __init__(self, max_changes: int = 1000):
+        self._locks = LockManager()
+        self.max_changes = max_changes
+        self._versions: Dict[str, int] = {}
+        self._logs: Dict[str, Deque[Tuple[int, Dict]]] = {}
+
+    def keyed_store(self, namespace: str, ttl_seconds: float, max_size: int = 100000) -> KeyedStore:
+        return LocalKeyedStore(ttl_seconds=ttl_seconds, max_size=max_size)
+
+    def lock(self, key: Hashable):
+        return self._locks.lock(key)
+
+    def fsm_storage(self):
+        return None
+
+    async def publish_change(self, log: str, change: Dict) -> int:
+        version = self._versions.get(log, 0) + 1
+        self._versions[log] = version
+        self._logs.setdefault(log, deque(maxlen=self.max_changes)).append((version, change))
+        return version
+
+    async def log_version(self, log: str) -> int:
+        return self._versions.get(log, 0)
+
+    async def changes_since(self, log: str, version: int) -> List[Tuple[int, Dict]]:
+        return [entry for entry in self._logs.get(log, ()) if entry[0] > version]
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, **self._locks.stats()}
+
+
+class RedisBackend(StateBackend):
+    """Состояние в Redis, общее для нескольких процессов"""
+
+    name = "redis"
+    shared = True
+
+    def __init__(
+            self,
+            url: str,
+            prefix: str = "barkery",
+            lease_seconds: float = 10,
+            lock_timeout: float = 15,
+            max_changes: int = 1000
+    ):
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError("Для REDIS_URL нужен пакет redis: pip install redis") from e
+
+        self.redis = Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.lease_ms = int(lease_seconds * 1000)
+        self.lock_timeout = lock_timeout
+        # Записей в каждом журнале изменений (приблизительно, MAXLEN ~)
+        self.max_changes = max_changes
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+        self.leases_lost = 0
+
+    def keyed_store(self, namespace: str, ttl_seconds: float, max_size: int = 100000) -> KeyedStore:
+        # Размер в Redis ограничивается TTL и maxmemory, а не max_size
+        return RedisKeyedStore(self.redis, self.prefix, namespace, ttl_seconds)
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable):
+        """
+        Распределенная аренда: ключ живет lease_seconds, поэтому упавший процесс
+        не держит блокировку вечно. Пока блокировка удерживается, аренда
+        продлевается каждую треть срока; если продлить не удалось до истечения
+        срока (аренду перехватили, Redis недоступен), код под блокировкой
+        прерывается с LeaseLostError. Освобождается только владельцем (по токену).
+        """
+        name = f"{self.prefix}:lock:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.002
+
+        while not await self.redis.set(name, token, nx=True, px=self.lease_ms):
+            if time.monotonic() >= deadline:
+                self.lock_timeouts += 1
+                raise TimeoutError(f"Не удалось получить блокировку {key}")
+            self.lock_waits += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+        holder = asyncio.current_task()
+        lost = asyncio.Event()
+        renewal = asyncio.create_task(self._keep_lease(name, token, holder, lost))
+        try:
+            yield
+        except asyncio.CancelledError:
+            if not lost.is_set():
+                raise
+            holder.uncancel()
+            raise LeaseLostError(f"Аренда блокировки {key} потеряна") from None
+        finally:
+            renewal.cancel()
+            await asyncio.gather(renewal, return_exceptions=True)
+            if not lost.is_set():
+                try:
+                    await self.redis.eval(_RELEASE_LEASE_SCRIPT, 1, name, token)
+                except Exception as e:
+                    # Аренда истечет сама
+                    logger.warning(f"Не удалось освободить блокировку {key}: {e}")
+
+    async def _keep_lease(self, name: str, token: str, holder: asyncio.Task, lost: asyncio.Event) -> None:
+        """Продлевать аренду, пока она удерживается; при потере - прервать владельца"""
+        expires = time.monotonic() + self.lease_ms / 1000
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            try:
+                renewed = await self.redis.eval(_RENEW_LEASE_SCRIPT, 1, name, token, self.lease_ms)
+            except Exception as e:
+                logger.warning(f"Не удалось продлить блокировку {name}: {e}")
+                renewed = None
+            now = time.monotonic()
+            if renewed:
+                expires = now + self.lease_ms / 1000
+            elif renewed == 0 or now >= expires:
+                # Ключ уже чужой (или истек) - другой процесс может войти под блокировку
+                self.leases_lost += 1
+                logger.error(f"Аренда блокировки {name} потеряна")
+                lost.set()
+                holder.cancel()
+                return
+
+    def fsm_storage(self):
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        ttl = int(settings.fsm_ttl_hours * 3600)
+        return RedisStorage(redis=self.redis, state_ttl=ttl, data_ttl=ttl)
+
+    async def publish_change(self, log: str, change: Dict) -> int:
+        return await self.redis.eval(
+            _APPEND_CHANGE_SCRIPT, 2, f"{self.prefix}:log:{log}:version", f"{self.prefix}:log:{log}",
+            json.dumps(change), self.max_changes
+        )
+
+    async def log_version(self, log: str) -> int:
+        return int(await self.redis.get(f"{self.prefix}:log:{log}:version") or 0)
+
+    async def changes_since(self, log: str, version: int) -> List[Tuple[int, Dict]]:
+        entries = await self.redis.xrange(f"{self.prefix}:log:{log}", min=f"{version + 1}-0", max="+")
+        return [(int(entry_id.split("-")[0]), json.loads(fields["change"])) for entry_id, fields in entries]
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "lock_waits": self.lock_waits,
+            "lock_timeouts": self.lock_timeouts,
+            "leases_lost": self.leases_lost
+        }
+
+
+def create_backend(redis_url: Optional[str] = None) -> StateBackend:
+    """Redis, если задан REDIS_URL, иначе память процесса"""
+    if redis_url:
+        logger.info("Общее состояние: Redis")
+        return RedisBackend(redis_url, prefix=settings.redis_prefix)
+    return InProcessBackend()
+
+
+# Глобальный экземпляр
+shared_state = create_backend(settings.redis_url)
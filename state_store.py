@@ -0,0 +1,143 @@
+"""
+Ограниченное хранилище временного состояния и менеджер блокировок
+
+ExpiringKeyedStore - значения по ключу (пользователь, подключ) с TTL,
+ограничением размера и индексом по пользователю, чтобы удалять всё
+состояние пользователя за O(1) на запись.
+LockManager - блокировки по ключу со счетчиком ссылок: неиспользуемые
+блокировки удаляются сразу после освобождения.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Hashable, List, Set, Tuple
+
+_MISSING = object()
+
+
+class ExpiringKeyedStore:
+    """Хранилище значений (user_id, key) с TTL и ограничением размера"""
+
+    def __init__(self, ttl_seconds: float = 3600, max_size: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        # (user_id, key) -> (value, expires_at); порядок - от самых старых записей
+        self._items: "OrderedDict[Tuple[int, Hashable], Tuple[Any, float]]" = OrderedDict()
+        # user_id -> множество ключей пользователя
+        self._by_user: Dict[int, Set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        """Получить значение (просроченные записи не возвращаются)"""
+        entry = self._items.get((user_id, key))
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(user_id, key)
+            return default
+        return value
+
+    def set(self, user_id: int, key: Hashable, value: Any) -> None:
+        """Сохранить значение и продлить его TTL"""
+        item_key = (user_id, key)
+        self._items[item_key] = (value, time.monotonic() + self.ttl_seconds)
+        self._items.move_to_end(item_key)
+        self._by_user.setdefault(user_id, set()).add(key)
+        self._evict()
+
+    def pop(self, user_id: int, key: Hashable, default: Any = None) -> Any:
+        """Удалить значение и вернуть его"""
+        entry = self._items.get((user_id, key))
+        if entry is None:
+            return default
+        self._remove(user_id, key)
+        return entry[0]
+
+    def drop_user(self, user_id: int) -> int:
+        """Удалить всё состояние пользователя, вернуть количество удаленных записей"""
+        keys = self._by_user.pop(user_id, None)
+        if not keys:
+            return 0
+        for key in keys:
+            self._items.pop((user_id, key), None)
+        return len(keys)
+
+    def clear(self) -> None:
+        """Удалить все записи"""
+        self._items.clear()
+        self._by_user.clear()
+
+    def user_items(self, user_id: int) -> List[Tuple[Hashable, Any]]:
+        """Все актуальные значения пользователя"""
+        items = []
+        for key in list(self._by_user.get(user_id, ())):
+            value = self.get(user_id, key, _MISSING)
+            if value is not _MISSING:
+                items.append((key, value))
+        return items
+
+    def purge_expired(self) -> int:
+        """Удалить просроченные записи (они лежат в начале очереди)"""
+        now = time.monotonic()
+        removed = 0
+        while self._items:
+            (user_id, key), (_, expires_at) = next(iter(self._items.items()))
+            if expires_at >= now:
+                break
+            self._remove(user_id, key)
+            removed += 1
+        return removed
+
+    def _evict(self) -> None:
+        """Вытеснить просроченные и самые старые записи сверх лимита"""
+        self.purge_expired()
+        while len(self._items) > self.max_size:
+            (user_id, key), _ = next(iter(self._items.items()))
+            self._remove(user_id, key)
+
+    def _remove(self, user_id: int, key: Hashable) -> None:
+        self._items.pop((user_id, key), None)
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    def stats(self) -> Dict:
+        """Размер хранилища"""
+        return {"items": len(self._items), "users": len(self._by_user), "max_size": self.max_size}
+
+
+class LockManager:
+    """Блокировки по ключу со счетчиком ссылок"""
+
+    def __init__(self):
+        # key -> [asyncio.Lock, количество владельцев и ожидающих]
+        self._locks: Dict[Hashable, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable):
+        """Захватить блокировку по ключу; после освобождения последним - удалить её"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self._locks[key] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(key) is entry:
+                del self._locks[key]
+
+    def stats(self) -> Dict:
+        """Количество активных блокировок"""
+        return {"locks": len(self._locks)}
@@ -1,38 +1,199 @@
 """
 Модуль статистики для Barkery Shop
+
+Продажи хранятся в сводных таблицах sales_daily и sales_product_daily,
+которые обновляются в транзакции оформления заказа. Дашборд читает
+несколько строк сводок вместо агрегатов по orders/order_items.
+Пересборка сводок из заказов - rebuild() (команда /rebuild_stats).
 """
 import logging
+from datetime import date, timedelta
+from typing import Dict, List
+
+from sqlalchemy import case, delete, func, insert, literal_column, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import get_session, Order, OrderItem, Product, User, SalesDaily, SalesProductDaily
 
 logger = logging.getLogger(__name__)
 
+TOP_PRODUCTS_LIMIT = 5
+
+
+def item_revenue(unit_type: str, price: float, quantity: int) -> float:
+    """Стоимость позиции: цена за 100 г для весовых товаров, за штуку для штучных"""
+    if unit_type == 'pieces':
+        return price * quantity
+    return price / 100 * quantity
+
+
 class StatisticsService:
+
+    # ---------- обновление сводок ----------
+
+    async def record_order(self, session, day: date, total_amount: float, items: List[Dict]) -> None:
+        """
+        Добавить заказ в сводки (в транзакции заказа).
+        items: product_id, product_name, quantity, revenue - по одной позиции на товар.
+        """
+        stmt = sqlite_insert(SalesDaily).values(
+            day=day,
+            orders=1,
+            units=sum(item["quantity"] for item in items),
+            revenue=total_amount
+        )
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[SalesDaily.day],
+            set_={
+                "orders": SalesDaily.orders + stmt.excluded.orders,
+                "units": SalesDaily.units + stmt.excluded.units,
+                "revenue": SalesDaily.revenue + stmt.excluded.revenue
+            }
+        ))
+
+        stmt = sqlite_insert(SalesProductDaily)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[SalesProductDaily.day, SalesProductDaily.product_id],
+                set_={
+                    "product_name": stmt.excluded.product_name,
+                    "orders": SalesProductDaily.orders + stmt.excluded.orders,
+                    "units": SalesProductDaily.units + stmt.excluded.units,
+                    "revenue": SalesProductDaily.revenue + stmt.excluded.revenue
+                }
+            ),
+            [
+                {
+                    "day": day,
+                    "product_id": item["product_id"],
+                    "product_name": item["product_name"],
+                    "orders": 1,
+                    "units": item["quantity"],
+                    "revenue": item["revenue"]
+                }
+                for item in items
+            ]
+        )
+
+    async def rebuild(self) -> Dict:
+        """Пересобрать сводки из orders/order_items одной транзакцией (бэкфилл)"""
+        try:
+            order_day = func.date(Order.created_at)
+            units_per_order = (
+                select(OrderItem.order_id, func.sum(OrderItem.quantity).label("units"))
+                .group_by(OrderItem.order_id)
+                .subquery()
+            )
+            daily = (
+                select(
+                    order_day,
+                    func.count(Order.id),
+                    func.coalesce(func.sum(units_per_order.c.units), 0),
+                    func.sum(Order.total_amount)
+                )
+                .outerjoin(units_per_order, units_per_order.c.order_id == Order.id)
+                .group_by(order_day)
+            )
+            revenue = case(
+                (Product.unit_type == 'pieces', OrderItem.price_per_100g * OrderItem.quantity),
+                else_=OrderItem.price_per_100g * OrderItem.quantity / literal_column("100.0")
+            )
+            per_product = (
+                select(
+                    order_day,
+                    OrderItem.product_id,
+                    func.max(OrderItem.product_name),
+                    func.count(func.distinct(OrderItem.order_id)),
+                    func.sum(OrderItem.quantity),
+                    func.sum(revenue)
+                )
+                .join(Order, Order.id == OrderItem.order_id)
+                .outerjoin(Product, Product.id == OrderItem.product_id)
+                .where(OrderItem.product_id.isnot(None))
+                .group_by(order_day, OrderItem.product_id)
+            )
+
+            async with get_session() as session:
+                await session.execute(delete(SalesDaily))
+                await session.execute(delete(SalesProductDaily))
+                days = (await session.execute(
+                    insert(SalesDaily).from_select(["day", "orders", "units", "revenue"], daily)
+                )).rowcount
+                rows = (await session.execute(
+                    insert(SalesProductDaily).from_select(
+                        ["day", "product_id", "product_name", "orders", "units", "revenue"], per_product
+                    )
+                )).rowcount
+
+            logger.info(f"📊 Сводки продаж пересобраны: {days} дней, {rows} строк по товарам")
+            return {"success": True, "days": days, "product_rows": rows}
+        except Exception as e:
+            logger.error(f"Ошибка пересборки сводок продаж: {e}")
+            return {"success": False, "error": str(e)}
+
+    # ---------- дашборд ----------
+
     async def get_dashboard_stats(self):
         try:
-            from database import get_session, Order, Product, User
-            from sqlalchemy import func, select
-            
+            from catalog_cache import catalog_cache
+
+            today = date.today()
+            month_start = today - timedelta(days=29)
+
             async with get_session() as session:
-                result = await session.execute(select(func.count(Order.id)))
-                total_orders = result.scalar() or 0
-                
+                result = await session.execute(
+                    select(SalesDaily).where(SalesDaily.day >= month_start)
+                )
+                recent = result.scalars().all()
+
+                result = await session.execute(
+                    select(func.coalesce(func.sum(SalesDaily.orders), 0), func.coalesce(func.sum(SalesDaily.revenue), 0))
+                )
+                total_orders, total_revenue = result.one()
+
+                result = await session.execute(
+                    select(
+                        SalesProductDaily.product_id,
+                        func.max(SalesProductDaily.product_name).label("product_name"),
+                        func.sum(SalesProductDaily.units).label("units"),
+                        func.sum(SalesProductDaily.revenue).label("revenue")
+                    )
+                    .where(SalesProductDaily.day >= month_start)
+                    .group_by(SalesProductDaily.product_id)
+                    .order_by(func.sum(SalesProductDaily.revenue).desc())
+                    .limit(TOP_PRODUCTS_LIMIT)
+                )
+                top_products = [dict(row) for row in result.mappings()]
+
                 result = await session.execute(select(func.count(User.id)))
                 total_users = result.scalar() or 0
-                
-                result = await session.execute(select(func.count(Product.id)))
-                total_products = result.scalar() or 0
-                
-                result = await session.execute(select(func.sum(Order.total_amount)))
-                total_revenue = float(result.scalar() or 0)
-                
-                avg = total_revenue / total_orders if total_orders > 0 else 0
-                
-                return {
-                    "total_orders": total_orders,
-                    "total_users": total_users,
-                    "total_products": total_products,
-                    "total_revenue": total_revenue,
-                    "avg_order_value": avg
-                }
+
+                snapshot = catalog_cache.snapshot
+                if snapshot is not None:
+                    total_products = len(snapshot.products)
+                else:
+                    result = await session.execute(select(func.count(Product.id)))
+                    total_products = result.scalar() or 0
+
+            snapshot = catalog_cache.snapshot
+            for product in top_products:
+                cached = snapshot.products.get(product["product_id"]) if snapshot is not None else None
+                product["unit_type"] = cached["unit_type"] if cached else None
+
+            total_revenue = float(total_revenue)
+            avg = total_revenue / total_orders if total_orders > 0 else 0
+
+            return {
+                "total_orders": total_orders,
+                "total_users": total_users,
+                "total_products": total_products,
+                "total_revenue": total_revenue,
+                "avg_order_value": avg,
+                "today": self._period(recent, today),
+                "week": self._period(recent, today - timedelta(days=6)),
+                "month": self._period(recent, month_start),
+                "top_products": top_products
+            }
         except Exception as e:
             logger.error(f"Ошибка статистики: {e}")
             return {
@@ -43,4 +204,16 @@ class StatisticsService:
                 "avg_order_value": 0
             }
 
+    @staticmethod
+    def _period(rows: List[SalesDaily], since: date) -> Dict:
+        """Сумма дневных сводок начиная с since"""
+        orders = sum(r.orders for r in rows if r.day >= since)
+        revenue = sum(r.revenue for r in rows if r.day >= since)
+        return {
+            "orders": orders,
+            "revenue": revenue,
+            "avg_order_value": revenue / orders if orders else 0
+        }
+
+
 statistics_service = StatisticsService()
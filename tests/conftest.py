@@ -0,0 +1,99 @@
+"""
+Общие настройки тестов Barkery Shop
+
+Engine БД и глобальные сервисы создаются при импорте модулей бота,
+поэтому переменные окружения задаются до импорта, а все тесты работают
+в одном цикле событий (соединения aiosqlite и блокировки привязаны к нему).
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+TEST_DIR = tempfile.mkdtemp(prefix="barkery-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{TEST_DIR}/test.db"
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ["REDIS_URL"] = ""
+os.environ["BACKUP_ENABLED"] = "0"
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    # Воркеры очереди исходящих запросов живут в этом цикле
+    module = sys.modules.get("outbound")
+    if module is not None:
+        loop.run_until_complete(module.outbound.close())
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def run(event_loop):
+    """Выполнить корутину в общем цикле событий"""
+    return event_loop.run_until_complete
+
+
+@pytest.fixture(scope="session")
+def database(run):
+    from database import init_db
+
+    run(init_db())
+
+
+@pytest.fixture
+def db(run, database):
+    """Пустая БД (кроме версии схемы) и сброшенные кэши каталога"""
+    from sqlalchemy import text
+    from database import engine, Base
+    from catalog_cache import catalog_cache
+    from outbound import outbound, TokenBucket
+
+    async def clean():
+        async with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                await conn.execute(text(f"DELETE FROM {table.name}"))
+        catalog_cache._snapshot = None
+
+    run(clean())
+    # Ограничения Telegram в тестах не нужны
+    outbound.chat_rate = outbound.chat_burst = 1e6
+    outbound._global = TokenBucket(1e6, 1e6)
+    outbound._deletes = TokenBucket(1e6, 1e6)
+    yield
+
+
+@pytest.fixture
+def add_products(run, db):
+    """Создать категорию с товарами: add_products(("Печенье", {"stock_grams": 1000}), ...)"""
+    from database import get_session, Category, Product
+
+    async def create(category_name, products):
+        async with get_session() as session:
+            category = Category(name=category_name)
+            session.add(category)
+            await session.flush()
+            created = []
+            for name, fields in products:
+                values = dict(
+                    name=name, price=100, stock_grams=1000, unit_type="grams", measurement_step=100,
+                    available=True, is_active=True, hide_when_zero=True, is_hypoallergenic=False
+                )
+                values.update(fields)
+                product = Product(category_id=category.id, **values)
+                session.add(product)
+                created.append(product)
+            await session.flush()
+            return category.id, [p.id for p in created]
+
+    def add(*products, category: str = "Печенье"):
+        return run(create(category, products))
+
+    return add
@@ -0,0 +1,35 @@
+"""Доступность товара после правки остатка в админке"""
+from admin import apply_availability
+from database import Product
+
+
+def _product(**fields) -> Product:
+    values = dict(id=1, name="Печенье", price=100, stock_grams=1000, unit_type="grams", measurement_step=100,
+                  available=True, is_active=True, hide_when_zero=True, is_hypoallergenic=False, category_id=1)
+    values.update(fields)
+    return Product(**values)
+
+
+def test_low_stock_hides_only_with_hide_when_zero():
+    product = _product(stock_grams=50)
+    apply_availability(product)
+    assert product.available is False
+
+    # Раньше админка скрывала товар, даже если hide_when_zero выключен
+    product = _product(stock_grams=50, hide_when_zero=False)
+    apply_availability(product)
+    assert product.available is True
+
+
+def test_restock_restores_by_unit_minimum():
+    product = _product(stock_grams=100, available=False)
+    apply_availability(product)
+    assert product.available is True
+
+    product = _product(stock_grams=1, unit_type="pieces", measurement_step=1, available=False)
+    apply_availability(product)
+    assert product.available is True
+
+    product = _product(stock_grams=0, unit_type="pieces", measurement_step=1, available=False, hide_when_zero=False)
+    apply_availability(product)
+    assert product.available is False
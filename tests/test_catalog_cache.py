@@ -0,0 +1,73 @@
+"""Снимок каталога: точечное обновление совпадает с полной пересборкой"""
+import random
+
+from catalog_cache import CatalogCache, CatalogSnapshot
+
+
+def _product(product_id: int, rng: random.Random) -> dict:
+    return {
+        "id": product_id,
+        "name": f"Товар {rng.randint(0, 50)}",
+        "description": None,
+        "price": 100,
+        "stock_grams": rng.choice([0, 50, 500]),
+        "image_url": None,
+        "available": rng.random() < 0.8,
+        "is_active": rng.random() < 0.9,
+        "unit_type": rng.choice(["grams", "pieces"]),
+        "measurement_step": 100,
+        "hide_when_zero": rng.random() < 0.5,
+        "is_hypoallergenic": rng.random() < 0.3,
+        "category_id": rng.randint(1, 5)
+    }
+
+
+def _indexes(snapshot: CatalogSnapshot):
+    return (
+        {pid: dict(p) for pid, p in snapshot.products.items()},
+        {cid: [p["id"] for p in items] for cid, items in snapshot.products_by_category.items()},
+        [p["id"] for p in snapshot.hypoallergenic],
+        [c["id"] for c in snapshot.categories]
+    )
+
+
+def test_with_products_matches_full_rebuild():
+    rng = random.Random(7)
+    categories = [{"id": i, "name": f"Категория {i}"} for i in range(1, 6)]
+    products = {i: _product(i, rng) for i in range(1, 301)}
+    snapshot = CatalogSnapshot(1, categories, products.values())
+
+    for version in range(2, 202):
+        updates = {}
+        for product_id in rng.sample(range(1, 321), rng.randint(1, 4)):
+            if rng.random() < 0.15:
+                updates[product_id] = None
+                products.pop(product_id, None)
+            else:
+                updates[product_id] = products[product_id] = _product(product_id, rng)
+        snapshot = snapshot.with_products(version, updates)
+
+        assert snapshot.version == version
+        assert _indexes(snapshot) == _indexes(CatalogSnapshot(version, categories, products.values()))
+
+
+def test_apply_products_fields_is_one_swap():
+    cache = CatalogCache()
+    rng = random.Random(1)
+    products = [_product(i, rng) | {"is_active": True, "available": True, "stock_grams": 500} for i in range(1, 4)]
+    cache._snapshot = CatalogSnapshot(cache._next_version(), [{"id": 1, "name": "К"}], products)
+    version = cache.version
+
+    cache.apply_products_fields({
+        1: {"stock_grams": 0, "available": False},
+        2: {"stock_grams": 300},
+        99: {"stock_grams": 1}  # нет в снимке - пропускается
+    })
+
+    assert cache.version == version + 1
+    snapshot = cache.snapshot
+    assert snapshot.products[1]["stock_grams"] == 0
+    assert snapshot.products[2]["stock_grams"] == 300
+    assert 99 not in snapshot.products
+    visible = [p["id"] for items in snapshot.products_by_category.values() for p in items]
+    assert 1 not in visible and 2 in visible
@@ -0,0 +1,212 @@
+"""Оформление заказа: одновременные покупки не продают больше, чем есть на складе"""
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import func, select
+
+from database import get_session, Order, OrderItem, OutboxMessage, Product, User
+from catalog_cache import catalog_cache
+from services import checkout_service
+
+
+def _cart(product_id: int, quantity: int):
+    return [{
+        "product_id": product_id,
+        "product_name": "Печенье",
+        "price_per_100g": 100,
+        "quantity": quantity,
+        "unit_type": "grams",
+        "total_price": quantity
+    }]
+
+
+def _create_users(run, count: int):
+    async def create():
+        async with get_session() as session:
+            users = [User(telegram_id=str(10_000 + i)) for i in range(count)]
+            session.add_all(users)
+            await session.flush()
+            return [u.id for u in users]
+
+    return run(create())
+
+
+def test_concurrent_checkouts_never_oversell(run, add_products):
+    _, (product_id,) = add_products(("Печенье", {"stock_grams": 1000}))
+    run(catalog_cache.load())
+    user_ids = _create_users(run, 300)
+
+    async def buy_all():
+        return await asyncio.gather(*(
+            checkout_service.checkout(user_id, "Рекс", "@rex", "Белград", _cart(product_id, 200), 200)
+            for user_id in user_ids
+        ))
+
+    results = run(buy_all())
+
+    succeeded = [r for r in results if r["success"]]
+    rejected = [r for r in results if not r["success"]]
+    assert len(succeeded) == 5
+    assert all(r["error"] == "insufficient_stock" for r in rejected)
+
+    async def stored():
+        async with get_session() as session:
+            product = await session.get(Product, product_id)
+            orders = await session.scalar(select(func.count()).select_from(Order))
+            sold = await session.scalar(select(func.sum(OrderItem.quantity)))
+            return product, orders, sold
+
+    product, orders, sold = run(stored())
+    assert product.stock_grams == 0
+    assert not product.available
+    assert orders == 5 and sold == 1000
+
+    # Снимок каталога совпадает с БД
+    cached = catalog_cache.snapshot.products[product_id]
+    assert cached["stock_grams"] == 0 and not cached["available"]
+
+
+def test_shortage_rolls_back_whole_order(run, add_products):
+    _, (plenty, scarce) = add_products(("Много", {"stock_grams": 1000}), ("Мало", {"stock_grams": 100}))
+    (user_id,) = _create_users(run, 1)
+
+    cart = _cart(plenty, 300) + _cart(scarce, 200)
+    result = run(checkout_service.checkout(user_id, "Рекс", "@rex", "Белград", cart, 500))
+
+    assert result["success"] is False
+    assert result["error"] == "insufficient_stock"
+    assert [s["product_id"] for s in result["shortages"]] == [scarce]
+
+    async def stock():
+        async with get_session() as session:
+            orders = await session.scalar(select(func.count()).select_from(Order))
+            return (await session.get(Product, plenty)).stock_grams, orders
+
+    assert run(stock()) == (1000, 0)
+
+
+def _stored_counts(run, product_id):
+    async def counts():
+        async with get_session() as session:
+            orders = await session.scalar(select(func.count()).select_from(Order))
+            outbox = await session.scalar(select(func.count()).select_from(OutboxMessage))
+            stock = (await session.get(Product, product_id)).stock_grams
+            return orders, outbox, stock
+
+    return run(counts())
+
+
+def _confirm_taps(run, product_id, user_id, monkeypatch):
+    """Нажатия "Подтвердить" по одному FSMContext; возвращает tap(n) и список показанных экранов"""
+    import handlers
+
+    shown = []
+
+    async def safe_edit_or_send(callback, text, keyboard=None):
+        shown.append(text)
+
+    async def answer(text=None, *args, **kwargs):
+        if text:
+            shown.append(text)
+
+    monkeypatch.setattr(handlers.clean_ui, "safe_edit_or_send", safe_edit_or_send)
+
+    storage = MemoryStorage()
+    key = StorageKey(bot_id=42, chat_id=10_000, user_id=10_000)
+    run(storage.set_data(key, {
+        "pet_name": "Рекс", "telegram_login": "rex", "address": "Белград",
+        "cart_items": _cart(product_id, 200), "total_amount": 200,
+        "checkout_token": uuid.uuid4().hex
+    }))
+
+    def tap(n):
+        callback = SimpleNamespace(
+            id=f"tap-{n}", answer=answer, message=None,
+            from_user=SimpleNamespace(id=10_000, username="rex")
+        )
+        return handlers.confirm_order(callback, FSMContext(storage, key), user_id)
+
+    return tap, shown
+
+
+def test_concurrent_confirm_taps_create_one_order(run, add_products, monkeypatch):
+    _, (product_id,) = add_products(("Печенье", {"stock_grams": 1000}))
+    (user_id,) = _create_users(run, 1)
+    tap, shown = _confirm_taps(run, product_id, user_id, monkeypatch)
+
+    async def double_taps():
+        await asyncio.gather(*(tap(n) for n in range(50)))
+
+    run(double_taps())
+
+    # Одно нажатие оформило заказ, остальные получили тот же заказ
+    assert _stored_counts(run, product_id) == (1, 1, 800)
+    assert len(shown) == 50
+    assert len(set(shown)) == 1 and "Заказ успешно оформлен" in shown[0]
+
+
+def test_confirm_tap_after_completion_shows_same_order(run, add_products, monkeypatch):
+    """Состояние после заказа сброшено, но повторное нажатие видит тот же заказ, а не ошибку"""
+    _, (product_id,) = add_products(("Печенье", {"stock_grams": 1000}))
+    (user_id,) = _create_users(run, 1)
+    tap, shown = _confirm_taps(run, product_id, user_id, monkeypatch)
+
+    run(tap(0))
+    run(tap(1))
+    run(tap(2))
+
+    assert _stored_counts(run, product_id) == (1, 1, 800)
+    assert len(shown) == 3
+    assert len(set(shown)) == 1 and "Заказ успешно оформлен" in shown[0]
+
+
+def test_same_checkout_key_from_other_processes_creates_one_order(run, add_products):
+    """Повторы мимо in-flight map (другой процесс) отсекает ключ в idempotency_keys"""
+    _, (product_id,) = add_products(("Печенье", {"stock_grams": 1000}))
+    (user_id,) = _create_users(run, 1)
+    checkout_key = ("checkout", uuid.uuid4().hex)
+
+    async def deliveries():
+        return await asyncio.gather(*(
+            checkout_service.checkout(user_id, "Рекс", "@rex", "Белград", _cart(product_id, 200), 200,
+                                      idempotency_key=checkout_key)
+            for _ in range(50)
+        ))
+
+    results = run(deliveries())
+
+    assert all(r["success"] for r in results)
+    assert len({r["order_id"] for r in results}) == 1
+    assert sum(not r.get("duplicate") for r in results) == 1
+    assert _stored_counts(run, product_id) == (1, 1, 800)
+
+
+def test_old_idempotency_keys_are_purged_outside_checkout(run, add_products):
+    from database import IdempotencyKey
+    from idempotency import idempotency
+
+    _, (product_id,) = add_products(("Печенье", {"stock_grams": 1000}))
+    (user_id,) = _create_users(run, 1)
+
+    async def add_old_key():
+        async with get_session() as session:
+            session.add(IdempotencyKey(key="old", scope="checkout", user_id=user_id,
+                                       created_at=time.time() - idempotency.retention_seconds - 60))
+
+    async def keys():
+        async with get_session() as session:
+            return set((await session.execute(select(IdempotencyKey.key))).scalars())
+
+    run(add_old_key())
+    run(checkout_service.checkout(user_id, "Рекс", "@rex", "Белград", _cart(product_id, 200), 200,
+                                  idempotency_key=("checkout", "new")))
+    # Заказ не удаляет чужие старые ключи
+    assert "old" in run(keys())
+
+    assert run(idempotency.purge()) == 1
+    assert run(keys()) == {f"{user_id}:checkout:new"}
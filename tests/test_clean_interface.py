@@ -0,0 +1,57 @@
+"""Отложенная правка карточки: серия нажатий - одна правка"""
+import asyncio
+import gc
+from types import SimpleNamespace
+
+from clean_interface import CleanInterface
+from shared_state import InProcessBackend
+
+
+class FakeScheduler:
+    def __init__(self, fail: bool = False):
+        self.posted = []
+        self.fail = fail
+
+    def post(self, chat_id, call, priority=0, coalesce_key=None, delete=False):
+        if self.fail:
+            raise RuntimeError("очередь остановлена")
+        self.posted.append((chat_id, coalesce_key))
+
+
+def _callback(user_id: int, message_id: int):
+    return SimpleNamespace(
+        from_user=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(message_id=message_id, photo=None),
+        bot=None
+    )
+
+
+def test_taps_are_coalesced_and_flush_tasks_are_kept(run):
+    scheduler = FakeScheduler()
+    ui = CleanInterface(scheduler=scheduler, backend=InProcessBackend(), card_edit_delay=0.02)
+
+    async def taps():
+        for _ in range(10):
+            await ui.schedule_product_card_update(_callback(1, 5), "карточка", None)
+        await ui.schedule_product_card_update(_callback(2, 6), "карточка", None)
+        await asyncio.sleep(0.05)
+        # Задача правки запущена и удерживается, пока не завершится
+        gc.collect()
+        while ui._flush_tasks:
+            await asyncio.sleep(0.01)
+
+    run(taps())
+    assert sorted(scheduler.posted) == [(1, ("edit", 1, 5)), (2, ("edit", 2, 6))]
+    assert not ui._card_edits
+
+
+def test_flush_errors_are_logged(run, caplog):
+    ui = CleanInterface(scheduler=FakeScheduler(fail=True), backend=InProcessBackend(), card_edit_delay=0.01)
+
+    async def tap():
+        await ui.schedule_product_card_update(_callback(1, 5), "карточка", None)
+        await asyncio.sleep(0.05)
+
+    run(tap())
+    assert not ui._flush_tasks
+    assert "Ошибка отложенной правки карточки" in caplog.text
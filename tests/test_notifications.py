@@ -0,0 +1,56 @@
+"""Уведомления админу о заказах: HTML-разметка и сводки"""
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendMessage
+
+from config import settings
+from notifications import format_admin_notification, format_orders_digest
+from outbox import OutboxDispatcher
+
+
+def _order(order_id: int, **fields) -> dict:
+    order = {
+        "order_id": order_id,
+        "user_id": 1000 + order_id,
+        "pet_name": "Барон",
+        "telegram_login": "baron",
+        "address": "ул. Светогорска, 5",
+        "total_amount": 500,
+        "created_at": "2026-02-26T18:16:00",
+        "cart_items": [{"product_name": "Печенье", "quantity": 200, "unit_type": "grams", "total_price": 500}]
+    }
+    order.update(fields)
+    return order
+
+
+def test_user_fields_are_escaped():
+    order = _order(1, pet_name="<b>Рекс</b>", telegram_login="a&b", address="Дом <5> & кв. 2")
+    for text in [format_admin_notification(order, 1), *format_orders_digest([order, _order(2)])]:
+        assert "<b>Рекс</b>" not in text
+        assert "&lt;b&gt;Рекс&lt;/b&gt;" in text
+        assert "@a&amp;b" in text
+        assert "Дом &lt;5&gt; &amp; кв. 2" in text
+
+
+class FakeBot:
+    """Отклоняет сводки, принимает уведомления о заказах по одному"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if "НОВЫЕ ЗАКАЗЫ" in text:
+            raise TelegramBadRequest(SendMessage(chat_id=chat_id, text=text), "can't parse entities")
+        self.sent.append(text)
+
+
+def test_rejected_digest_falls_back_to_single_orders(run, db, monkeypatch):
+    monkeypatch.setattr(settings, "admin_id", 42)
+    dispatcher = OutboxDispatcher()
+    dispatcher.bot = FakeBot()
+
+    run(dispatcher._deliver("admin_order", [_order(1), _order(2), _order(3)]))
+
+    assert len(dispatcher.bot.sent) == 3
+    assert [text.splitlines()[0] for text in dispatcher.bot.sent] == [
+        f"🛎️ <b>НОВЫЙ ЗАКАЗ #{order_id}</b>" for order_id in (1, 2, 3)
+    ]
@@ -0,0 +1,47 @@
+"""Очередь исходящих запросов: лимиты и остановка"""
+import asyncio
+
+import pytest
+
+from outbound import OutboundScheduler, PRIORITY_CLEANUP
+
+
+async def _ok():
+    return True
+
+
+def test_close_fails_unsent_jobs(run):
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate=0.01, chat_burst=1)
+        futures = [scheduler.submit(1, _ok) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        assert scheduler.stats()["deferred"] == 4
+
+        await scheduler.close(timeout=0.1)
+        assert futures[0].result() is True
+        for future in futures[1:]:
+            with pytest.raises(RuntimeError):
+                future.result()
+        assert scheduler.stats()["deferred"] == 0
+
+        # Запросы, не дождавшиеся общего лимита, остаются в очереди - их тоже завершаем
+        scheduler = OutboundScheduler(global_rate=1, workers=1)
+        futures = [scheduler.submit(chat_id, _ok) for chat_id in range(5)]
+        await scheduler.close(timeout=0.1)
+        assert futures[0].result() is True
+        assert all(isinstance(f.exception(), RuntimeError) for f in futures[1:])
+        assert scheduler.stats()["queued"] == 0
+
+    run(scenario())
+
+
+def test_deletes_do_not_spend_chat_budget(run):
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate=0.01, chat_burst=1, delete_rate=1000)
+        deletes = [scheduler.submit(1, _ok, priority=PRIORITY_CLEANUP, delete=True) for _ in range(20)]
+        await asyncio.gather(*deletes)
+        # Лимит чата не тронут: ответ пользователю уходит сразу
+        assert await asyncio.wait_for(scheduler.send(1, _ok), 1) is True
+        await scheduler.close()
+
+    run(scenario())
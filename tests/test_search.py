@@ -0,0 +1,36 @@
+"""Поиск товаров: основы слов и запасной поиск без FTS5"""
+import pytest
+
+import search
+from search import product_search, stem
+
+
+@pytest.mark.parametrize("forms", [
+    ("ягнёнок", "Ягнёнка", "ягненком"),
+    ("огурец", "огурца", "огурцы"),
+    ("цыпленок", "цыпленка"),
+    ("палец", "пальца"),
+    ("торт", "тортами"),
+])
+def test_fleeting_vowel_forms_share_stem(forms):
+    assert len({stem(word) for word in forms}) == 1
+
+
+def _names(run, query):
+    product_search.clear_cache()
+    result = run(product_search.search(query))
+    assert result["success"]
+    return sorted(item["name"] for item in result["items"])
+
+
+def test_oblique_case_finds_product(run, add_products):
+    add_products(("Ягнёнок сушеный", {}), ("Огурец хрустящий", {}), ("Печенье", {}))
+    assert _names(run, "ягнёнка") == ["Ягнёнок сушеный"]
+    assert _names(run, "огурцом") == ["Огурец хрустящий"]
+
+
+def test_fallback_treats_wildcards_literally(run, add_products, monkeypatch):
+    add_products(("Печенье 50% мяса", {}), ("Печенье", {}), ("Сушка_утка", {}), ("Сушка утка", {}))
+    monkeypatch.setattr(search, "IS_SQLITE", False)
+    assert _names(run, "50%") == ["Печенье 50% мяса"]
+    assert _names(run, "Сушка_") == ["Сушка_утка"]
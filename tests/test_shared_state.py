@@ -0,0 +1,291 @@
+"""
+Общее состояние в Redis: несколько процессов бота
+
+Процессы запускаются через multiprocessing (spawn) и подключаются
+к одному серверу fakeredis по TCP.
+"""
+import asyncio
+import multiprocessing
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # скрипты Lua (аренды) в fakeredis
+
+from shared_state import LeaseLostError, RedisBackend  # noqa: E402
+
+WORKERS = 4
+INCREMENTS = 25
+
+
+@pytest.fixture(scope="module")
+def redis_url():
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    yield f"redis://{host}:{port}/0"
+    server.shutdown()
+    server.server_close()
+
+
+def _spawn(target, *args):
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=target, args=args) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert [p.exitcode for p in processes] == [0] * WORKERS
+
+
+def _locked_increments(url):
+    async def work():
+        backend = RedisBackend(url, prefix="mp", lease_seconds=0.3)
+        for _ in range(INCREMENTS):
+            async with backend.lock("counter"):
+                # Чтение-изменение-запись: без взаимного исключения приращения теряются
+                value = int(await backend.redis.get("mp:value") or 0)
+                await asyncio.sleep(0.005)
+                await backend.redis.set("mp:value", value + 1)
+        await backend.close()
+
+    asyncio.run(work())
+
+
+def test_lease_excludes_other_processes(redis_url):
+    _spawn(_locked_increments, redis_url)
+
+    async def value():
+        backend = RedisBackend(redis_url, prefix="mp")
+        try:
+            return int(await backend.redis.get("mp:value"))
+        finally:
+            await backend.close()
+
+    assert asyncio.run(value()) == WORKERS * INCREMENTS
+
+
+def test_lease_is_renewed_while_held(redis_url):
+    async def scenario():
+        holder = RedisBackend(redis_url, prefix="renew", lease_seconds=0.2)
+        other = RedisBackend(redis_url, prefix="renew", lease_seconds=0.2, lock_timeout=0.3)
+        async with holder.lock("cart"):
+            # Держим в несколько раз дольше срока аренды - аренда продлевается
+            await asyncio.sleep(0.7)
+            with pytest.raises(TimeoutError):
+                async with other.lock("cart"):
+                    pass
+        async with other.lock("cart"):
+            pass
+        assert holder.leases_lost == 0
+        await holder.close()
+        await other.close()
+
+    asyncio.run(scenario())
+
+
+def test_lost_lease_fails_the_holder(redis_url):
+    async def scenario():
+        backend = RedisBackend(redis_url, prefix="lost", lease_seconds=0.3)
+        reached_end = False
+        with pytest.raises(LeaseLostError):
+            async with backend.lock("cart"):
+                # Аренду перехватил другой процесс (например, после паузы дольше срока)
+                await backend.redis.set("lost:lock:cart", "someone-else")
+                await asyncio.sleep(1)
+                reached_end = True
+        assert not reached_end
+        assert backend.leases_lost == 1
+        # Чужую аренду не освобождаем
+        assert await backend.redis.get("lost:lock:cart") == "someone-else"
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+def _change_catalog(url, product_id, price):
+    from catalog_cache import CatalogCache
+    from database import get_session, Product
+
+    async def work():
+        cache = CatalogCache(RedisBackend(url, prefix="catalog"))
+        await cache.start_sync(interval=60)
+        await cache.load()
+        async with get_session() as session:
+            product = await session.get(Product, product_id)
+            product.price = price
+        await cache.patch_product(product_id)
+        await cache.stop_sync()
+        await cache.backend.close()
+
+    asyncio.run(work())
+
+
+def test_catalog_change_reaches_other_processes(redis_url, add_products):
+    from catalog_cache import CatalogCache
+
+    _, (product_id,) = add_products(("Печенье", {"price": 100}))
+    ctx = multiprocessing.get_context("spawn")
+
+    async def scenario():
+        cache = CatalogCache(RedisBackend(redis_url, prefix="catalog"))
+        cleared = []
+        cache.add_listener(lambda: cleared.append(True))
+        await cache.start_sync(interval=0.05)
+        await cache.load()
+        version = cache.version
+
+        # Изменение в другом процессе
+        process = ctx.Process(target=_change_catalog, args=(redis_url, product_id, 250))
+        process.start()
+        await asyncio.to_thread(process.join, 60)
+        assert process.exitcode == 0
+
+        for _ in range(100):
+            if cache.remote_patches:
+                break
+            await asyncio.sleep(0.05)
+        await cache.stop_sync()
+        await cache.backend.close()
+        return cache, version, cleared
+
+    # Отдельный цикл: у клиента Redis и фоновой проверки версии свой цикл событий
+    cache, version, cleared = asyncio.run(scenario())
+    # Перечитан только измененный товар, а не весь каталог
+    assert cache.remote_patches == 1
+    assert cache.remote_reloads == 0
+    assert cleared == [True]
+    assert cache.version > version
+    assert cache.snapshot.products[product_id]["price"] == 250
+
+
+def test_catalog_sync_patches_products_and_reloads_only_when_needed(redis_url, add_products):
+    from catalog_cache import CatalogCache
+    from database import get_session, Product
+
+    _, (product_id, other_id) = add_products(("Печенье", {"price": 100}), ("Сушка", {"price": 50}))
+
+    async def set_price(pid, price):
+        async with get_session() as session:
+            product = await session.get(Product, pid)
+            product.price = price
+
+    async def published(cache):
+        await asyncio.gather(*cache._publish_tasks)
+
+    async def scenario():
+        seller = CatalogCache(RedisBackend(redis_url, prefix="sync"))
+        viewer = CatalogCache(RedisBackend(redis_url, prefix="sync"))
+        for cache in (seller, viewer):
+            await cache.start_sync(interval=60)
+            await cache.load()
+
+        # Продажа: другой процесс перечитывает один товар
+        await set_price(product_id, 150)
+        await seller.patch_product(product_id)
+        await published(seller)
+        assert await viewer.sync()
+        assert (viewer.remote_patches, viewer.remote_reloads) == (1, 0)
+        assert viewer.snapshot.products[product_id]["price"] == 150
+        # Свои изменения не перечитываются
+        assert not await seller.sync()
+        assert (seller.remote_patches, seller.remote_reloads) == (0, 0)
+
+        # Изменение категорий - полная загрузка
+        await seller.reload()
+        await published(seller)
+        assert await viewer.sync()
+        assert (viewer.remote_patches, viewer.remote_reloads) == (1, 1)
+
+        # Записи журнала потеряны (пропуск) - полная загрузка
+        await set_price(other_id, 70)
+        await seller.patch_product(other_id)
+        await published(seller)
+        await viewer.backend.redis.delete("sync:log:catalog")
+        assert await viewer.sync()
+        assert (viewer.remote_patches, viewer.remote_reloads) == (1, 2)
+        assert viewer.snapshot.products[other_id]["price"] == 70
+
+        for cache in (seller, viewer):
+            await cache.stop_sync()
+            await cache.backend.close()
+
+    asyncio.run(scenario())
+
+
+CART_STEPS = 5
+BUYERS = 5
+
+
+def _cart_and_checkout(url, worker, shared_users, buyers, cart_product, stock_product):
+    from services import cart_service, checkout_service
+
+    async def work():
+        backend = RedisBackend(url, prefix="mp-cart")
+        # Блокировки корзины - общие для всех процессов (как с REDIS_URL)
+        cart_service._locks = backend
+        # Одни и те же корзины из разных процессов: приращения не должны теряться
+        for _ in range(CART_STEPS):
+            for user_id in shared_users:
+                result = await cart_service.update_cart_quantity(user_id, cart_product, 100)
+                assert result["success"], result
+        # Свои покупатели: товара на всех не хватит
+        for user_id in buyers:
+            await cart_service.add_to_cart(user_id, stock_product, 100)
+            cart = await cart_service.get_cart(user_id)
+            items = [item for item in cart["items"] if item["product_id"] == stock_product]
+            await checkout_service.checkout(user_id, "Рекс", "@rex", "Белград", items, 100,
+                                            idempotency_key=("checkout", f"{worker}-{user_id}"))
+        await backend.close()
+
+    asyncio.run(work())
+
+
+def test_cart_and_checkout_from_several_processes(run, redis_url, add_products):
+    from sqlalchemy import func, select
+    from database import get_session, CartItem, Order, Product, User
+
+    _, (cart_product, stock_product) = add_products(
+        ("Печенье", {"stock_grams": 10 ** 6}), ("Сушка", {"stock_grams": 1500})
+    )
+
+    async def create_users(count):
+        async with get_session() as session:
+            users = [User(telegram_id=str(50_000 + i)) for i in range(count)]
+            session.add_all(users)
+            await session.flush()
+            return [u.id for u in users]
+
+    user_ids = run(create_users(3 + WORKERS * BUYERS))
+    shared_users, buyer_ids = user_ids[:3], user_ids[3:]
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_cart_and_checkout, args=(
+            redis_url, worker, shared_users, buyer_ids[worker * BUYERS:(worker + 1) * BUYERS],
+            cart_product, stock_product
+        ))
+        for worker in range(WORKERS)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+    assert [p.exitcode for p in processes] == [0] * WORKERS
+
+    async def stored():
+        async with get_session() as session:
+            quantities = (await session.execute(
+                select(CartItem.user_id, CartItem.quantity).where(CartItem.product_id == cart_product)
+            )).all()
+            orders = await session.scalar(select(func.count()).select_from(Order))
+            stock = await session.scalar(select(Product.stock_grams).where(Product.id == stock_product))
+            return dict(quantities), orders, stock
+
+    quantities, orders, stock = run(stored())
+    # Ни одно приращение корзины не потеряно
+    assert quantities == {user_id: WORKERS * CART_STEPS * 100 for user_id in shared_users}
+    # 1500 г по 100 г: ровно 15 заказов, остаток не уходит в минус
+    assert (orders, stock) == (15, 0)
@@ -0,0 +1,172 @@
+"""Временное состояние: размер хранилищ не растет с числом нажатий"""
+import asyncio
+import tracemalloc
+
+import pytest
+
+import state_store
+from state_store import ExpiringKeyedStore, LockManager
+
+TAPS = 1_000_000
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(state_store.time, "monotonic", clock)
+    return clock
+
+
+def _check_index(store: ExpiringKeyedStore) -> None:
+    """Индекс по пользователям совпадает с записями"""
+    indexed = {(user_id, key) for user_id, keys in store._by_user.items() for key in keys}
+    assert indexed == set(store._items)
+    assert all(store._by_user.values())
+
+
+def test_million_distinct_taps_stay_bounded():
+    store = ExpiringKeyedStore(ttl_seconds=3600, max_size=20_000)
+
+    for i in range(TAPS):
+        store.set(i % 50_000, i, i)
+
+    # Еще две серии по 100k нажатий под tracemalloc: после первой все записи
+    # хранилища уже отслеживаются, вторая не должна добавить памяти
+    tracemalloc.start()
+    try:
+        for i in range(TAPS, TAPS + 100_000):
+            store.set(i % 50_000, i, i)
+        before, _ = tracemalloc.get_traced_memory()
+        for i in range(TAPS + 100_000, TAPS + 200_000):
+            store.set(i % 50_000, i, i)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(store) == 20_000
+    assert store.stats()["users"] <= 20_000
+    _check_index(store)
+    # Остались самые свежие записи
+    last = TAPS + 200_000 - 1
+    assert store.get(last % 50_000, last) == last
+    assert store.get(0, 0) is None
+    # Допуск - на перестройку хэш-таблиц
+    assert after - before < 512 * 1024
+
+
+def test_expired_entries_are_purged(clock):
+    store = ExpiringKeyedStore(ttl_seconds=30, max_size=1000)
+    for product_id in range(100):
+        store.set(1, product_id, product_id)
+
+    clock.now += 20
+    store.set(2, "fresh", 1)
+    assert store.get(1, 5) == 5
+
+    clock.now += 15
+    assert store.get(1, 5) is None
+    # Просроченные записи удаляются при следующей записи, а не копятся
+    store.set(3, "next", 1)
+    assert len(store) == 2
+    _check_index(store)
+
+
+def test_set_extends_ttl_and_drop_user(clock):
+    store = ExpiringKeyedStore(ttl_seconds=30, max_size=1000)
+    store.set(1, "a", 1)
+    store.set(1, "b", 2)
+    store.set(2, "a", 3)
+
+    clock.now += 25
+    store.set(1, "a", 10)
+    clock.now += 10
+    assert store.user_items(1) == [("a", 10)]
+
+    assert store.drop_user(1) == 1
+    assert store.drop_user(1) == 0
+    assert store.user_items(2) == []
+    _check_index(store)
+
+
+def test_lock_manager_frees_idle_locks(run):
+    locks = LockManager()
+
+    async def taps():
+        for i in range(100_000):
+            async with locks.lock(("user", i)):
+                pass
+        assert len(locks) == 0
+
+        # Ожидающие держат блокировку в словаре, последний - удаляет
+        order = []
+
+        async def worker(n):
+            async with locks.lock("same"):
+                order.append(n)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(worker(n) for n in range(50)))
+        assert order == list(range(50))
+        assert len(locks) == 0
+
+    run(taps())
+
+
+def test_card_contexts_are_bounded_and_invalidated(run, monkeypatch):
+    import handlers
+    from catalog_cache import catalog_cache
+
+    loads = []
+
+    async def get_card(user_id, product_id):
+        loads.append(product_id)
+        return {"product": {"id": product_id}}
+
+    monkeypatch.setattr(handlers.product_card_service, "get_card", get_card)
+    contexts = handlers.card_contexts
+
+    async def taps():
+        for i in range(TAPS):
+            await handlers.get_card_for_taps(1, i % 100_000, i, i % 500)
+
+    run(taps())
+    assert len(contexts) == contexts.max_size
+    _check_index(contexts)
+
+    # Серия нажатий по одной карточке читает БД один раз
+    loads.clear()
+    for _ in range(10):
+        run(handlers.get_card_for_taps(1, 7, 555, 3))
+    assert loads == [3]
+
+    # Изменение каталога - карточка перечитывается
+    catalog_cache._next_version()
+    run(handlers.get_card_for_taps(1, 7, 555, 3))
+    assert loads == [3, 3]
+
+    # Выход из заказа/очистка корзины убирает контексты пользователя
+    run(handlers.clear_temp_quantities(7))
+    assert contexts.user_items(7) == []
+
+
+def test_temp_quantities_are_bounded(run):
+    from shared_state import LocalKeyedStore
+
+    store = LocalKeyedStore(ttl_seconds=3600, max_size=10_000)
+
+    async def taps():
+        for i in range(200_000):
+            await store.set(i % 30_000, i % 700, i)
+            await store.incr(i % 30_000, "taps")
+
+    run(taps())
+    assert store.stats()["items"] == 10_000
+    _check_index(store._store)
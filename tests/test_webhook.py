@@ -0,0 +1,104 @@
+"""Webhook: ограничение очереди принятых обновлений и остановка по SIGTERM"""
+import asyncio
+import datetime
+import os
+import signal
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update, User
+from aiohttp.test_utils import make_mocked_request
+
+import webhook
+from config import settings
+from webhook import LimitedRequestHandler
+
+
+class FakeSession(BaseSession):
+    """Сессия без сети: setWebhook и прочие методы возвращают True"""
+
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def _update(update_id: int) -> dict:
+    message = Message(message_id=update_id, date=datetime.datetime.now(), chat=Chat(id=1, type="private"),
+                      from_user=User(id=1, is_bot=False, first_name="test"), text="hi")
+    return Update(update_id=update_id, message=message).model_dump(mode="json", exclude_none=True)
+
+
+def _slow_dispatcher(done: list) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def slow(message: Message):
+        await asyncio.sleep(0.3)
+        done.append(message.message_id)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def test_backlog_over_limit_gets_429(run):
+    async def scenario():
+        done = []
+        bot = Bot("42:TEST", session=FakeSession())
+        handler = LimitedRequestHandler(_slow_dispatcher(done), bot, max_concurrency=1, max_backlog=2)
+        for update_id in (1, 2):
+            task = asyncio.create_task(handler._background_feed_update(bot, _update(update_id)))
+            handler._background_feed_update_tasks.add(task)
+            task.add_done_callback(handler._background_feed_update_tasks.discard)
+
+        response = await handler.handle(make_mocked_request("POST", "/webhook"))
+        assert response.status == 429
+        assert handler.stats()["rejected"] == 1
+
+        await handler.drain()
+        return done
+
+    assert run(scenario()) == [1, 2]
+
+
+def test_sigterm_drains_accepted_updates(run, monkeypatch):
+    monkeypatch.setattr(settings, "webapp_host", "127.0.0.1")
+    monkeypatch.setattr(settings, "webapp_port", 0)
+    monkeypatch.setattr(settings, "webhook_url", "https://example.com")
+    apps = []
+    create_app = webhook.create_app
+
+    def capture(*args):
+        app = create_app(*args)
+        apps.append(app)
+        return app
+
+    monkeypatch.setattr(webhook, "create_app", capture)
+
+    async def scenario():
+        done = []
+        bot = Bot("42:TEST", session=FakeSession())
+        server = asyncio.create_task(webhook.run_webhook(_slow_dispatcher(done), bot))
+        while not apps:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+
+        # Обновление принято (Telegram получил 200) и еще обрабатывается
+        handler = apps[0]["webhook_handler"]
+        task = asyncio.create_task(handler._background_feed_update(bot, _update(7)))
+        handler._background_feed_update_tasks.add(task)
+        task.add_done_callback(handler._background_feed_update_tasks.discard)
+        await asyncio.sleep(0)
+
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(server, timeout=10)
+        return done, handler.stats()
+
+    done, stats = run(scenario())
+    assert done == [7]
+    assert stats["closing"] and stats["in_flight"] == 0
@@ -0,0 +1,175 @@
+"""
+Режим webhook для Barkery Shop
+
+Обновления принимает aiohttp-сервер через интеграцию aiogram.
+Запросы проверяются по секретному токену, одновременная обработка
+ограничена семафором, а очередь принятых обновлений - max_backlog
+(сверх него Telegram получает 429 и повторит доставку позже). По SIGTERM
+или SIGINT (docker stop, перезапуск на хостинге) сервер перестает
+принимать новые обновления и дожидается обработки уже принятых.
+"""
+import asyncio
+import logging
+import secrets
+import signal
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import settings
+from metrics import metrics_exporter
+from outbound import outbound
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Обработчик webhook с ограничением параллельности и плавной остановкой"""
+
+    def __init__(
+            self,
+            dispatcher: Dispatcher,
+            bot: Bot,
+            max_concurrency: int = 32,
+            max_backlog: int = 1000,
+            drain_timeout: float = 15,
+            secret_token: Optional[str] = None,
+            **data: Any
+    ):
+        super().__init__(
+            dispatcher=dispatcher,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=secret_token,
+            **data
+        )
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_backlog = max(self.max_concurrency, max_backlog)
+        self.drain_timeout = drain_timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._closing = False
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        # Telegram уже получил ответ 200, здесь ограничиваем только обработку
+        async with self._semaphore:
+            try:
+                await super()._background_feed_update(bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._closing:
+            # Telegram повторит доставку, когда бот снова поднимется
+            return web.Response(text="Shutting down", status=503)
+        if len(self._background_feed_update_tasks) >= self.max_backlog:
+            # Не копим обновления в памяти: Telegram повторит доставку позже
+            self.rejected += 1
+            return web.Response(text="Too many pending updates", status=429)
+        return await super().handle(request)
+
+    __call__ = handle
+
+    async def drain(self) -> None:
+        """Перестать принимать обновления и дождаться обработки принятых"""
+        self._closing = True
+        pending = set(self._background_feed_update_tasks)
+        if not pending:
+            return
+
+        logger.info(f"Ожидание обработки {len(pending)} обновлений (до {self.drain_timeout} с)")
+        done, not_done = await asyncio.wait(pending, timeout=self.drain_timeout)
+        if not_done:
+            logger.warning(f"Не дождались {len(not_done)} обновлений, отменяем")
+            for task in not_done:
+                task.cancel()
+            await asyncio.gather(*not_done, return_exceptions=True)
+
+    async def close(self) -> None:
+        """Дождаться обработки обновлений и отправки ответов, затем закрыть сессию бота"""
+        await self.drain()
+        await outbound.close()
+        await super().close()
+
+    def stats(self) -> Dict:
+        """Состояние обработчика"""
+        return {
+            "in_flight": len(self._background_feed_update_tasks),
+            "max_concurrency": self.max_concurrency,
+            "max_backlog": self.max_backlog,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "closing": self._closing
+        }
+
+
+def create_app(dp: Dispatcher, bot: Bot, secret_token: str) -> web.Application:
+    """Собрать aiohttp-приложение с маршрутом webhook"""
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        max_concurrency=settings.webhook_max_concurrency,
+        max_backlog=settings.webhook_max_backlog,
+        drain_timeout=settings.webhook_drain_timeout,
+        secret_token=secret_token
+    )
+    handler.register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+    app["webhook_handler"] = handler
+    metrics_exporter.attach(webhook_handler=handler)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Запустить сервер webhook и работать до SIGTERM/SIGINT или отмены"""
+    # Без заданного секрета генерируем случайный на время жизни процесса
+    secret_token = settings.webhook_secret or secrets.token_urlsafe(32)
+    app = create_app(dp, bot, secret_token)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.webapp_host, port=settings.webapp_port)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    signals = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            signals.append(sig)
+        except (NotImplementedError, RuntimeError):
+            # Windows или не главный поток - остановка только отменой задачи
+            pass
+
+    try:
+        await site.start()
+        webhook_url = settings.webhook_url.rstrip("/") + settings.webhook_path
+        await bot.set_webhook(
+            url=webhook_url,
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=min(100, max(1, settings.webhook_max_concurrency))
+        )
+        logger.info(
+            f"🌐 Webhook: {webhook_url}, сервер {settings.webapp_host}:{settings.webapp_port}, "
+            f"параллельность {settings.webhook_max_concurrency}"
+        )
+        await stop.wait()
+        logger.info("⏹️ Получен сигнал остановки")
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        # Пока сервер слушает, новые обновления получают 503 и придут повторно;
+        # принятые дообрабатываются. Webhook не удаляем: Telegram придержит
+        # обновления до перезапуска
+        await app["webhook_handler"].drain()
+        await runner.cleanup()
+        logger.info("⏹️ Сервер webhook остановлен")